@@ -101,6 +101,105 @@ if platform.system() == 'Windows':
         os.environ['PATH'] = CONDA_BIN_PATH + os.pathsep + os.environ.get('PATH', '')
         GDAL_LIBRARY_PATH = os.path.join(CONDA_BIN_PATH, 'gdal.dll') 
 
+# Импорт данных о движении ТС: сколько позиций записывать в БД за одну транзакцию
+BUS_DATA_IMPORT_BATCH_SIZE = 5000
+# Способ записи позиций: 'orm' (bulk_create) или 'copy' (COPY через временную таблицу, быстрее)
+BUS_DATA_IMPORT_LOADER = 'orm'
+# Сколько процессов разбирают файлы маршрутов при импорте из sorted_routes (1 — последовательно);
+# в воркере django-q файлы раздаются стольким же задачам django-q
+BUS_DATA_IMPORT_WORKERS = min(4, os.cpu_count() or 1)
+# Импорт из sorted_routes через журнал: пропуск уже загруженных файлов и позиций старше отметки маршрута
+BUS_DATA_IMPORT_INCREMENTAL = True
+
+# Каталог, куда сохраняются файлы, загруженные через /api/upload-bus-data/, до их фонового импорта
+BUS_DATA_INGEST_SPOOL_DIR = BASE_DIR / 'data_processing_files' / 'uploads'
+
+# Секционирование таблицы позиций ТС: гранулярность ('day' или 'month'),
+# сколько секций создавать заранее и срок хранения в днях (None — бессрочно)
+VEHICLE_POSITION_PARTITION_INTERVAL = 'month'
+VEHICLE_POSITION_PARTITIONS_AHEAD = 2
+VEHICLE_POSITION_RETENTION_DAYS = None
+# Позиции старше стольких дней (битые метки времени) ложатся в секцию по умолчанию, секции для них не создаются
+VEHICLE_POSITION_PARTITION_MAX_AGE_DAYS = 3650
+
+# Размер страницы /api/vehicle-positions/ (клиент может запросить ?page_size= до максимума)
+VEHICLE_POSITIONS_PAGE_SIZE = 500
+VEHICLE_POSITIONS_MAX_PAGE_SIZE = 5000
+
+# Сбор меток ТС: шаг опроса и случайный сдвиг (сек), маршрутов в одном запросе,
+# размер пула соединений, таймаут запроса и предел задержки после ошибок (сек)
+BUS_COLLECTOR_INTERVAL = 10
+BUS_COLLECTOR_JITTER = 5
+BUS_COLLECTOR_SHARD_SIZE = 40
+BUS_COLLECTOR_MAX_CONNECTIONS = 8
+BUS_COLLECTOR_TIMEOUT = 15
+BUS_COLLECTOR_BACKOFF_MAX = 60
+
+# Режим сбора по умолчанию: 'files' (сырые файлы -> очистка -> sorted_routes) или
+# 'stream' (сразу в БД, позиции сбрасываются не реже чем раз в BUS_DATA_STREAM_FLUSH_INTERVAL сек)
+BUS_COLLECTION_MODE = 'files'
+BUS_DATA_STREAM_FLUSH_INTERVAL = 5
+
+# Очистка сырых данных: объем строк (байт) для сортировки в памяти, сверх него — внешняя сортировка
+BUS_DATA_DEDUP_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# Рейсы: разрыв в данных (сек), стоянка (сек) в радиусе (м), после которых начинается новый рейс,
+# и допуск упрощения траектории алгоритмом Дугласа—Пекера (м)
+BUS_TRIP_GAP_SECONDS = 600
+BUS_TRIP_DWELL_SECONDS = 300
+BUS_TRIP_DWELL_RADIUS = 30
+BUS_TRIP_SIMPLIFY_TOLERANCE = 10.0
+
+# Привязка позиций к геометрии маршрутов: предельное отклонение от маршрута (м)
+# и сколько точек проецировать за раз
+BUS_MATCH_MAX_DISTANCE = 150
+BUS_MATCH_CHUNK_SIZE = 50000
+
+# Прохождения остановок: радиус стоянки у остановки вдоль маршрута (м), наибольший разрыв
+# между позициями для интерполяции (сек), наибольшая скорость вдоль маршрута (км/ч) и число
+# остановок, которые можно пройти за один шаг (быстрее и дальше — скачок привязки),
+# перекрытие инкрементальных запусков (сек) и наибольший интервал движения, который еще
+# входит в статистику (сек)
+BUS_ARRIVAL_RADIUS = 40
+BUS_ARRIVAL_MAX_GAP = 180
+BUS_ARRIVAL_MAX_SPEED = 120
+BUS_ARRIVAL_MAX_STOPS_PER_STEP = 3
+BUS_ARRIVAL_LOOKBACK = 1800
+BUS_HEADWAY_MAX = 7200
+
+# Время в пути по соединениям: длина интервала суток (мин), ширина корзины гистограммы (сек),
+# наибольшее время проезда, которое еще считается поездкой (сек), и сколько проездов нужно,
+# чтобы заменить Connection.travel_time наблюдаемой медианой
+BUS_TRAVEL_TIME_BUCKET_MINUTES = 60
+BUS_TRAVEL_TIME_BIN_SECONDS = 15
+BUS_TRAVEL_TIME_MAX_SECONDS = 1800
+BUS_TRAVEL_TIME_MIN_COUNT = 20
+
+# Планировщик поездок: скорость (км/ч) для соседних остановок маршрута без соединения
+BUS_PLAN_DEFAULT_SPEED = 20
+
+# Индекс остановок в памяти: размер ячейки сетки (м) и наибольшее число точек в пакетном запросе
+BUS_STOP_INDEX_CELL = 250
+BUS_STOP_BULK_MAX_POINTS = 10000
+
+# Векторные тайлы: до какого масштаба точки объединяются в кластеры, размер кластера
+# (в единицах тайла из 4096) и каталог дискового кэша (None — без кэша)
+BUS_TILE_CLUSTER_MAX_ZOOM = 14
+BUS_TILE_CLUSTER_PIXELS = 128
+BUS_TILE_CACHE_DIR = BASE_DIR / 'data_processing_files' / 'tiles'
+
+# Тепловая карта: размер ячейки (м в проекции Web Mercator) и корзины гистограммы скоростей (км/ч),
+# интервал запроса без from и наибольший интервал запроса (сутки)
+BUS_HEATMAP_CELL_SIZE = 250
+BUS_HEATMAP_SPEED_BIN = 5
+BUS_HEATMAP_SPEED_MAX = 120
+BUS_HEATMAP_DEFAULT_DAYS = 7
+BUS_HEATMAP_MAX_DAYS = 31
+
+# Сводки по маршрутам и ТС: скорость (км/ч), выше которой шаг между позициями считается
+# скачком координат и не входит в пройденное расстояние
+BUS_ROLLUP_MAX_SPEED = 150
+
 # Django Q settings
 Q_CLUSTER = {
     'name': 'DjangORM',
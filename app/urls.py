@@ -2,15 +2,17 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from project.views import ShowProjectView
+from project.views import ShowProjectView, TileView
 from project.api import (
     ProjectViewSet, TransportTypeViewSet, StopViewSet,
     RouteViewSet, RouteStopViewSet, ConnectionViewSet,
-    FileUploadView, BusDataUploadAPIView,
-    VehicleViewSet, VehiclePositionViewSet,
+    FileUploadView, BusDataUploadAPIView, IngestJobViewSet,
+    VehicleViewSet, VehiclePositionViewSet, TripViewSet, StopArrivalViewSet, RouteHeadwayStatsViewSet,
     StopsExportCSVView, RoutePositionsExportCSVView,
     StopsExportGeoJSONView,
-    RoutePositionsExportJSONView,
+    RoutePositionsExportJSONView, PositionsExportColumnarView,
+    JourneyPlanView, HeatmapView,
+    RouteActivityRollupViewSet, VehicleActivityRollupViewSet, FleetStatsView,
     StartCollectionPipelineView, StartImportPipelineView, DeleteMonitoringDataView    # <-- Импортируем правильный View
 )
 
@@ -24,12 +26,30 @@ router.register(r'route-stops', RouteStopViewSet, basename='route-stops')
 router.register(r'connections', ConnectionViewSet, basename='connections')
 router.register(r'vehicles', VehicleViewSet, basename='vehicles')
 router.register(r'vehicle-positions', VehiclePositionViewSet, basename='vehicle-positions')
+router.register(r'trips', TripViewSet, basename='trips')
+router.register(r'stop-arrivals', StopArrivalViewSet, basename='stop-arrivals')
+router.register(r'headway-stats', RouteHeadwayStatsViewSet, basename='headway-stats')
+router.register(r'stats/routes', RouteActivityRollupViewSet, basename='stats-routes')
+router.register(r'stats/vehicles', VehicleActivityRollupViewSet, basename='stats-vehicles')
+router.register(r'ingest-jobs', IngestJobViewSet, basename='ingest-jobs')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', ShowProjectView.as_view(), name='show_project'),
     path('api/', include(router.urls)),
     
+    # Векторные тайлы карты
+    path('tiles/<slug:layer>/<int:z>/<int:x>/<int:y>.mvt', TileView.as_view(), name='tile'),
+
+    # Тепловая карта позиций и скоростей
+    path('api/heatmap/', HeatmapView.as_view(), name='heatmap'),
+
+    # Показатели всего парка по сводкам
+    path('api/stats/fleet/', FleetStatsView.as_view(), name='stats_fleet'),
+
+    # Поиск поездки между остановками
+    path('api/plan/', JourneyPlanView.as_view(), name='journey_plan'),
+
     # URL для импорта
     path('api/upload-geojson/', FileUploadView.as_view(), name='upload_geojson'),
     path('api/upload-bus-data/', BusDataUploadAPIView.as_view(), name='upload_bus_data'),
@@ -42,6 +62,9 @@ urlpatterns = [
     path('api/export/route-positions/<int:route_id>/csv/', RoutePositionsExportCSVView.as_view(), name='export-route-positions-csv'),
     path('api/export/route-positions/<int:route_id>/json/', RoutePositionsExportJSONView.as_view(), name='export-route-positions-json'),
 
+    # Колоночный экспорт истории позиций (Parquet / Arrow IPC) для аналитики
+    path('api/export/positions/columnar/', PositionsExportColumnarView.as_view(), name='export-positions-columnar'),
+
     path('api/start-collection-pipeline/', StartCollectionPipelineView.as_view(), name='start_collection_pipeline'),
     path('api/start-import-pipeline/', StartImportPipelineView.as_view(), name='start_import_pipeline'),
     
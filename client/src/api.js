@@ -47,6 +47,26 @@ export const getVehiclePositions = (vehicleId = null, routeId = null) => {
     if (routeId) params.append('route_id', routeId);
     return apiClient.get(`vehicle-positions/?${params.toString()}`);
 };
+// Где сейчас каждый ТС (снимок последних позиций), с необязательными фильтрами
+export const getLiveVehicles = (routeId = null, bbox = null) => {
+    const params = new URLSearchParams();
+    if (routeId) params.append('route_id', routeId);
+    if (bbox) params.append('bbox', bbox.join(','));
+    return apiClient.get(`vehicles/live/?${params.toString()}`);
+};
+// Позиции отдаются страницами: next — полная ссылка на следующую страницу (или null)
+export const getVehiclePositionsPage = (nextUrl) => apiClient.get(nextUrl);
+// Вся история позиций маршрута (проход по страницам) в плоском виде: vehicle — id ТС
+export const getAllRoutePositions = async (routeId, fields = 'timestamp,latitude,longitude,vehicle') => {
+    const params = new URLSearchParams({ route_id: routeId, flat: '1', fields });
+    let response = await apiClient.get(`vehicle-positions/?${params.toString()}`);
+    const positions = [...response.data.results];
+    while (response.data.next) {
+        response = await getVehiclePositionsPage(response.data.next);
+        positions.push(...response.data.results);
+    }
+    return positions;
+};
 
 // --- File Uploads ---
 export const uploadGeoJSONFile = (file) => {
@@ -67,6 +87,9 @@ export const uploadBusDataFiles = (files) => {
     });
 };
 
+// Состояние фонового импорта загруженных файлов
+export const getIngestJob = (jobId) => apiClient.get(`ingest-jobs/${jobId}/`);
+
 // --- Функции для экспорта данных ---
 
 function downloadFile(response, defaultFilename) {
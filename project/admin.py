@@ -3,7 +3,10 @@
 from django.contrib import admin
 from django.contrib.gis.admin import OSMGeoAdmin # <-- ИСПРАВЛЕНИЕ: Прямой импорт OSMGeoAdmin
 from .models import (
-    Project, TransportType, Stop, Route, RouteStop, Connection, Vehicle, VehiclePosition
+    Project, TransportType, Stop, Route, RouteStop, Connection, Vehicle, VehiclePosition,
+    VehicleLastPosition, IngestedFile, RouteImportWatermark, IngestJob, Trip, RouteShape,
+    AnalyticsWatermark, IndexVersion, PositionChange, StopArrival, RouteHeadwayStats, ConnectionTravelTime, PositionDensityCell,
+    RouteActivityRollup, VehicleActivityRollup
 )
 
 @admin.register(Project)
@@ -64,4 +67,96 @@ class VehiclePositionAdmin(OSMGeoAdmin):
     # OSMGeoAdmin автоматически подхватит поле 'location' для карты
     default_lat = 52.28
     default_lon = 104.30
-    default_zoom = 11
\ No newline at end of file
+    default_zoom = 11
+
+@admin.register(VehicleLastPosition)
+class VehicleLastPositionAdmin(OSMGeoAdmin):
+    list_display = ('vehicle', 'route', 'timestamp', 'speed')
+    list_filter = ('route',)
+    search_fields = ('vehicle__gos_num',)
+    default_lat = 52.28
+    default_lon = 104.30
+    default_zoom = 11
+
+@admin.register(IngestedFile)
+class IngestedFileAdmin(admin.ModelAdmin):
+    list_display = ('name', 'imported_at', 'positions_created', 'size')
+    search_fields = ('name', 'digest')
+    readonly_fields = ('digest', 'imported_at')
+
+@admin.register(RouteImportWatermark)
+class RouteImportWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('route', 'last_timestamp', 'updated_at')
+    search_fields = ('route__name',)
+
+@admin.register(IngestJob)
+class IngestJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'files_done', 'files_total', 'positions_created', 'created_at', 'finished_at')
+    list_filter = ('status',)
+
+@admin.register(Trip)
+class TripAdmin(OSMGeoAdmin):
+    list_display = ('vehicle', 'route', 'start_time', 'end_time', 'points_total', 'distance')
+    list_filter = ('route',)
+    search_fields = ('vehicle__gos_num',)
+    readonly_fields = ('time_deltas',)
+    default_lat = 52.28
+    default_lon = 104.30
+    default_zoom = 11
+
+@admin.register(RouteShape)
+class RouteShapeAdmin(OSMGeoAdmin):
+    list_display = ('route', 'length', 'built_at')
+    search_fields = ('route__name',)
+    readonly_fields = ('stop_ids', 'stop_offsets', 'signature', 'built_at')
+    default_lat = 52.28
+    default_lon = 104.30
+    default_zoom = 11
+
+@admin.register(StopArrival)
+class StopArrivalAdmin(admin.ModelAdmin):
+    list_display = ('vehicle', 'route', 'stop', 'arrival_time', 'departure_time', 'dwell')
+    list_filter = ('route',)
+    search_fields = ('vehicle__gos_num', 'stop__name')
+
+@admin.register(RouteHeadwayStats)
+class RouteHeadwayStatsAdmin(admin.ModelAdmin):
+    list_display = ('route', 'hour', 'arrivals', 'vehicles', 'headway_mean', 'headway_p90', 'dwell_mean')
+    list_filter = ('route',)
+
+@admin.register(ConnectionTravelTime)
+class ConnectionTravelTimeAdmin(admin.ModelAdmin):
+    list_display = ('connection', 'bucket', 'count', 'p50', 'p85', 'p95', 'updated_at')
+    list_select_related = ('connection__from_stop', 'connection__to_stop')
+    exclude = ('histogram',)
+
+@admin.register(PositionDensityCell)
+class PositionDensityCellAdmin(admin.ModelAdmin):
+    list_display = ('route', 'hour', 'cell_x', 'cell_y', 'count', 'mean_speed')
+    list_filter = ('route',)
+    exclude = ('speed_histogram',)
+
+@admin.register(RouteActivityRollup)
+class RouteActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ('route', 'period', 'start', 'vehicles', 'samples', 'distance', 'max_speed')
+    list_filter = ('period', 'route')
+
+@admin.register(VehicleActivityRollup)
+class VehicleActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ('vehicle', 'period', 'start', 'routes', 'samples', 'distance', 'max_speed')
+    list_filter = ('period',)
+    search_fields = ('vehicle__gos_num',)
+
+@admin.register(AnalyticsWatermark)
+class AnalyticsWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('stage', 'route', 'processed_until', 'updated_at')
+    list_filter = ('stage',)
+
+@admin.register(IndexVersion)
+class IndexVersionAdmin(admin.ModelAdmin):
+    list_display = ('name', 'version')
+
+@admin.register(PositionChange)
+class PositionChangeAdmin(admin.ModelAdmin):
+    list_display = ('stage', 'route', 'vehicle', 'since', 'until', 'revision')
+    list_filter = ('stage',)
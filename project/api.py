@@ -1,28 +1,69 @@
-import csv
 import json
 import traceback
 
-from django.http import HttpResponse, JsonResponse
-from django.contrib.gis.geos import Point, GEOSGeometry
+import tempfile
+
+import numpy as np
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+from django.contrib.gis.geos import Point, GEOSGeometry, Polygon
 from django.db import models
 
 from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from .models import (
-    Connection, Project, Route, RouteStop, Stop, TransportType, Vehicle,
+    AnalyticsWatermark, Connection, ConnectionTravelTime, IngestedFile, IngestJob, PositionChange, PositionDensityCell,
+    Project, Route,
+    RouteActivityRollup, RouteHeadwayStats, RouteImportWatermark, ROLLUP_DAY, ROLLUP_HOUR,
+    RouteStop, Stop, StopArrival, TransportType, Trip, Vehicle, VehicleActivityRollup, VehicleLastPosition,
     VehiclePosition
 )
 from .serializers import (
-    ConnectionSerializer, ProjectSerializer, RouteSerializer,
-    RouteStopSerializer, StopSerializer, TransportTypeSerializer,
-    VehiclePositionSerializer, VehicleSerializer
+    ConnectionSerializer, ConnectionTravelTimeSerializer, IngestJobSerializer, ProjectSerializer, RouteSerializer,
+    RouteActivityRollupSerializer, RouteHeadwayStatsSerializer, RouteStopSerializer, StopArrivalSerializer,
+    StopSerializer, TransportTypeSerializer, TripSerializer, VehicleActivityRollupSerializer,
+    VehicleLastPositionSerializer, VehiclePositionFlatSerializer, VehiclePositionSerializer, VehicleSerializer
+)
+from .exports import (
+    COLUMNAR_FORMATS, ColumnarExportUnavailable, iter_route_positions_csv, iter_route_positions_json,
+    iter_stops_csv, iter_stops_geojson, write_positions_columnar
+)
+from .pagination import (
+    HourlyStatsCursorPagination, KeysetCursorPagination, RollupCursorPagination, StopArrivalCursorPagination,
+    TripCursorPagination
 )
-from .services import import_bus_data_from_files
+from .partitioning import drop_partitions_before, truncate_positions
+from .ingest import spool_uploads
+from .matching import get_route_shape
+from .planner import get_graph
+from .stop_index import get_stop_index
+from .params import parse_time_param
+from .tiles import DENSITY_TILES, POSITION_LAYERS, invalidate_tiles
+from .heatmap import HEATMAP_CELL_SIZE, HEATMAP_MAX_DAYS, heatmap, heatmap_window
+from .rollups import ROLLUP_STAGE
+from .travel_times import TRAVEL_TIME_STAGE
 from django_q.tasks import async_task
 
 
+def _parse_bbox_param(value):
+    """Разбирает bbox=min_lon,min_lat,max_lon,max_lat в прямоугольник (SRID 4326). Некорректное значение -> None."""
+    if not value:
+        return None
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in value.split(','))
+    except ValueError:
+        return None
+    if min_lon > max_lon or min_lat > max_lat:
+        return None
+    bbox = Polygon.from_bbox((min_lon, min_lat, max_lon, max_lat))
+    bbox.srid = 4326
+    return bbox
+
+
 class ProjectViewSet(viewsets.ModelViewSet):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
@@ -31,6 +72,38 @@ class TransportTypeViewSet(viewsets.ModelViewSet):
     queryset = TransportType.objects.all()
     serializer_class = TransportTypeSerializer
 
+# Ограничения запросов ближайших остановок
+NEAREST_STOPS_MAX = 100
+NEAREST_BULK_MAX_POINTS = getattr(settings, 'BUS_STOP_BULK_MAX_POINTS', 10000)
+
+
+def _float_param(params, name, required=True, positive=False):
+    """Числовой параметр запроса; отсутствующий обязательный или некорректный — ошибка 400."""
+    value = params.get(name)
+    if value in (None, '') and not required:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        number = None
+    if number is None or not np.isfinite(number) or (positive and number <= 0):
+        raise ValidationError({name: f"Некорректное значение параметра '{name}'."})
+    return number
+
+
+def _int_param(params, name, default, maximum):
+    value = params.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        number = 0
+    if not 1 <= number <= maximum:
+        raise ValidationError({name: f"Параметр '{name}' должен быть от 1 до {maximum}."})
+    return number
+
+
 class StopViewSet(viewsets.ModelViewSet):
     """API для управления Остановками (поддерживает пространственный фильтр ?polygon=WKT)"""
     queryset = Stop.objects.all()
@@ -42,15 +115,76 @@ class StopViewSet(viewsets.ModelViewSet):
         if polygon_wkt:
             try:
                 poly = GEOSGeometry(polygon_wkt)
-                qs = qs.filter(location__within=poly)
             except Exception:
-                pass # Игнорируем некорректные полигоны
+                raise ValidationError({'polygon': "Некорректное значение параметра 'polygon'."})
+            qs = qs.filter(location__within=poly)
         return qs
 
+    @action(detail=False, url_path='nearest')
+    def nearest(self, request):
+        """
+        Ближайшие остановки к точке по индексу в памяти процесса: ?lon=&lat=&n=5[&radius=м].
+        Расстояние (м) — в локальной метрической проекции.
+        """
+        lon, lat = _float_param(request.query_params, 'lon'), _float_param(request.query_params, 'lat')
+        count = _int_param(request.query_params, 'n', default=5, maximum=NEAREST_STOPS_MAX)
+        radius = _float_param(request.query_params, 'radius', required=False, positive=True)
+        index = get_stop_index()
+        return Response([index.describe(*found) for found in index.nearest(lon, lat, count, radius)])
+
+    @action(detail=False, url_path='within')
+    def within(self, request):
+        """Остановки в радиусе от точки по возрастанию расстояния: ?lon=&lat=&radius=м."""
+        lon, lat = _float_param(request.query_params, 'lon'), _float_param(request.query_params, 'lat')
+        radius = _float_param(request.query_params, 'radius', positive=True)
+        index = get_stop_index()
+        return Response([index.describe(*found) for found in index.within(lon, lat, radius)])
+
+    @action(detail=False, methods=['post'], url_path='nearest-bulk')
+    def nearest_bulk(self, request):
+        """
+        Ближайшие остановки для многих точек за один запрос.
+        Тело: {"points": [[lon, lat], ...], "n": 1, "radius": м (необязательно)}.
+        Ответ: {"results": [[{id, distance}, ...], ...]} в порядке точек.
+        """
+        points = request.data.get('points')
+        try:
+            lon, lat = np.array(points, dtype=np.float64).reshape(-1, 2).T
+        except (TypeError, ValueError):
+            raise ValidationError({'points': "Ожидается список пар [lon, lat]."})
+        if not (np.isfinite(lon).all() and np.isfinite(lat).all()):
+            raise ValidationError({'points': "Ожидается список пар [lon, lat]."})
+        if len(lon) > NEAREST_BULK_MAX_POINTS:
+            raise ValidationError({'points': f"Не больше {NEAREST_BULK_MAX_POINTS} точек за запрос."})
+        count = _int_param(request.data, 'n', default=1, maximum=NEAREST_STOPS_MAX)
+        radius = _float_param(request.data, 'radius', required=False, positive=True)
+        index = get_stop_index()
+        return Response({'results': [
+            [{'id': int(index.stop_ids[found]), 'distance': round(distance, 1)} for found, distance in point]
+            for point in index.nearest_many(lon, lat, count, radius)
+        ]})
+
 class RouteViewSet(viewsets.ModelViewSet):
     queryset = Route.objects.all()
     serializer_class = RouteSerializer
 
+    @action(detail=True, url_path='shape')
+    def shape(self, request, pk=None):
+        """
+        Геометрия маршрута по порядку остановок: вершины [lon, lat], длина и расстояние
+        от начала маршрута до каждой остановки (м). 404, если остановок с координатами меньше двух.
+        """
+        route = self.get_object()
+        shape = get_route_shape(route.pk)
+        if shape is None:
+            return Response({"error": "У маршрута меньше двух остановок с координатами."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            "route": route.pk,
+            "length": shape.length,
+            "coordinates": [list(point) for point in shape.path.coords],
+            "stops": [{"stop": stop_id, "offset": offset} for stop_id, offset in zip(shape.stop_ids, shape.stop_offsets)],
+        })
+
 class RouteStopViewSet(viewsets.ModelViewSet):
     queryset = RouteStop.objects.all()
     serializer_class = RouteStopSerializer
@@ -59,25 +193,114 @@ class ConnectionViewSet(viewsets.ModelViewSet):
     queryset = Connection.objects.all()
     serializer_class = ConnectionSerializer
 
+    @action(detail=True, url_path='travel-times')
+    def travel_times(self, request, pk=None):
+        """
+        Наблюдаемое время в пути по соединению (сек) по интервалам суток: число проездов,
+        среднее, медиана, 85-й и 95-й процентили. travel_time — значение, заданное в соединении (мин).
+        """
+        connection = self.get_object()
+        return Response({
+            "connection": connection.pk,
+            "travel_time": connection.travel_time,
+            "buckets": ConnectionTravelTimeSerializer(connection.travel_times.all(), many=True).data,
+        })
+
 class VehicleViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Vehicle.objects.all().order_by('gos_num')
     serializer_class = VehicleSerializer
 
+    @action(detail=False, url_path='live')
+    def live(self, request):
+        """
+        Где сейчас каждый ТС: читает снимок VehicleLastPosition (одна строка на ТС), а не историю.
+        Фильтры: ?route_id=, ?bbox=min_lon,min_lat,max_lon,max_lat.
+        """
+        queryset = VehicleLastPosition.objects.select_related('vehicle').order_by('vehicle__gos_num')
+        route_id = request.query_params.get('route_id')
+        bbox = _parse_bbox_param(request.query_params.get('bbox'))
+        if request.query_params.get('bbox') and bbox is None:
+            raise ValidationError({'bbox': "Некорректное значение параметра 'bbox'."})
+        if route_id:
+            queryset = queryset.filter(route_id=route_id)
+        if bbox:
+            queryset = queryset.filter(location__bboverlaps=bbox)
+        return Response(VehicleLastPositionSerializer(queryset, many=True).data)
+
 class VehiclePositionViewSet(viewsets.ReadOnlyModelViewSet):
-    """API для получения списка позиций ТС с фильтрацией (в т.ч. пространственной)."""
+    """
+    API для получения списка позиций ТС с фильтрацией (в т.ч. пространственной).
+    Параметры from/to (ISO 8601) ограничивают интервал времени, и PostgreSQL читает только нужные секции таблицы;
+    bbox=min_lon,min_lat,max_lon,max_lat — быстрый фильтр по прямоугольнику через GiST-индекс.
+    Список отдается страницами по курсору (timestamp, id): ссылка на следующую страницу — в поле next.
+    ?fields=id,timestamp,latitude,longitude оставляет только нужные поля,
+    ?flat=1 заменяет вложенные ТС и маршрут их id и избавляет запрос от JOIN.
+    """
     serializer_class = VehiclePositionSerializer
+    pagination_class = KeysetCursorPagination
+
+    # Какие столбцы модели нужны для каждого поля ответа
+    FIELD_COLUMNS = {
+        'id': 'id', 'timestamp': 'timestamp', 'location': 'location',
+        'latitude': 'location', 'longitude': 'location',
+        'speed': 'speed', 'direction': 'direction', 'vehicle': 'vehicle', 'route': 'route',
+    }
+
+    def _requested_fields(self):
+        raw = self.request.query_params.get('fields')
+        if not raw:
+            return None
+        fields = [name.strip() for name in raw.split(',') if name.strip() in self.FIELD_COLUMNS]
+        if not fields:
+            raise ValidationError({'fields': f"Нет известных полей. Допустимые: {', '.join(self.FIELD_COLUMNS)}."})
+        return fields
+
+    def _is_flat(self):
+        return self.request.query_params.get('flat', '').lower() in ('1', 'true', 'yes')
+
+    def get_serializer_class(self):
+        return VehiclePositionFlatSerializer if self._is_flat() else VehiclePositionSerializer
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self._requested_fields())
+        return super().get_serializer(*args, **kwargs)
 
     def get_queryset(self):
-        queryset = VehiclePosition.objects.select_related('vehicle', 'route').all()
+        fields = self._requested_fields() or list(self.FIELD_COLUMNS)
+        queryset = VehiclePosition.objects.all()
+        if self._is_flat() or not {'vehicle', 'route'} & set(fields):
+            # Без вложенных объектов JOIN не нужен: читаем только требуемые столбцы
+            queryset = queryset.only('id', 'timestamp', *{self.FIELD_COLUMNS[name] for name in fields})
+        else:
+            if 'vehicle' in fields:
+                queryset = queryset.select_related('vehicle')
+            if 'route' in fields:
+                queryset = queryset.select_related('route__transport_type')
         
         vehicle_id = self.request.query_params.get('vehicle_id')
         route_id = self.request.query_params.get('route_id')
         polygon_wkt = self.request.query_params.get('polygon')
+        time_from = parse_time_param(self.request.query_params.get('from'))
+        time_to = parse_time_param(self.request.query_params.get('to'))
+        bbox = _parse_bbox_param(self.request.query_params.get('bbox'))
+
+        for name, value in (('from', time_from), ('to', time_to), ('bbox', bbox)):
+            if self.request.query_params.get(name) and value is None:
+                raise ValidationError({name: f"Некорректное значение параметра '{name}'."})
 
         if vehicle_id:
             queryset = queryset.filter(vehicle__id=vehicle_id)
         elif route_id:
             queryset = queryset.filter(route__id=route_id)
+
+        if time_from:
+            queryset = queryset.filter(timestamp__gte=time_from)
+        if time_to:
+            queryset = queryset.filter(timestamp__lt=time_to)
+
+        if bbox:
+            # && по ограничивающему прямоугольнику напрямую использует GiST-индекс по location
+            queryset = queryset.filter(location__bboverlaps=bbox)
             
         if polygon_wkt:
             try:
@@ -88,6 +311,226 @@ class VehiclePositionViewSet(viewsets.ReadOnlyModelViewSet):
 
         return queryset.order_by('timestamp')
 
+class TripViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Рейсы ТС со сжатыми траекториями — одна строка на рейс вместо всех его позиций.
+    Фильтры: vehicle_id, route_id, from/to (рейсы, пересекающие интервал), bbox.
+    ?path=0 отдает только сводку рейса без траектории. Страницы — по курсору (start_time, id).
+    """
+    serializer_class = TripSerializer
+    pagination_class = TripCursorPagination
+
+    def _include_path(self):
+        return self.request.query_params.get('path', '1').lower() not in ('0', 'false', 'no')
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('include_path', self._include_path())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = Trip.objects.select_related('vehicle')
+        if not self._include_path():
+            queryset = queryset.defer('path', 'time_deltas')
+
+        vehicle_id = self.request.query_params.get('vehicle_id')
+        route_id = self.request.query_params.get('route_id')
+        time_from = parse_time_param(self.request.query_params.get('from'))
+        time_to = parse_time_param(self.request.query_params.get('to'))
+        bbox = _parse_bbox_param(self.request.query_params.get('bbox'))
+
+        for name, value in (('from', time_from), ('to', time_to), ('bbox', bbox)):
+            if self.request.query_params.get(name) and value is None:
+                raise ValidationError({name: f"Некорректное значение параметра '{name}'."})
+
+        if vehicle_id:
+            queryset = queryset.filter(vehicle_id=vehicle_id)
+        if route_id:
+            queryset = queryset.filter(route_id=route_id)
+        if time_from:
+            queryset = queryset.filter(end_time__gte=time_from)
+        if time_to:
+            queryset = queryset.filter(start_time__lt=time_to)
+        if bbox:
+            queryset = queryset.filter(path__bboverlaps=bbox)
+        return queryset.order_by('start_time')
+
+def _time_window_params(request):
+    """Разбирает параметры from/to; некорректное значение — ошибка 400."""
+    time_from = parse_time_param(request.query_params.get('from'))
+    time_to = parse_time_param(request.query_params.get('to'))
+    for name, value in (('from', time_from), ('to', time_to)):
+        if request.query_params.get(name) and value is None:
+            raise ValidationError({name: f"Некорректное значение параметра '{name}'."})
+    return time_from, time_to
+
+class StopArrivalViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Фактические прохождения остановок (прибытие, отправление, стоянка) из аналитической стадии.
+    Фильтры: route_id, stop_id, vehicle_id, from/to по времени прибытия. Страницы — по курсору.
+    """
+    serializer_class = StopArrivalSerializer
+    pagination_class = StopArrivalCursorPagination
+
+    def get_queryset(self):
+        queryset = StopArrival.objects.select_related('vehicle')
+        for param, field in (('route_id', 'route_id'), ('stop_id', 'stop_id'), ('vehicle_id', 'vehicle_id')):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{field: value})
+        time_from, time_to = _time_window_params(self.request)
+        if time_from:
+            queryset = queryset.filter(arrival_time__gte=time_from)
+        if time_to:
+            queryset = queryset.filter(arrival_time__lt=time_to)
+        return queryset
+
+class RouteHeadwayStatsViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Почасовые интервалы движения и стоянки по маршрутам — готовые агрегаты, история позиций не читается.
+    Фильтры: route_id, from/to по началу часа.
+    """
+    serializer_class = RouteHeadwayStatsSerializer
+    pagination_class = HourlyStatsCursorPagination
+
+    def get_queryset(self):
+        queryset = RouteHeadwayStats.objects.all()
+        route_id = self.request.query_params.get('route_id')
+        if route_id:
+            queryset = queryset.filter(route_id=route_id)
+        time_from, time_to = _time_window_params(self.request)
+        if time_from:
+            queryset = queryset.filter(hour__gte=time_from)
+        if time_to:
+            queryset = queryset.filter(hour__lt=time_to)
+        return queryset
+
+def _rollup_params(request):
+    """Разбирает параметры сводок period (hour/day, по умолчанию hour) и from/to."""
+    period = request.query_params.get('period', ROLLUP_HOUR)
+    if period not in (ROLLUP_HOUR, ROLLUP_DAY):
+        raise ValidationError({'period': f"Параметр 'period' должен быть '{ROLLUP_HOUR}' или '{ROLLUP_DAY}'."})
+    time_from, time_to = _time_window_params(request)
+    return period, time_from, time_to
+
+def _filter_rollups(queryset, request, object_field):
+    period, time_from, time_to = _rollup_params(request)
+    queryset = queryset.filter(period=period)
+    object_id = request.query_params.get(f'{object_field}_id')
+    if object_id:
+        queryset = queryset.filter(**{f'{object_field}_id': object_id})
+    if time_from:
+        queryset = queryset.filter(start__gte=time_from)
+    if time_to:
+        queryset = queryset.filter(start__lt=time_to)
+    return queryset
+
+class RouteActivityRollupViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Сводки работы маршрутов за час или сутки: число ТС, позиций, пройденное расстояние (м),
+    средняя и наибольшая скорость. Читаются только готовые сводки.
+    Фильтры: period (hour/day), route_id, from/to по началу периода.
+    """
+    serializer_class = RouteActivityRollupSerializer
+    pagination_class = RollupCursorPagination
+
+    def get_queryset(self):
+        return _filter_rollups(RouteActivityRollup.objects.all(), self.request, 'route')
+
+class VehicleActivityRollupViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Сводки работы ТС за час или сутки: число маршрутов, позиций, пройденное расстояние (м),
+    средняя и наибольшая скорость. Фильтры: period (hour/day), vehicle_id, from/to по началу периода.
+    """
+    serializer_class = VehicleActivityRollupSerializer
+    pagination_class = RollupCursorPagination
+
+    def get_queryset(self):
+        return _filter_rollups(VehicleActivityRollup.objects.select_related('vehicle'), self.request, 'vehicle')
+
+class FleetStatsView(APIView):
+    """
+    Показатели всего парка по периодам (из сводок по ТС): число работавших ТС, позиций,
+    пройденное расстояние (м), средняя и наибольшая скорость.
+    Параметры: period (hour/day), from/to по началу периода.
+    """
+    def get(self, request, *args, **kwargs):
+        period, time_from, time_to = _rollup_params(request)
+        rollups = VehicleActivityRollup.objects.filter(period=period)
+        if time_from:
+            rollups = rollups.filter(start__gte=time_from)
+        if time_to:
+            rollups = rollups.filter(start__lt=time_to)
+        rows = (
+            rollups.order_by('start').values('start')
+            .annotate(
+                vehicles=models.Count('id'), samples=models.Sum('samples'), distance=models.Sum('distance'),
+                speed_sum=models.Sum('speed_sum'), max_speed=models.Max('max_speed'),
+            )
+        )
+        return Response({
+            'period': period,
+            'results': [
+                {
+                    'start': row['start'],
+                    'vehicles': row['vehicles'],
+                    'samples': row['samples'],
+                    'distance': round(row['distance'], 1),
+                    'mean_speed': round(row['speed_sum'] / row['samples'], 1) if row['samples'] else None,
+                    'max_speed': row['max_speed'],
+                }
+                for row in rows
+            ],
+        })
+
+class HeatmapView(APIView):
+    """
+    Тепловая карта позиций по готовым почасовым агрегатам: число позиций, средняя и
+    85-й процентиль скорости по ячейкам сетки.
+    Параметры: from/to (округляются до часа; по умолчанию — последние BUS_HEATMAP_DEFAULT_DAYS
+    суток, интервал не длиннее BUS_HEATMAP_MAX_DAYS суток), route_id (можно через запятую), bbox,
+    scale — во сколько раз укрупнить ячейку (1..64).
+    """
+    def get(self, request, *args, **kwargs):
+        time_from, time_to = heatmap_window(*_time_window_params(request))
+        if (time_to - time_from).total_seconds() > HEATMAP_MAX_DAYS * 86400:
+            raise ValidationError({'from': f"Интервал тепловой карты не длиннее {HEATMAP_MAX_DAYS} суток."})
+        route_ids = None
+        if request.query_params.get('route_id'):
+            try:
+                route_ids = [int(part) for part in request.query_params['route_id'].split(',')]
+            except ValueError:
+                raise ValidationError({'route_id': "Некорректное значение параметра 'route_id'."})
+        bbox = _parse_bbox_param(request.query_params.get('bbox'))
+        if request.query_params.get('bbox') and bbox is None:
+            raise ValidationError({'bbox': "Некорректное значение параметра 'bbox'."})
+        scale = _int_param(request.query_params, 'scale', default=1, maximum=64)
+        return Response({
+            'cell_size': HEATMAP_CELL_SIZE * scale,
+            'cells': heatmap(time_from, time_to, route_ids, bbox.extent if bbox else None, scale),
+        })
+
+class JourneyPlanView(APIView):
+    """
+    Поиск поездки между остановками: /api/plan/?from=<id остановки>&to=<id остановки>.
+    Путь ищется в графе остановок, загруженном в память процесса, БД при запросе не читается.
+    Ответ: время в пути (сек), число пересадок и участки поездки с маршрутами и остановками.
+    """
+    def get(self, request, *args, **kwargs):
+        stop_ids = {}
+        for name in ('from', 'to'):
+            try:
+                stop_ids[name] = int(request.query_params.get(name, ''))
+            except ValueError:
+                raise ValidationError({name: f"Некорректное значение параметра '{name}'."})
+        graph = get_graph()
+        for name, stop_id in stop_ids.items():
+            if stop_id not in graph.index:
+                return Response({"error": f"Остановка {stop_id} не найдена."}, status=status.HTTP_404_NOT_FOUND)
+        plan = graph.plan(stop_ids['from'], stop_ids['to'])
+        if plan is None:
+            return Response({"error": "Между остановками нет пути."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(plan)
+
 # --- (Вьюхи импорта, экспорта и запуска задач остаются без изменений, сохраняем их как в вашем исходнике) ---
 class FileUploadView(APIView):
     def post(self, request, *args, **kwargs):
@@ -103,71 +546,101 @@ class FileUploadView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 class BusDataUploadAPIView(APIView):
+    """
+    Принимает файлы .json/.zip, сохраняет их на диск и ставит импорт в очередь django-q.
+    Отвечает сразу (202) номером задачи; ход импорта — GET /api/ingest-jobs/<id>/.
+    """
     def post(self, request, *args, **kwargs):
         files = request.FILES.getlist('files')
         if not files:
             return Response({"error": "Файлы не предоставлены."}, status=status.HTTP_400_BAD_REQUEST)
-        result = import_bus_data_from_files(files)
-        response_status = status.HTTP_207_MULTI_STATUS if result.get('errors') else status.HTTP_200_OK
-        return Response(result, status=response_status)
+        unsupported = [f.name for f in files if not f.name.lower().endswith(('.zip', '.json'))]
+        if unsupported:
+            return Response({"error": f"Неподдерживаемый формат (нужен .zip или .json): {', '.join(unsupported)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = spool_uploads(files)
+        async_task('project.tasks.run_ingest_job_task', job.pk)
+        return Response({
+            "message": "Файлы загружены, импорт запущен в фоновом режиме.",
+            "job_id": job.pk,
+            "status_url": request.build_absolute_uri(f'/api/ingest-jobs/{job.pk}/'),
+        }, status=status.HTTP_202_ACCEPTED)
+
+class IngestJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Состояние фоновых задач импорта: статус, обработанные файлы, созданные и пропущенные позиции, ошибки."""
+    queryset = IngestJob.objects.all()
+    serializer_class = IngestJobSerializer
+
+def _streaming_attachment(chunks, content_type, filename):
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 class StopsExportCSVView(APIView):
     def get(self, request, *args, **kwargs):
-        response = HttpResponse(content_type='text/csv; charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename="stops_export.csv"'
-        response.write('\ufeff')
-        writer = csv.writer(response)
-        writer.writerow(['ID', 'Название остановки', 'Широта', 'Долгота'])
-        for stop in Stop.objects.all().order_by('name'):
-            writer.writerow([stop.id, stop.name, stop.latitude, stop.longitude])
-        return response
+        return _streaming_attachment(iter_stops_csv(), 'text/csv; charset=utf-8', 'stops_export.csv')
 
 class RoutePositionsExportCSVView(APIView):
     def get(self, request, route_id, *args, **kwargs):
-        response = HttpResponse(content_type='text/csv; charset=utf-8')
-        response['Content-Disposition'] = f'attachment; filename="route_{route_id}_positions.csv"'
-        response.write('\ufeff')
-        writer = csv.writer(response)
-        writer.writerow(['ID Позиции', 'Время', 'Гос. номер ТС', 'Скорость (км/ч)', 'Направление', 'Широта', 'Долгота'])
-        positions = VehiclePosition.objects.filter(route__id=route_id).select_related('vehicle').order_by('timestamp')
-        for pos in positions:
-            writer.writerow([pos.id, pos.timestamp.strftime('%Y-%m-%d %H:%M:%S'), pos.vehicle.gos_num if pos.vehicle else '', pos.speed, pos.direction, pos.latitude, pos.longitude])
-        return response
+        return _streaming_attachment(
+            iter_route_positions_csv(route_id), 'text/csv; charset=utf-8', f'route_{route_id}_positions.csv'
+        )
 
 class StopsExportGeoJSONView(APIView):
     def get(self, request, *args, **kwargs):
-        feature_collection = {"type": "FeatureCollection", "features":[]}
-        for stop in Stop.objects.filter(location__isnull=False).order_by('name'):
-            feature = {
-                "type": "Feature",
-                "geometry": json.loads(stop.location.geojson),
-                "properties": {"id": stop.id, "name": stop.name},
-            }
-            feature_collection["features"].append(feature)
-        response = JsonResponse(feature_collection)
-        response['Content-Disposition'] = 'attachment; filename="stops_export.geojson"'
-        return response
+        return _streaming_attachment(iter_stops_geojson(), 'application/geo+json', 'stops_export.geojson')
 
 class RoutePositionsExportJSONView(APIView):
     def get(self, request, route_id, *args, **kwargs):
-        positions = VehiclePosition.objects.filter(route__id=route_id).select_related('vehicle').order_by('timestamp')
-        data_list =[
-            {
-                "position_id": pos.id,
-                "timestamp": pos.timestamp.isoformat(),
-                "latitude": pos.latitude,
-                "longitude": pos.longitude,
-                "speed": pos.speed,
-                "direction": pos.direction,
-                "vehicle_gos_num": pos.vehicle.gos_num if pos.vehicle else None
-            } for pos in positions
-        ]
-        response = JsonResponse(data_list, safe=False)
-        response['Content-Disposition'] = f'attachment; filename="route_{route_id}_positions.json"'
-        return response
+        return _streaming_attachment(
+            iter_route_positions_json(route_id), 'application/json', f'route_{route_id}_positions.json'
+        )
     
+class PositionsExportColumnarView(APIView):
+    """
+    Колоночный экспорт истории позиций для аналитики: ?format=parquet|arrow
+    и фильтры route_id, vehicle_id, from, to (ISO 8601).
+    Файл собирается во временном файле порциями и отдается потоком.
+    """
+    def get(self, request, *args, **kwargs):
+        fmt = request.query_params.get('format', 'parquet')
+        if fmt not in COLUMNAR_FORMATS:
+            return Response({"error": f"Неизвестный формат '{fmt}'. Доступны: {', '.join(COLUMNAR_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        filters = {
+            'route_id': request.query_params.get('route_id'),
+            'vehicle_id': request.query_params.get('vehicle_id'),
+            'time_from': parse_time_param(request.query_params.get('from')),
+            'time_to': parse_time_param(request.query_params.get('to')),
+        }
+        for name, key in (('from', 'time_from'), ('to', 'time_to')):
+            if request.query_params.get(name) and filters[key] is None:
+                return Response({"error": f"Некорректное значение параметра '{name}'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type, extension = COLUMNAR_FORMATS[fmt]
+        output = tempfile.TemporaryFile()
+        try:
+            write_positions_columnar(output, fmt, **filters)
+        except ColumnarExportUnavailable as e:
+            output.close()
+            return Response({"error": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        output.seek(0)
+
+        name_parts = [f"{key}_{value}" for key, value in (('route', filters['route_id']), ('vehicle', filters['vehicle_id'])) if value]
+        filename = f"positions{'_' + '_'.join(name_parts) if name_parts else ''}.{extension}"
+        return FileResponse(output, as_attachment=True, filename=filename, content_type=content_type)
+
 class StartCollectionPipelineView(APIView):
+    """
+    Запускает сбор данных. mode='files' (по умолчанию BUS_COLLECTION_MODE) — сбор, очистка
+    и раскладка по файлам маршрутов; mode='stream' — сбор сразу в БД без промежуточных файлов.
+    """
     def post(self, request, *args, **kwargs):
+        mode = request.data.get('mode', getattr(settings, 'BUS_COLLECTION_MODE', 'files'))
+        if mode == 'stream':
+            async_task('project.tasks.run_streaming_collection_task')
+            return Response({"message": "Потоковый сбор данных с записью в базу запущен в фоновом режиме."}, status=status.HTTP_202_ACCEPTED)
+        if mode != 'files':
+            return Response({"error": f"Неизвестный режим '{mode}' (нужен 'files' или 'stream')."}, status=status.HTTP_400_BAD_REQUEST)
         async_task('project.tasks.run_collection_task')
         return Response({"message": "Процесс сбора и очистки данных запущен в фоновом режиме."}, status=status.HTTP_202_ACCEPTED)
 
@@ -176,19 +649,89 @@ class StartImportPipelineView(APIView):
         async_task('project.tasks.run_import_task')
         return Response({"message": "Процесс импорта данных в базу запущен в фоновом режиме."}, status=status.HTTP_202_ACCEPTED)
     
+def _delete_derived_data(route_ids=None, before=None):
+    """
+    Удаляет данные, построенные по удаляемым позициям: рейсы, прохождения остановок,
+    почасовую статистику и сводки, а также кэш тайлов позиций. Без before сбрасываются и отметки
+    аналитических стадий, а при удалении всех данных — и накопленное время в пути по соединениям.
+    """
+    derived = (
+        (Trip.objects.all(), 'start_time'),
+        (StopArrival.objects.all(), 'arrival_time'),
+        (RouteHeadwayStats.objects.all(), 'hour'),
+        (PositionDensityCell.objects.all(), 'hour'),
+        (RouteActivityRollup.objects.all(), 'start'),
+    )
+    for queryset, time_field in derived:
+        if route_ids:
+            queryset = queryset.filter(route_id__in=route_ids)
+        if before:
+            queryset = queryset.filter(**{f'{time_field}__lt': before})
+        queryset.delete()
+    if not before:
+        watermarks = AnalyticsWatermark.objects.all()
+        if route_ids:
+            # Гистограммы времени в пути общие для маршрутов и остаются: без отметки стадии
+            # проезды этих маршрутов после повторного импорта были бы учтены в них дважды
+            watermarks = watermarks.filter(route_id__in=route_ids).exclude(stage=TRAVEL_TIME_STAGE)
+        watermarks.delete()
+    if route_ids:
+        # Сводки по ТС не делятся по маршрутам: сброс отметки пересчитает их целиком
+        AnalyticsWatermark.objects.filter(stage=ROLLUP_STAGE).delete()
+    else:
+        vehicle_rollups = VehicleActivityRollup.objects.all()
+        if before:
+            vehicle_rollups = vehicle_rollups.filter(start__lt=before)
+        vehicle_rollups.delete()
+    if not before and not route_ids:
+        ConnectionTravelTime.objects.all().delete()
+        PositionChange.objects.all().delete()
+    invalidate_tiles(POSITION_LAYERS + (DENSITY_TILES,))
+
 class DeleteMonitoringDataView(APIView):
+    """
+    Удаление данных мониторинга.
+    delete_all очищает таблицу позиций через TRUNCATE, before (ISO-дата) без route_ids удаляет
+    целые секции старше указанного момента, route_ids удаляет позиции выбранных маршрутов
+    построчно (с before — только более старые).
+    Для TRUNCATE и удаления секций число позиций — оценка по статистике PostgreSQL.
+    """
     def post(self, request, *args, **kwargs):
         route_ids = request.data.get('route_ids',[])
         delete_all = request.data.get('delete_all', False)
-        if not route_ids and not delete_all:
-            return Response({"error": "Не указаны ID маршрутов или флаг 'delete_all'."}, status=status.HTTP_400_BAD_REQUEST)
+        before_raw = request.data.get('before')
+        before = parse_time_param(before_raw)
+        if before_raw and before is None:
+            return Response({"error": "Некорректное значение 'before' (нужна дата в формате ISO 8601)."}, status=status.HTTP_400_BAD_REQUEST)
+        if not route_ids and not delete_all and not before:
+            return Response({"error": "Не указаны ID маршрутов, дата 'before' или флаг 'delete_all'."}, status=status.HTTP_400_BAD_REQUEST)
 
+        dropped_partitions = []
         if delete_all:
-            deleted_positions_count, _ = VehiclePosition.objects.all().delete()
+            deleted_positions_count = truncate_positions()
             deleted_vehicles_count, _ = Vehicle.objects.all().delete()
+            # Журнал импорта больше не соответствует данным: те же файлы можно загрузить заново
+            IngestedFile.objects.all().delete()
+            RouteImportWatermark.objects.all().delete()
+            _delete_derived_data()
         else:
-            positions_to_delete = VehiclePosition.objects.filter(route__id__in=route_ids)
-            deleted_positions_count, _ = positions_to_delete.delete()
+            if route_ids:
+                positions_to_delete = VehiclePosition.objects.filter(route__id__in=route_ids)
+                if before:
+                    positions_to_delete = positions_to_delete.filter(timestamp__lt=before)
+                deleted_positions_count, _ = positions_to_delete.delete()
+                last_positions = VehicleLastPosition.objects.filter(route_id__in=route_ids)
+                if not before:
+                    RouteImportWatermark.objects.filter(route_id__in=route_ids).delete()
+                    IngestedFile.objects.all().delete()
+            else:
+                dropped_partitions, deleted_positions_count = drop_partitions_before(before)
+                last_positions = VehicleLastPosition.objects.all()
+            if before:
+                last_positions = last_positions.filter(timestamp__lt=before)
+            # Снимок и аналитика не должны показывать позиции, которых больше нет в истории
+            last_positions.delete()
+            _delete_derived_data(route_ids or None, before)
             vehicles_to_delete = Vehicle.objects.annotate(num_positions=models.Count('positions')).filter(num_positions=0)
             deleted_vehicles_count, _ = vehicles_to_delete.delete()
 
@@ -196,4 +739,5 @@ class DeleteMonitoringDataView(APIView):
             "message": "Данные успешно удалены.",
             "deleted_positions": deleted_positions_count,
             "deleted_vehicles": deleted_vehicles_count,
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+            "dropped_partitions": dropped_partitions,
+        }, status=status.HTTP_200_OK)
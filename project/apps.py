@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ProjectConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'project'
+
+    def ready(self):
+        # Регистрирует обработчики сигналов, сбрасывающие граф планировщика, индекс остановок и тайлы
+        from . import planner, stop_index, tiles  # noqa: F401
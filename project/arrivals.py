@@ -0,0 +1,232 @@
+# project/arrivals.py
+"""
+Прохождения остановок и почасовая статистика интервалов движения.
+
+Позиции маршрута привязываются к его геометрии (см. matching.py), и для каждого ТС
+ищутся моменты, когда расстояние вдоль маршрута переходит через расстояние до остановки;
+время прохождения интерполируется между соседними позициями. Шаги с неправдоподобной
+скоростью или через слишком много остановок сразу (скачки привязки) не учитываются. Если ТС стояло у остановки
+(несколько позиций в пределах ARRIVAL_RADIUS метров от нее), прибытием считается первая,
+а отправлением — последняя из этих позиций.
+
+Стадия инкрементальная: по отметке AnalyticsWatermark читаются только позиции после
+последнего запуска (с перекрытием ARRIVAL_LOOKBACK), прохождения в перекрытии пересчитываются,
+а статистика RouteHeadwayStats обновляется только за затронутые часы.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .decoding import epoch_to_datetime
+from .ledger import advance_stage_watermark, stage_watermark
+from .matching import get_route_matcher, get_route_shape, match_positions
+from .models import RouteHeadwayStats, RouteStop, StopArrival
+from .trips import epoch_expression
+
+ARRIVAL_STAGE = 'stop_arrivals'
+
+# Позиции не дальше этого расстояния вдоль маршрута от остановки (м) считаются стоянкой у нее
+ARRIVAL_RADIUS = getattr(settings, 'BUS_ARRIVAL_RADIUS', 40)
+# Между позициями с большим разрывом (сек) прохождение остановки не интерполируется
+ARRIVAL_MAX_GAP = getattr(settings, 'BUS_ARRIVAL_MAX_GAP', 180)
+# Шаг вдоль маршрута быстрее этой скорости (км/ч) — скачок привязки, прохождений он не дает
+ARRIVAL_MAX_SPEED = getattr(settings, 'BUS_ARRIVAL_MAX_SPEED', 120)
+# Шаг, перескакивающий больше остановок, — тоже скачок привязки (например, на параллельный участок)
+ARRIVAL_MAX_STOPS_PER_STEP = getattr(settings, 'BUS_ARRIVAL_MAX_STOPS_PER_STEP', 3)
+# Перекрытие инкрементальных запусков (сек): прохождения за это время до отметки пересчитываются
+ARRIVAL_LOOKBACK = getattr(settings, 'BUS_ARRIVAL_LOOKBACK', 1800)
+# Повторные прохождения одной остановки одним ТС в пределах этого времени (сек) объединяются
+ARRIVAL_MERGE_SECONDS = 60
+# Интервалы длиннее этого (сек) — перерыв в движении, а не интервал; в статистику не входят
+HEADWAY_MAX = getattr(settings, 'BUS_HEADWAY_MAX', 7200)
+
+
+def _thresholds(stop_offsets, radius):
+    """
+    Расстояния, переход через которые означает прохождение остановки. Для конечных они
+    сдвинуты внутрь маршрута: через начало и конец ломаной позиции не "переходят".
+    """
+    thresholds = np.array(stop_offsets, dtype=np.float64)
+    if len(thresholds) > 1:
+        thresholds[0] = min(radius, thresholds[1] / 2)
+        thresholds[-1] = max(thresholds[-1] - radius, (thresholds[-2] + thresholds[-1]) / 2)
+    return thresholds
+
+
+def detect_arrivals(matched, stop_offsets, radius=None, max_gap=None, max_speed=None, max_stops=None):
+    """
+    Находит прохождения остановок в привязанных позициях (MatchedPositions, упорядоченных
+    по ТС и времени). Возвращает столбцы vehicle_id, stop_index, arrival, departure (секунды UTC).
+    """
+    radius = ARRIVAL_RADIUS if radius is None else radius
+    max_gap = ARRIVAL_MAX_GAP if max_gap is None else max_gap
+    max_speed = ARRIVAL_MAX_SPEED if max_speed is None else max_speed
+    max_stops = ARRIVAL_MAX_STOPS_PER_STEP if max_stops is None else max_stops
+    stop_offsets = np.asarray(stop_offsets, dtype=np.float64)
+    thresholds = _thresholds(stop_offsets, radius)
+
+    vehicle = matched.vehicle_id[matched.matched]
+    t = matched.timestamp[matched.matched]
+    offset = matched.offset[matched.matched]
+    nearest = matched.stop_index[matched.matched]
+
+    # Серии подряд идущих позиций одного ТС у одной остановки
+    near = np.abs(offset - stop_offsets[nearest]) <= radius
+    starts = np.ones(len(t), dtype=bool)
+    starts[1:] = (vehicle[1:] != vehicle[:-1]) | (nearest[1:] != nearest[:-1]) | (near[1:] != near[:-1])
+    run = np.cumsum(starts) - 1
+    run_first = t[starts]
+    run_last = t[np.append(np.flatnonzero(starts)[1:] - 1, len(t) - 1)] if len(t) else t
+
+    # Переходы через пороги остановок между соседними позициями одного ТС при движении вперед
+    # с правдоподобной скоростью и не более чем через max_stops остановок
+    step = np.diff(offset)
+    dt = np.diff(t)
+    first = np.searchsorted(thresholds, offset[:-1], side='right')
+    last = np.searchsorted(thresholds, offset[1:], side='right')
+    forward = (
+        (vehicle[1:] == vehicle[:-1]) & (step > 0) & (dt <= max_gap)
+        & (step <= dt * (max_speed / 3.6)) & (last - first <= max_stops)
+    )
+    count = np.where(forward, np.maximum(last - first, 0), 0)
+    pair = np.repeat(np.arange(len(count)), count)
+    stop = first[pair] + np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    crossing = t[pair] + (thresholds[stop] - offset[pair]) / step[pair] * (t[pair + 1] - t[pair])
+
+    arrival, departure = crossing.copy(), crossing.copy()
+    for side in (pair, pair + 1):
+        at_stop = near[side] & (nearest[side] == stop)
+        arrival = np.where(at_stop, np.minimum(arrival, run_first[run[side]]), arrival)
+        departure = np.where(at_stop, np.maximum(departure, run_last[run[side]]), departure)
+    arrival, departure = np.round(arrival).astype(np.int64), np.round(departure).astype(np.int64)
+    vehicle = vehicle[pair]
+
+    # Дрожание координат у остановки дает несколько переходов подряд — объединяем их
+    order = np.lexsort((arrival, stop, vehicle))
+    vehicle, stop, arrival, departure = vehicle[order], stop[order], arrival[order], departure[order]
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = (vehicle[1:] != vehicle[:-1]) | (stop[1:] != stop[:-1]) | (arrival[1:] > departure[:-1] + ARRIVAL_MERGE_SECONDS)
+    groups = np.flatnonzero(new)
+    return {
+        'vehicle_id': vehicle[groups],
+        'stop_index': stop[groups],
+        'arrival': arrival[groups],
+        'departure': np.maximum.reduceat(departure, groups) if len(groups) else departure,
+    }
+
+
+def _hour(epoch):
+    return epoch // 3600 * 3600
+
+
+def refresh_headway_stats(route_id, since=None):
+    """
+    Пересчитывает RouteHeadwayStats маршрута за часы начиная с since (все часы, если None)
+    по сохраненным прохождениям. Возвращает число записанных часов.
+    """
+    hour_from = _hour(int(since.timestamp())) if since is not None else None
+    arrivals = StopArrival.objects.filter(route_id=route_id)
+    if hour_from is not None:
+        # Интервал первого прибытия часа считается от предыдущего прибытия, возможно более раннего
+        arrivals = arrivals.filter(arrival_time__gte=epoch_to_datetime(hour_from - HEADWAY_MAX))
+    rows = list(
+        arrivals.order_by('stop_index', 'arrival_time')
+        .annotate(arrival=epoch_expression('arrival_time'))
+        .values_list('stop_index', 'vehicle_id', 'arrival', 'dwell')
+    )
+
+    stale = RouteHeadwayStats.objects.filter(route_id=route_id)
+    if hour_from is not None:
+        stale = stale.filter(hour__gte=epoch_to_datetime(hour_from))
+    if not rows:
+        stale.delete()
+        return 0
+
+    stop, vehicle, arrival, dwell = (np.array(column, dtype=np.int64) for column in zip(*rows))
+    hour = _hour(arrival)
+    headway = np.diff(arrival)
+    valid = (stop[1:] == stop[:-1]) & (headway > 0) & (headway <= HEADWAY_MAX)
+    headway, headway_hour = headway[valid], hour[1:][valid]
+    # Стоянки на конечных — это отстой между рейсами, в статистику стоянок они не входят
+    shape = get_route_shape(route_id)
+    last_stop = len(shape.stop_ids) - 1 if shape is not None else stop.max()
+    interior = (stop > 0) & (stop < last_stop)
+
+    stats = []
+    for moment in np.unique(hour):
+        if hour_from is not None and moment < hour_from:
+            continue
+        in_hour = hour == moment
+        hour_headways = headway[headway_hour == moment].astype(np.float64)
+        hour_dwells = dwell[in_hour & interior].astype(np.float64)
+        mean = float(hour_headways.mean()) if len(hour_headways) else None
+        stats.append(RouteHeadwayStats(
+            route_id=route_id,
+            hour=epoch_to_datetime(moment),
+            arrivals=int(in_hour.sum()),
+            vehicles=len(np.unique(vehicle[in_hour])),
+            headway_count=len(hour_headways),
+            headway_mean=mean,
+            headway_median=float(np.median(hour_headways)) if len(hour_headways) else None,
+            headway_p90=float(np.percentile(hour_headways, 90)) if len(hour_headways) else None,
+            headway_max=float(hour_headways.max()) if len(hour_headways) else None,
+            headway_cv=float(hour_headways.std() / mean) if mean else None,
+            dwell_mean=float(hour_dwells.mean()) if len(hour_dwells) else None,
+            dwell_p90=float(np.percentile(hour_dwells, 90)) if len(hour_dwells) else None,
+        ))
+    stale.delete()
+    RouteHeadwayStats.objects.bulk_create(stats)
+    return len(stats)
+
+
+def update_stop_arrivals(route_ids=None, full=False):
+    """
+    Инкрементально находит прохождения остановок по новым позициям и обновляет почасовую
+    статистику интервалов. full=True пересчитывает всю историю маршрутов.
+    Возвращает {'routes', 'arrivals', 'hours'}.
+    """
+    if route_ids is None:
+        route_ids = RouteStop.objects.order_by().values_list('route_id', flat=True).distinct()
+    lookback = timedelta(seconds=ARRIVAL_LOOKBACK)
+
+    stats = {'routes': 0, 'arrivals': 0, 'hours': 0}
+    for route_id in sorted(set(route_ids)):
+        watermark = None if full else stage_watermark(ARRIVAL_STAGE, route_id)
+        # Пересчитываются прохождения после replace_from; позиции читаются с запасом еще на одно
+        # перекрытие, чтобы стоянка, начавшаяся раньше, дала верное время прибытия
+        replace_from = watermark - lookback if watermark is not None else None
+        read_from = replace_from - lookback if replace_from is not None else None
+        matched = match_positions(time_from=read_from, route_ids=[route_id]).get(route_id)
+        if matched is None or not matched.matched.any():
+            continue
+        matcher, shape = get_route_matcher(route_id)
+        events = detect_arrivals(matched, matcher.stop_offsets)
+        if replace_from is not None:
+            keep = events['arrival'] >= int(replace_from.timestamp())
+            events = {name: column[keep] for name, column in events.items()}
+
+        stop_ids = np.array(shape.stop_ids, dtype=np.int64)
+        with transaction.atomic():
+            stale = StopArrival.objects.filter(route_id=route_id)
+            if replace_from is not None:
+                stale = stale.filter(arrival_time__gte=replace_from)
+            stale.delete()
+            StopArrival.objects.bulk_create([
+                StopArrival(
+                    vehicle_id=vehicle_id, route_id=route_id, stop_id=int(stop_ids[stop_index]), stop_index=stop_index,
+                    arrival_time=epoch_to_datetime(arrival), departure_time=epoch_to_datetime(departure),
+                    dwell=departure - arrival,
+                )
+                for vehicle_id, stop_index, arrival, departure in zip(
+                    events['vehicle_id'].tolist(), events['stop_index'].tolist(),
+                    events['arrival'].tolist(), events['departure'].tolist(),
+                )
+            ], batch_size=5000)
+            stats['hours'] += refresh_headway_stats(route_id, since=replace_from)
+            advance_stage_watermark(ARRIVAL_STAGE, route_id, epoch_to_datetime(matched.timestamp.max()))
+        stats['routes'] += 1
+        stats['arrivals'] += len(events['arrival'])
+    return stats
@@ -0,0 +1,140 @@
+# project/collector.py
+"""
+Асинхронный сборщик меток ТС с irkbus.ru.
+
+Список маршрутов (rids) делится на шарды, каждый шард опрашивается своей корутиной
+через общий пул соединений aiohttp. Опросы идут по расписанию с фиксированным шагом
+и случайным сдвигом (jitter), а не "запрос + sleep", поэтому медленный ответ не сдвигает
+следующие опросы. Ошибки и зависшие запросы одного шарда откладывают только этот шард
+(экспоненциальная задержка), остальные продолжают собирать данные.
+"""
+
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from django.conf import settings
+
+# Шаг опроса каждого шарда (сек) и максимальный случайный сдвиг к нему
+COLLECTOR_INTERVAL = getattr(settings, 'BUS_COLLECTOR_INTERVAL', 10)
+COLLECTOR_JITTER = getattr(settings, 'BUS_COLLECTOR_JITTER', 5)
+
+# Сколько маршрутов (элементов rids) запрашивать одним запросом
+COLLECTOR_SHARD_SIZE = getattr(settings, 'BUS_COLLECTOR_SHARD_SIZE', 40)
+
+# Размер пула соединений и таймаут одного запроса (сек)
+COLLECTOR_MAX_CONNECTIONS = getattr(settings, 'BUS_COLLECTOR_MAX_CONNECTIONS', 8)
+COLLECTOR_TIMEOUT = getattr(settings, 'BUS_COLLECTOR_TIMEOUT', 15)
+
+# Пределы экспоненциальной задержки после ошибок (сек)
+COLLECTOR_BACKOFF_BASE = getattr(settings, 'BUS_COLLECTOR_BACKOFF_BASE', 2)
+COLLECTOR_BACKOFF_MAX = getattr(settings, 'BUS_COLLECTOR_BACKOFF_MAX', 60)
+
+
+def split_rids(rids, shard_size=None):
+    """Делит строку rids ('2-1,13-1,...') на шарды по shard_size маршрутов."""
+    shard_size = shard_size or COLLECTOR_SHARD_SIZE
+    items = [rid.strip() for rid in rids.split(',') if rid.strip()]
+    return [','.join(items[i:i + shard_size]) for i in range(0, len(items), shard_size)]
+
+
+def backoff_delay(failures, base=None, maximum=None):
+    """Задержка перед повтором после failures ошибок подряд: base * 2^(n-1), не больше maximum, плюс jitter."""
+    base = COLLECTOR_BACKOFF_BASE if base is None else base
+    maximum = COLLECTOR_BACKOFF_MAX if maximum is None else maximum
+    delay = min(maximum, base * 2 ** (failures - 1))
+    return delay + random.uniform(0, delay / 2)
+
+
+class AsyncCollector:
+    """
+    Сборщик меток. on_sample(data) вызывается для каждого ответа с непустым "anims"
+    (в том же потоке, что и цикл событий), так что запись в файл не требует блокировок.
+    """
+
+    def __init__(self, base_url, params, headers=None, on_sample=None, main_page_url=None,
+                 shard_size=None, interval=None, jitter=None, timeout=None, max_connections=None,
+                 backoff_base=None, backoff_max=None, log=print):
+        self.base_url = base_url
+        self.params = dict(params)
+        self.headers = headers or {}
+        self.on_sample = on_sample or (lambda data: None)
+        self.main_page_url = main_page_url
+        self.shards = split_rids(self.params.pop('rids'), shard_size)
+        self.interval = COLLECTOR_INTERVAL if interval is None else interval
+        self.jitter = COLLECTOR_JITTER if jitter is None else jitter
+        self.timeout = COLLECTOR_TIMEOUT if timeout is None else timeout
+        self.max_connections = max_connections or COLLECTOR_MAX_CONNECTIONS
+        self.backoff_base = COLLECTOR_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = COLLECTOR_BACKOFF_MAX if backoff_max is None else backoff_max
+        self.log = log
+        self.stats = {'requests': 0, 'samples': 0, 'errors': 0}
+
+    async def run(self, duration_seconds):
+        """Опрашивает все шарды в течение duration_seconds. Возвращает статистику."""
+        import aiohttp
+
+        deadline = time.monotonic() + duration_seconds
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, headers=self.headers, timeout=timeout) as session:
+            if self.main_page_url:
+                try:
+                    self.log("[Сборщик] Получение свежей сессии (Cookie)...")
+                    async with session.get(self.main_page_url) as response:
+                        await response.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    self.log(f"[Сборщик] Не удалось получить Cookie, работа будет продолжена. Ошибка: {e}")
+
+            # Старты шардов равномерно разнесены по интервалу, чтобы не бить в сервер залпом
+            offsets = [self.interval * i / len(self.shards) for i in range(len(self.shards))]
+            await asyncio.gather(*(
+                self._poll_shard(session, index, rids, offset, deadline)
+                for index, (rids, offset) in enumerate(zip(self.shards, offsets))
+            ))
+        return self.stats
+
+    async def _poll_shard(self, session, index, rids, offset, deadline):
+        import aiohttp
+
+        next_run = time.monotonic() + offset
+        failures = 0
+        while True:
+            # Ни ожидание следующего слота, ни пауза после ошибки не продлевают сбор за deadline
+            delay = min(next_run, deadline) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if time.monotonic() >= deadline:
+                return
+
+            try:
+                await self._fetch(session, rids)
+                failures = 0
+                next_run += self.interval + random.uniform(0, self.jitter)
+                # Если отстали от расписания (долгий ответ), не догоняем пропущенные слоты залпом
+                next_run = max(next_run, time.monotonic())
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                failures += 1
+                self.stats['errors'] += 1
+                pause = min(backoff_delay(failures, self.backoff_base, self.backoff_max), deadline - time.monotonic())
+                if pause <= 0:
+                    return
+                self.log(f"[Сборщик] Шард {index}: ошибка {e!r}, повтор через {pause:.1f} с.")
+                next_run = time.monotonic() + pause
+
+    async def _fetch(self, session, rids):
+        params = dict(self.params, rids=rids, _=int(datetime.now().timestamp() * 1000))
+        self.stats['requests'] += 1
+        async with session.get(self.base_url, params=params) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        if isinstance(data, dict) and data.get("anims"):
+            self.stats['samples'] += 1
+            self.on_sample(data)
+
+
+def collect(base_url, params, duration_seconds, **kwargs):
+    """Синхронная обертка: запускает AsyncCollector в собственном цикле событий."""
+    collector = AsyncCollector(base_url, params, **kwargs)
+    return asyncio.run(collector.run(duration_seconds))
@@ -1,16 +1,21 @@
-import os
+import hashlib
+import heapq
 import json
-import random
-import requests
-import time
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
 from datetime import datetime
 from pathlib import Path
-from .services import import_bus_data_from_files
+from django.conf import settings
+from django.db import connection
+from .collector import collect
+from .ingest import dispatch_route_files
+from .partitioning import ensure_future_partitions
+from .services import IMPORT_INCREMENTAL, IMPORT_WORKERS, PositionStreamWriter, import_bus_data_from_files, import_bus_data_parallel
 from collections import defaultdict
 
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
-
 
 BASE_URL = "http://irkbus.ru/php/getVehiclesMarkers.php"
 MAIN_PAGE_URL = "http://irkbus.ru/"
@@ -37,73 +42,117 @@ FULL_DATA_PATH = DATA_DIR / 'full_data.json'
 DEDUPLICATED_PATH = DATA_DIR / 'deduplicated_data.json'
 SORTED_DIR = DATA_DIR / 'sorted_routes'
 
+# Сколько байт строк держать в памяти при сортировке по maxk, прежде чем сбрасывать серию на диск
+DEDUP_MEMORY_BUDGET = getattr(settings, 'BUS_DATA_DEDUP_MEMORY_BUDGET', 64 * 1024 * 1024)
+
 def run_parser(duration_seconds=300):
+    """
+    Собирает метки ТС в FULL_DATA_PATH (по одному JSON-ответу на строку).
+    Маршруты опрашиваются шардами параллельно, см. project/collector.py.
+    """
     print(f"[Парсер] Запуск на {duration_seconds} секунд...")
-    
-    session = requests.Session()
-    retries = Retry(total=5, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-    
-    session.mount('http://', HTTPAdapter(max_retries=retries))
-    
-    session.headers.update(HEADERS)
-    start_time = time.time()
-    
-    try:
-        print("[Парсер] Получение свежей сессии (Cookie)...")
-        session.get(MAIN_PAGE_URL, timeout=10)
-    except requests.RequestException as e:
-        print(f"[Парсер] Не удалось получить Cookie, работа будет продолжена. Ошибка: {e}")
-        
+
     if FULL_DATA_PATH.exists():
         FULL_DATA_PATH.unlink()
 
-    while time.time() - start_time < duration_seconds:
-        try:
-            PARAMS["_"] = int(datetime.now().timestamp() * 1000)
-            response = session.get(BASE_URL, params=PARAMS, timeout=15)
-            response.raise_for_status() # Проверяем, что ответ успешный (не 4xx или 5xx)
-
-            data = response.json()
-            if data.get("anims"):
-                with open(FULL_DATA_PATH, "a", encoding="utf-8") as f:
-                    f.write(json.dumps(data, ensure_ascii=False) + '\n')
-                print(f"[Парсер] {datetime.now().strftime('%H:%M:%S')}: Получены и сохранены данные.")
-            
-            time.sleep(10 + random.randint(0, 5))
-            
-        except requests.exceptions.RequestException as e:
-            print(f"[Парсер] Критическая ошибка сети после нескольких попыток: {e}")
-            print("[Парсер] Пропускаем итерацию, попробуем снова через 20 секунд.")
-            time.sleep(20)
-        except Exception as e:
-            print(f"[Парсер] Неизвестная ошибка в цикле: {e}")
-            time.sleep(15)
-            
-    print("[Парсер] Работа завершена.")
-
-def remove_duplicates():
-    print("[Очистка] Удаление дубликатов...")
-    unique_objects = {}
-    if not FULL_DATA_PATH.exists():
-        print("[Очистка] Файл с сырыми данными не найден. Пропускаем шаг.")
-        return
+    with open(FULL_DATA_PATH, "a", encoding="utf-8") as f:
+        def save_sample(data):
+            f.write(json.dumps(data, ensure_ascii=False) + '\n')
+            print(f"[Парсер] {datetime.now().strftime('%H:%M:%S')}: Получены и сохранены данные.")
+
+        stats = collect(
+            BASE_URL, PARAMS, duration_seconds,
+            headers=HEADERS, main_page_url=MAIN_PAGE_URL, on_sample=save_sample,
+        )
 
-    with open(FULL_DATA_PATH, 'r', encoding='utf-8') as infile:
+    print(f"[Парсер] Работа завершена. Запросов: {stats['requests']}, "
+          f"ответов с данными: {stats['samples']}, ошибок: {stats['errors']}")
+
+def _sample_digest(data):
+    """Компактный ключ ответа: blake2b канонического JSON (16 байт вместо всей строки)."""
+    canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).digest()
+
+
+def _iter_unique_samples(path):
+    """Читает JSONL построчно и отдает (maxk, строка для записи) только для первых вхождений ответов."""
+    seen = set()
+    with open(path, 'r', encoding='utf-8') as infile:
         for line in infile:
             try:
                 data = json.loads(line.strip())
-                data_str = json.dumps(data, sort_keys=True)
-                if data_str not in unique_objects:
-                    unique_objects[data_str] = data
             except json.JSONDecodeError:
                 continue
+            digest = _sample_digest(data)
+            if digest in seen:
+                continue
+            seen.add(digest)
+            yield data.get('maxk', 0), json.dumps(data, ensure_ascii=False)
+
 
-    sorted_data = sorted(unique_objects.values(), key=lambda obj: obj.get('maxk', 0))
+def _write_run(run, tmp_dir):
+    run.sort(key=lambda item: item[:2])
+    spill = tempfile.TemporaryFile('w+', encoding='utf-8', dir=tmp_dir)
+    for maxk, seq, line in run:
+        spill.write(f"{json.dumps(maxk)}\t{seq}\t{line}\n")
+    spill.seek(0)
+    return spill
 
-    with open(DEDUPLICATED_PATH, 'w', encoding='utf-8') as outfile:
-        for obj in sorted_data:
-            outfile.write(json.dumps(obj, ensure_ascii=False) + "\n")
-    print("[Очистка] Дубликаты удалены, результат сохранен.")
+
+def _read_run(spill):
+    for row in spill:
+        maxk, seq, line = row.rstrip('\n').split('\t', 2)
+        yield json.loads(maxk), int(seq), line
+
+
+def _sorted_by_maxk(samples, memory_budget, tmp_dir=None):
+    """
+    Сортирует (maxk, строка) по maxk с сохранением исходного порядка равных.
+    Пока данные помещаются в memory_budget байт, сортировка идет в памяти; иначе
+    отсортированные серии сбрасываются во временные файлы и сливаются через heapq.merge.
+    """
+    runs, run, run_size = [], [], 0
+    try:
+        for seq, (maxk, line) in enumerate(samples):
+            run.append((maxk, seq, line))
+            run_size += len(line) + 64
+            if run_size >= memory_budget:
+                runs.append(_write_run(run, tmp_dir))
+                run, run_size = [], 0
+
+        run.sort(key=lambda item: item[:2])
+        if not runs:
+            for _, _, line in run:
+                yield line
+            return
+        streams = [_read_run(spill) for spill in runs] + [iter(run)]
+        for _, _, line in heapq.merge(*streams, key=lambda item: item[:2]):
+            yield line
+    finally:
+        for spill in runs:
+            spill.close()
+
+
+def remove_duplicates(source=None, target=None, memory_budget=None):
+    """
+    Удаляет повторные ответы из сырых данных и упорядочивает их по maxk.
+    Работает потоково: в памяти держатся только 16-байтовые хэши ответов и
+    текущая серия сортировки (не больше memory_budget байт, по умолчанию BUS_DATA_DEDUP_MEMORY_BUDGET).
+    """
+    source = source or FULL_DATA_PATH
+    target = target or DEDUPLICATED_PATH
+    memory_budget = memory_budget or DEDUP_MEMORY_BUDGET
+    print("[Очистка] Удаление дубликатов...")
+    if not source.exists():
+        print("[Очистка] Файл с сырыми данными не найден. Пропускаем шаг.")
+        return
+
+    written = 0
+    with open(target, 'w', encoding='utf-8') as outfile:
+        for line in _sorted_by_maxk(_iter_unique_samples(source), memory_budget, tmp_dir=target.parent):
+            outfile.write(line + "\n")
+            written += 1
+    print(f"[Очистка] Дубликаты удалены, уникальных ответов: {written}, результат сохранен.")
 
 def sort_by_route():
     print("[Сортировка] Сортировка по маршрутам...")
@@ -154,25 +203,110 @@ def run_collection_pipeline(parse_duration_seconds=300):
     sort_by_route()
 
 
-def run_import_pipeline():
+def run_streaming_pipeline(duration_seconds=300, loader=None, raw_file=False):
+    """
+    Однопроходный конвейер: ответы сборщика -> отсев повторов -> разбиение по маршрутам ->
+    пакетная запись в БД. Промежуточные файлы не создаются; с raw_file=True сырые ответы
+    дополнительно пишутся в FULL_DATA_PATH, как в файловом режиме.
+    Запись в БД идет в отдельном потоке, чтобы не блокировать цикл событий сборщика;
+    позиции появляются в VehiclePosition через несколько секунд после опроса.
+    """
+    print(f"[Конвейер] Потоковый сбор и импорт на {duration_seconds} секунд...")
+    ensure_future_partitions()
+    writer = PositionStreamWriter(loader=loader)
+    samples = queue.Queue()
+    seen = set()
+
+    def write_loop():
+        try:
+            while True:
+                try:
+                    data = samples.get(timeout=writer.flush_interval)
+                except queue.Empty:
+                    if writer.buffered:
+                        writer.flush()
+                    continue
+                if data is None:
+                    break
+                writer.add_sample(data)
+            writer.flush()
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=write_loop, name='position-writer', daemon=True)
+    thread.start()
+
+    raw_sink = None
+    if raw_file:
+        DATA_DIR.mkdir(exist_ok=True)
+        raw_sink = open(FULL_DATA_PATH, 'w', encoding='utf-8')
 
+    def on_sample(data):
+        digest = _sample_digest(data)
+        if digest in seen:
+            return
+        seen.add(digest)
+        if raw_sink:
+            raw_sink.write(json.dumps(data, ensure_ascii=False) + '\n')
+        samples.put(data)
 
+    try:
+        collect(BASE_URL, PARAMS, duration_seconds, headers=HEADERS, main_page_url=MAIN_PAGE_URL, on_sample=on_sample)
+    finally:
+        samples.put(None)
+        thread.join()
+        if raw_sink:
+            raw_sink.close()
+
+    stats = writer.stats
+    print(f"[Конвейер] Завершено. Ответов: {stats['samples']}, создано позиций: {stats['created']}, "
+          f"пропущено (повторы и битые записи): {stats['skipped']}")
+    return stats
+
+
+def run_import_pipeline(loader=None, workers=None, incremental=None):
+    """
+    Импортирует файлы из sorted_routes в БД.
+    loader — способ записи позиций ('orm' или 'copy'), по умолчанию BUS_DATA_IMPORT_LOADER.
+    workers — сколько процессов разбирают файлы (по умолчанию BUS_DATA_IMPORT_WORKERS);
+    при workers > 1 файлы маршрутов разбираются параллельно: в пуле процессов, а в воркере
+    django-q (демон-процессе, которому нельзя запускать дочерние процессы) — в workers задачах
+    django-q по группам файлов.
+    incremental — пропускать уже загруженные файлы и позиции старше отметок маршрутов
+    (по умолчанию BUS_DATA_IMPORT_INCREMENTAL), так что повторный запуск почти ничего не делает.
+    Возвращает IngestJob, если файлы розданы задачам django-q (импорт еще идет), иначе None.
+    """
     print("[Импорт] Запуск импорта в базу данных...")
     if SORTED_DIR.exists():
         files_to_import = list(SORTED_DIR.glob('*.json'))
         if files_to_import:
             print(f"[Импорт] Найдено файлов для импорта: {len(files_to_import)}")
-            file_streams = [open(path, 'rb') for path in files_to_import]
-            try:
-                result = import_bus_data_from_files(file_streams)
-                print(f"[Импорт] Завершено. Создано новых записей: {result['total_positions_created']}")
-                if result['errors']:
-                    print("[Импорт] Ошибки:")
-                    for error in result['errors']:
-                        print(f" - {error}")
-            finally:
-                for stream in file_streams:
-                    stream.close()
+            ensure_future_partitions()
+            workers = workers or IMPORT_WORKERS or os.cpu_count()
+            incremental = IMPORT_INCREMENTAL if incremental is None else incremental
+            if workers > 1 and multiprocessing.current_process().daemon:
+                job = dispatch_route_files(files_to_import, workers, loader=loader, incremental=incremental)
+                print(f"[Импорт] Файлы розданы задачам django-q, ход импорта — задача импорта #{job.pk}.")
+                return job
+            if workers > 1:
+                print(f"[Импорт] Параллельный разбор файлов в {workers} процессах.")
+                result = import_bus_data_parallel(files_to_import, workers=workers, loader=loader, incremental=incremental)
+            else:
+                file_streams = [open(path, 'rb') for path in files_to_import]
+                try:
+                    result = import_bus_data_from_files(file_streams, loader=loader, incremental=incremental)
+                finally:
+                    for stream in file_streams:
+                        stream.close()
+            print(f"[Импорт] Завершено. Создано новых записей: {result['total_positions_created']}, "
+                  f"отброшено дубликатов: {result['total_positions_deduplicated']}, "
+                  f"старше отметки маршрута: {result['total_positions_below_watermark']}, "
+                  f"пропущено всего: {result['total_positions_skipped']}, "
+                  f"уже загруженных файлов: {len(result['skipped_files'])}")
+            if result['errors']:
+                print("[Импорт] Ошибки:")
+                for error in result['errors']:
+                    print(f" - {error}")
         else:
             print("[Импорт] Не найдено файлов для импорта в папке 'sorted_routes'.")
     else:
@@ -0,0 +1,208 @@
+# project/decoding.py
+"""
+Пакетное декодирование меток irkbus в столбцы NumPy.
+
+Вместо разбора каждой записи по отдельности (float, strptime, make_aware, Point)
+список bus_data/anims целиком превращается в массивы: координаты пересчитываются
+векторно, время "ДД.ММ.ГГГГ ЧЧ:ММ:СС" разбирается по фиксированным позициям символов,
+а битые записи отсеиваются масками. Загрузчики в БД получают эти массивы напрямую.
+"""
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.utils import timezone
+
+# Пересчет "сырых" координат irkbus в градусы WGS 84
+LAT_SCALE, LAT_SHIFT = 1571673, 0.002005
+LON_SCALE, LON_SHIFT = 1467000, 0.002415
+
+# Длина строки времени "12.12.2025 03:14:49" и позиции ее разделителей
+LASTTIME_LENGTH = 19
+_SEPARATORS = {2: '.', 5: '.', 10: ' ', 13: ':', 16: ':'}
+_DIGITS = [i for i in range(LASTTIME_LENGTH) if i not in _SEPARATORS]
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _float_column(values):
+    """Столбец float64; значения, которые нельзя привести к числу, становятся NaN."""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([_to_float(value) for value in values], dtype=np.float64)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _int_column(values):
+    """Столбец int16 для скорости и азимута: пустые и нечисловые значения становятся 0."""
+    column = _float_column([0 if value is None else value for value in values])
+    column[~np.isfinite(column)] = 0
+    return column.astype(np.int16)
+
+
+def _days_from_civil(year, month, day):
+    """Число дней от 1970-01-01 для массивов года, месяца и дня (алгоритм Хиннанта)."""
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def _local_to_utc(naive_seconds):
+    """
+    Переводит секунды "локального" времени (TIME_ZONE) в секунды UTC.
+    Смещение часового пояса вычисляется один раз на каждый встречающийся час.
+    """
+    tz = timezone.get_current_timezone()
+    if tz.utcoffset(datetime(2000, 1, 1)) == timedelta(0) and tz.utcoffset(datetime(2000, 7, 1)) == timedelta(0):
+        return naive_seconds
+    hours, inverse = np.unique(naive_seconds // 3600, return_inverse=True)
+    offsets = np.array([
+        int(tz.utcoffset(datetime(1970, 1, 1) + timedelta(hours=int(hour))).total_seconds()) for hour in hours
+    ], dtype=np.int64)
+    return naive_seconds - offsets[inverse]
+
+
+def parse_lasttime(values):
+    """
+    Разбирает строки вида "ДД.ММ.ГГГГ ЧЧ:ММ:СС" (время TIME_ZONE).
+    Возвращает (секунды UTC int64, маска корректных значений).
+    """
+    strings = np.array([value if isinstance(value, str) else '' for value in values], dtype=f'U{LASTTIME_LENGTH + 1}')
+    codes = strings.view(np.uint32).reshape(len(strings), LASTTIME_LENGTH + 1).astype(np.int64)
+
+    valid = codes[:, LASTTIME_LENGTH] == 0
+    for position, separator in _SEPARATORS.items():
+        valid &= codes[:, position] == ord(separator)
+    digits = codes[:, _DIGITS] - ord('0')
+    valid &= ((digits >= 0) & (digits <= 9)).all(axis=1)
+
+    def number(*positions):
+        result = np.zeros(len(strings), dtype=np.int64)
+        for position in positions:
+            result = result * 10 + (codes[:, position] - ord('0'))
+        return result
+
+    day, month, year = number(0, 1), number(3, 4), number(6, 7, 8, 9)
+    hour, minute, second = number(11, 12), number(14, 15), number(17, 18)
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (hour <= 23) & (minute <= 59) & (second <= 59)
+    days_in_month = _days_from_civil(year + (month == 12), np.where(month == 12, 1, month + 1), 1) - \
+        _days_from_civil(year, np.clip(month, 1, 12), 1)
+    valid &= day <= days_in_month
+
+    naive = _days_from_civil(year, np.clip(month, 1, 12), day) * 86400 + hour * 3600 + minute * 60 + second
+    seconds = np.where(valid, naive, 0)
+    if valid.any():
+        seconds[valid] = _local_to_utc(naive[valid])
+    return seconds, valid
+
+
+def epoch_to_datetime(seconds):
+    return _EPOCH + timedelta(seconds=int(seconds))
+
+
+class PositionArrays:
+    """
+    Столбцы разобранных меток одной пачки: gos_num (object), timestamp (секунды UTC, int64),
+    lon, lat (float64), speed, direction (int16).
+    """
+    __slots__ = ('gos_num', 'timestamp', 'lon', 'lat', 'speed', 'direction')
+
+    def __init__(self, gos_num, timestamp, lon, lat, speed, direction):
+        self.gos_num = gos_num
+        self.timestamp = timestamp
+        self.lon = lon
+        self.lat = lat
+        self.speed = speed
+        self.direction = direction
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def take(self, index):
+        """Подмножество строк по маске или массиву индексов."""
+        return PositionArrays(*(getattr(self, name)[index] for name in self.__slots__))
+
+    @classmethod
+    def concat(cls, batches):
+        batches = list(batches)
+        if not batches:
+            return decode_bus_data([])[0]
+        return cls(*(np.concatenate([getattr(batch, name) for batch in batches]) for name in cls.__slots__))
+
+
+def decode_bus_data(items):
+    """
+    Декодирует список записей irkbus (bus_data или anims) в PositionArrays.
+    Записи без гос. номера, с нечисловыми координатами или некорректным временем отбрасываются.
+    Возвращает (PositionArrays, число отброшенных записей).
+    """
+    gos_num = np.array([item.get('gos_num') or '' for item in items], dtype=object)
+    raw_lat = _float_column([item.get('lat') for item in items])
+    raw_lon = _float_column([item.get('lon') for item in items])
+    timestamp, valid = parse_lasttime([item.get('lasttime') for item in items])
+
+    valid &= (gos_num != '') & np.isfinite(raw_lat) & np.isfinite(raw_lon)
+    positions = PositionArrays(
+        gos_num=gos_num,
+        timestamp=timestamp,
+        lon=raw_lon / LON_SCALE - LON_SHIFT,
+        lat=raw_lat / LAT_SCALE - LAT_SHIFT,
+        speed=_int_column([item.get('speed', 0) for item in items]),
+        direction=_int_column([item.get('dir', 0) for item in items]),
+    )
+    if valid.all():
+        return positions, 0
+    return positions.take(valid), int(len(valid) - valid.sum())
+
+
+class PositionRecords:
+    """
+    Пачка позиций для записи в БД: столбцы vehicle_id, timestamp (секунды UTC), lon, lat,
+    speed, direction и route_id (одно значение на пачку или массив).
+    Без дубликатов по (vehicle_id, timestamp) — это обеспечивает вызывающий код.
+    """
+    __slots__ = ('vehicle_id', 'route_id', 'timestamp', 'lon', 'lat', 'speed', 'direction')
+
+    def __init__(self, vehicle_id, route_id, timestamp, lon, lat, speed, direction):
+        self.vehicle_id = np.asarray(vehicle_id, dtype=np.int64)
+        self.route_id = np.broadcast_to(np.asarray(route_id, dtype=object), self.vehicle_id.shape)
+        self.timestamp = np.asarray(timestamp, dtype=np.int64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.speed = np.asarray(speed, dtype=np.int16)
+        self.direction = np.asarray(direction, dtype=np.int16)
+
+    def __len__(self):
+        return len(self.vehicle_id)
+
+    def take(self, index):
+        return PositionRecords(*(getattr(self, name)[index] for name in self.__slots__))
+
+    def time_range(self):
+        """(самая ранняя, самая поздняя) метка времени пачки как aware datetime."""
+        return epoch_to_datetime(self.timestamp.min()), epoch_to_datetime(self.timestamp.max())
+
+    def rows(self):
+        """Построчно: (vehicle_id, route_id, datetime UTC, lon, lat, speed, direction) с типами Python."""
+        return zip(
+            self.vehicle_id.tolist(), self.route_id.tolist(),
+            [epoch_to_datetime(seconds) for seconds in self.timestamp.tolist()],
+            self.lon.tolist(), self.lat.tolist(), self.speed.tolist(), self.direction.tolist(),
+        )
+
+    def latest_per_vehicle(self):
+        """Самая свежая позиция каждого ТС пачки."""
+        order = np.lexsort((self.timestamp, self.vehicle_id))
+        vehicles = self.vehicle_id[order]
+        last = np.append(vehicles[1:] != vehicles[:-1], True)
+        return self.take(order[last])
@@ -0,0 +1,248 @@
+# project/exports.py
+"""
+Потоковые генераторы для экспорта остановок и позиций ТС.
+
+Данные читаются серверным курсором (QuerySet.iterator) порциями по EXPORT_CHUNK_SIZE,
+координаты берутся прямо из БД через ST_X/ST_Y, без создания GEOS-объектов на строку,
+а ответ отдается кусками — память не зависит от объема выгрузки.
+"""
+
+import csv
+import json
+
+from django.conf import settings
+from django.db.models import BigIntegerField, F, FloatField, Func
+
+from .models import Stop, Vehicle, VehiclePosition
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+class _Echo:
+    """Псевдо-файл для csv.writer: возвращает записанную строку вместо буферизации."""
+    def write(self, value):
+        return value
+
+
+def _lon():
+    return Func(F('location'), function='ST_X', output_field=FloatField())
+
+
+def _lat():
+    return Func(F('location'), function='ST_Y', output_field=FloatField())
+
+
+def _chunked(lines, chunk_size=EXPORT_CHUNK_SIZE):
+    """Склеивает мелкие строки в куски, чтобы не отдавать ответ по одной строке."""
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def route_positions_rows(route_id):
+    """Позиции маршрута в хронологическом порядке: (id, timestamp, gos_num, speed, direction, lat, lon)."""
+    return (
+        VehiclePosition.objects
+        .filter(route_id=route_id)
+        .order_by('timestamp')
+        .annotate(lat=_lat(), lon=_lon())
+        .values_list('id', 'timestamp', 'vehicle__gos_num', 'speed', 'direction', 'lat', 'lon')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def stops_rows():
+    """Остановки по алфавиту: (id, name, lat, lon); у остановок без координат lat/lon = None."""
+    return (
+        Stop.objects
+        .order_by('name')
+        .annotate(lat=_lat(), lon=_lon())
+        .values_list('id', 'name', 'lat', 'lon')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def iter_stops_csv():
+    writer = csv.writer(_Echo())
+    yield '\ufeff'
+    yield writer.writerow(['ID', 'Название остановки', 'Широта', 'Долгота'])
+    yield from _chunked(writer.writerow(row) for row in stops_rows())
+
+
+def iter_stops_geojson():
+    def features():
+        first = True
+        for stop_id, name, lat, lon in stops_rows():
+            if lat is None:
+                continue
+            feature = {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                "properties": {"id": stop_id, "name": name},
+            }
+            yield ('' if first else ',') + json.dumps(feature, ensure_ascii=False)
+            first = False
+
+    yield '{"type": "FeatureCollection", "features": ['
+    yield from _chunked(features())
+    yield ']}'
+
+
+def iter_route_positions_csv(route_id):
+    writer = csv.writer(_Echo())
+    yield '\ufeff'
+    yield writer.writerow(['ID Позиции', 'Время', 'Гос. номер ТС', 'Скорость (км/ч)', 'Направление', 'Широта', 'Долгота'])
+    yield from _chunked(
+        writer.writerow([pos_id, timestamp.strftime('%Y-%m-%d %H:%M:%S'), gos_num or '', speed, direction, lat, lon])
+        for pos_id, timestamp, gos_num, speed, direction, lat, lon in route_positions_rows(route_id)
+    )
+
+
+def iter_route_positions_json(route_id):
+    def items():
+        first = True
+        for pos_id, timestamp, gos_num, speed, direction, lat, lon in route_positions_rows(route_id):
+            item = {
+                "position_id": pos_id,
+                "timestamp": timestamp.isoformat(),
+                "latitude": lat,
+                "longitude": lon,
+                "speed": speed,
+                "direction": direction,
+                "vehicle_gos_num": gos_num,
+            }
+            yield ('' if first else ',') + json.dumps(item, ensure_ascii=False)
+            first = False
+
+    yield '['
+    yield from _chunked(items())
+    yield ']'
+
+
+# --- Колоночный экспорт истории позиций (Parquet / Arrow IPC) ---
+
+COLUMNAR_CHUNK_SIZE = getattr(settings, 'COLUMNAR_EXPORT_CHUNK_SIZE', 50000)
+
+# формат -> (content-type, расширение файла)
+COLUMNAR_FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+}
+
+
+class ColumnarExportUnavailable(RuntimeError):
+    """pyarrow не установлен — колоночный экспорт недоступен."""
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ColumnarExportUnavailable("Для колоночного экспорта нужен пакет pyarrow (pip install pyarrow).")
+    return pyarrow
+
+
+def _epoch_ms():
+    return Func(
+        F('timestamp'),
+        template="(EXTRACT(EPOCH FROM %(expressions)s) * 1000)::bigint",
+        output_field=BigIntegerField(),
+    )
+
+
+def position_columns_rows(route_id=None, vehicle_id=None, time_from=None, time_to=None):
+    """
+    Строки истории позиций для колоночного экспорта:
+    (id, epoch_ms, vehicle_id, route_id, lon, lat, speed, direction), по возрастанию времени.
+    """
+    queryset = VehiclePosition.objects.all()
+    if route_id:
+        queryset = queryset.filter(route_id=route_id)
+    if vehicle_id:
+        queryset = queryset.filter(vehicle_id=vehicle_id)
+    if time_from:
+        queryset = queryset.filter(timestamp__gte=time_from)
+    if time_to:
+        queryset = queryset.filter(timestamp__lt=time_to)
+    return (
+        queryset
+        .order_by('timestamp', 'id')
+        .annotate(epoch_ms=_epoch_ms(), lon=_lon(), lat=_lat())
+        .values_list('id', 'epoch_ms', 'vehicle_id', 'route_id', 'lon', 'lat', 'speed', 'direction')
+        .iterator(chunk_size=COLUMNAR_CHUNK_SIZE)
+    )
+
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_positions_columnar(sink, fmt='parquet', route_id=None, vehicle_id=None, time_from=None, time_to=None):
+    """
+    Пишет историю позиций в sink (путь или двоичный файл) в формате Parquet или Arrow IPC.
+    Данные читаются порциями по COLUMNAR_CHUNK_SIZE и записываются типизированными столбцами:
+    время — int64 (мс, UTC), координаты — float64, скорость и азимут — int16,
+    гос. номер — словарное кодирование. Возвращает число записанных строк.
+    """
+    if fmt not in COLUMNAR_FORMATS:
+        raise ValueError(f"Неизвестный формат: {fmt!r}. Доступны: {', '.join(COLUMNAR_FORMATS)}")
+    pa = _import_pyarrow()
+
+    # Словарь гос. номеров общий для всех пачек: индекс = позиция ТС в списке
+    vehicles = list(Vehicle.objects.order_by('id').values_list('id', 'gos_num'))
+    vehicle_index = {vehicle_pk: i for i, (vehicle_pk, _) in enumerate(vehicles)}
+    gos_num_dictionary = pa.array([gos_num for _, gos_num in vehicles], pa.string())
+
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('timestamp', pa.timestamp('ms', tz='UTC')),
+        ('vehicle_id', pa.int64()),
+        ('gos_num', pa.dictionary(pa.int32(), pa.string())),
+        ('route_id', pa.int64()),
+        ('lon', pa.float64()),
+        ('lat', pa.float64()),
+        ('speed', pa.int16()),
+        ('direction', pa.int16()),
+    ])
+    if fmt == 'parquet':
+        writer = pa.parquet.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+
+    rows_written = 0
+    try:
+        rows = position_columns_rows(route_id, vehicle_id, time_from, time_to)
+        for chunk in _batched(rows, COLUMNAR_CHUNK_SIZE):
+            ids, epoch_ms, vehicle_ids, route_ids, lons, lats, speeds, directions = zip(*chunk)
+            batch = pa.record_batch([
+                pa.array(ids, pa.int64()),
+                pa.array(epoch_ms, pa.int64()).cast(pa.timestamp('ms', tz='UTC')),
+                pa.array(vehicle_ids, pa.int64()),
+                pa.DictionaryArray.from_arrays(
+                    pa.array([vehicle_index[pk] for pk in vehicle_ids], pa.int32()), gos_num_dictionary
+                ),
+                pa.array(route_ids, pa.int64()),
+                pa.array(lons, pa.float64()),
+                pa.array(lats, pa.float64()),
+                pa.array(speeds, pa.int16()),
+                pa.array(directions, pa.int16()),
+            ], schema=schema)
+            writer.write_batch(batch)
+            rows_written += len(chunk)
+    finally:
+        writer.close()
+    return rows_written
@@ -0,0 +1,236 @@
+# project/heatmap.py
+"""
+Тепловая карта позиций и скоростей.
+
+Позиции агрегируются в PositionDensityCell: маршрут x час x квадратная ячейка сетки в проекции
+Web Mercator (HEATMAP_CELL_SIZE метров проекции), с числом позиций, суммой скоростей и
+гистограммой скоростей. Гистограммы и суммы складываются, поэтому запрос за любой интервал
+из целых часов, по любым маршрутам и с укрупнением ячеек считается по готовым агрегатам,
+а история позиций не читается. Ячейки и гистограммы складываются в PostgreSQL, в Python
+приходит по строке на итоговую ячейку. Интервал запроса ограничен: по умолчанию — последние
+HEATMAP_DEFAULT_DAYS суток, не длиннее HEATMAP_MAX_DAYS суток.
+
+Агрегаты обновляются после импорта: пересчитываются сутки, в которые импорт записал новые
+позиции маршрутов (отметки PositionChange), и только по этим маршрутам — в том числе
+поздние данные маршрута, пришедшие после более новых позиций других маршрутов. По агрегатам
+строятся и векторные тайлы истории на мелких масштабах (см. tiles.py): после обновления агрегатов
+вызывающий сбрасывает их кэш (invalidate_tiles((DENSITY_TILES,))).
+"""
+
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, ExpressionWrapper, F, Func, IntegerField, Max, Min, Sum
+from django.db.models.functions import Least, TruncHour
+from django.utils import timezone
+
+from .ledger import advance_stage_watermark, clear_position_changes, day_starts, pending_position_changes, stage_watermark
+from .models import AnalyticsWatermark, PositionChange, PositionDensityCell, VehiclePosition
+
+DENSITY_STAGE = 'position_density'
+
+# Размер ячейки сетки (м в проекции Web Mercator; на местности — в cos(широты) раз меньше)
+HEATMAP_CELL_SIZE = getattr(settings, 'BUS_HEATMAP_CELL_SIZE', 250)
+# Ширина корзины гистограммы скоростей и скорость, с которой начинается последняя корзина (км/ч)
+HEATMAP_SPEED_BIN = getattr(settings, 'BUS_HEATMAP_SPEED_BIN', 5)
+HEATMAP_SPEED_MAX = getattr(settings, 'BUS_HEATMAP_SPEED_MAX', 120)
+# Интервал запроса тепловой карты без from (сутки до to) и наибольший интервал запроса (сутки)
+HEATMAP_DEFAULT_DAYS = getattr(settings, 'BUS_HEATMAP_DEFAULT_DAYS', 7)
+HEATMAP_MAX_DAYS = getattr(settings, 'BUS_HEATMAP_MAX_DAYS', 31)
+
+MERCATOR_RADIUS = 6378137.0
+
+
+def speed_bin_count():
+    return HEATMAP_SPEED_MAX // HEATMAP_SPEED_BIN + 1
+
+
+def _cell_expression(axis):
+    return Func(
+        F('location'),
+        template=f"FLOOR(ST_{axis}(ST_Transform(%(expressions)s, 3857)) / {HEATMAP_CELL_SIZE})::integer",
+        output_field=IntegerField(),
+    )
+
+
+def _floor_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def aggregate_positions(time_from, time_to, route_ids=None):
+    """Агрегаты PositionDensityCell по позициям интервала [time_from, time_to) (не сохраняются)."""
+    positions = VehiclePosition.objects.filter(timestamp__gte=time_from, timestamp__lt=time_to)
+    if route_ids is not None:
+        positions = positions.filter(route_id__in=route_ids)
+    rows = (
+        positions.order_by()
+        .annotate(
+            hour=TruncHour('timestamp'),
+            cell_x=_cell_expression('X'),
+            cell_y=_cell_expression('Y'),
+            speed_bin=Least(ExpressionWrapper(F('speed') / HEATMAP_SPEED_BIN, output_field=IntegerField()), speed_bin_count() - 1),
+        )
+        .values('route_id', 'hour', 'cell_x', 'cell_y', 'speed_bin')
+        .annotate(positions=Count('id'), speed_total=Sum('speed'))
+        .values_list('route_id', 'hour', 'cell_x', 'cell_y', 'speed_bin', 'positions', 'speed_total')
+    )
+    cells = {}
+    for route_id, hour, cell_x, cell_y, speed_bin, positions, speed_total in rows:
+        cell = cells.get((route_id, hour, cell_x, cell_y))
+        if cell is None:
+            cell = cells[route_id, hour, cell_x, cell_y] = PositionDensityCell(
+                route_id=route_id, hour=hour, cell_size=HEATMAP_CELL_SIZE, cell_x=cell_x, cell_y=cell_y,
+                count=0, speed_sum=0, speed_histogram=[0] * speed_bin_count(),
+            )
+        cell.count += positions
+        cell.speed_sum += speed_total
+        cell.speed_histogram[speed_bin] += positions
+    return list(cells.values())
+
+
+def update_position_density(full=False):
+    """
+    Пересчитывает почасовые агрегаты за сутки и маршруты из отметок новых позиций.
+    full=True, отсутствие отметки стадии (первый запуск, удаление всех данных) и смена размера
+    ячейки или корзин в настройках — пересчет всей истории.
+    Возвращает {'hours', 'cells'}.
+    """
+    stale_layout = PositionDensityCell.objects.exclude(
+        cell_size=HEATMAP_CELL_SIZE, speed_histogram__len=speed_bin_count(),
+    ).exists()
+    stats = {'hours': 0, 'cells': 0}
+    marks = []
+    if full or stale_layout or stage_watermark(DENSITY_STAGE) is None:
+        PositionDensityCell.objects.all().delete()
+        AnalyticsWatermark.objects.filter(stage=DENSITY_STAGE).delete()
+        PositionChange.objects.filter(stage=DENSITY_STAGE).delete()
+        bounds = VehiclePosition.objects.aggregate(first=Min('timestamp'), last=Max('timestamp'))
+        if bounds['last'] is None:
+            return stats
+        # None — все маршруты
+        windows = {day: None for day in day_starts(bounds['first'], bounds['last'])}
+        latest = bounds['last']
+    else:
+        marks = pending_position_changes(DENSITY_STAGE)
+        if not marks:
+            return stats
+        windows = {}
+        for mark in marks:
+            for day in day_starts(mark.since, mark.until):
+                windows.setdefault(day, set()).add(mark.route_id)
+        latest = max(mark.until for mark in marks)
+
+    for time_from, route_ids in sorted(windows.items()):
+        time_to = time_from + timedelta(days=1)
+        cells = aggregate_positions(time_from, time_to, route_ids)
+        with transaction.atomic():
+            stale = PositionDensityCell.objects.filter(hour__gte=time_from, hour__lt=time_to)
+            if route_ids is not None:
+                stale = stale.filter(route_id__in=route_ids)
+            stale.delete()
+            PositionDensityCell.objects.bulk_create(cells, batch_size=5000)
+        stats['hours'] += len({cell.hour for cell in cells})
+        stats['cells'] += len(cells)
+    clear_position_changes(marks)
+    advance_stage_watermark(DENSITY_STAGE, None, latest)
+    return stats
+
+
+def mercator_xy(lon, lat):
+    lon, lat = np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+    return MERCATOR_RADIUS * np.radians(lon), MERCATOR_RADIUS * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def mercator_lonlat(x, y):
+    return np.degrees(np.asarray(x) / MERCATOR_RADIUS), np.degrees(2 * np.arctan(np.exp(np.asarray(y) / MERCATOR_RADIUS)) - np.pi / 2)
+
+
+def histogram_percentiles(histograms, bin_width, q):
+    """Процентиль q по каждой строке матрицы гистограмм с интерполяцией внутри корзины (NaN для пустых)."""
+    histograms = np.asarray(histograms, dtype=np.float64)
+    total = histograms.sum(axis=1)
+    cumulative = np.cumsum(histograms, axis=1)
+    target = q * total
+    index = np.minimum((cumulative < target[:, None]).sum(axis=1), histograms.shape[1] - 1)
+    rows = np.arange(len(histograms))
+    before = np.where(index > 0, cumulative[rows, np.maximum(index - 1, 0)], 0.0)
+    inside = histograms[rows, index]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        value = (index + (target - before) / inside) * bin_width
+    return np.where(total > 0, value, np.nan)
+
+
+_MERGE_SQL = """
+    WITH cells AS (
+        SELECT floor(c.cell_x / %s::float8)::integer AS x, floor(c.cell_y / %s::float8)::integer AS y,
+               c.count, c.speed_sum, c.speed_histogram
+        FROM ({cells}) c
+    ),
+    totals AS (
+        SELECT x, y, sum(count)::bigint AS count, sum(speed_sum)::bigint AS speed_sum FROM cells GROUP BY x, y
+    ),
+    bins AS (
+        SELECT x, y, bin, sum(n)::bigint AS n
+        FROM cells, unnest(speed_histogram) WITH ORDINALITY AS h(n, bin)
+        GROUP BY x, y, bin
+    )
+    SELECT t.x, t.y, t.count, t.speed_sum, array_agg(b.n ORDER BY b.bin)
+    FROM totals t JOIN bins b ON b.x = t.x AND b.y = t.y
+    GROUP BY t.x, t.y, t.count, t.speed_sum
+    ORDER BY t.x, t.y
+"""
+
+
+def heatmap_window(time_from=None, time_to=None):
+    """Интервал запроса: без to — до текущего момента, без from — HEATMAP_DEFAULT_DAYS суток до to."""
+    time_to = time_to or timezone.now()
+    time_from = time_from or time_to - timedelta(days=HEATMAP_DEFAULT_DAYS)
+    return time_from, time_to
+
+
+def heatmap(time_from=None, time_to=None, route_ids=None, bbox=None, scale=1):
+    """
+    Тепловая карта по готовым агрегатам: ячейки размером HEATMAP_CELL_SIZE * scale с числом позиций,
+    средней скоростью и 85-м процентилем скорости. Интервал округляется до целых часов
+    (без границ — см. heatmap_window), bbox — (min_lon, min_lat, max_lon, max_lat).
+    """
+    time_from, time_to = heatmap_window(time_from, time_to)
+    cells = PositionDensityCell.objects.filter(
+        cell_size=HEATMAP_CELL_SIZE, speed_histogram__len=speed_bin_count(),
+        hour__gte=_floor_hour(time_from), hour__lt=time_to,
+    )
+    if route_ids:
+        cells = cells.filter(route_id__in=route_ids)
+    if bbox is not None:
+        (x_min, x_max), (y_min, y_max) = mercator_xy(bbox[0::2], bbox[1::2])
+        cells = cells.filter(
+            cell_x__gte=int(x_min // HEATMAP_CELL_SIZE), cell_x__lte=int(x_max // HEATMAP_CELL_SIZE),
+            cell_y__gte=int(y_min // HEATMAP_CELL_SIZE), cell_y__lte=int(y_max // HEATMAP_CELL_SIZE),
+        )
+    cells_sql, params = cells.order_by().values('cell_x', 'cell_y', 'count', 'speed_sum', 'speed_histogram').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(_MERGE_SQL.format(cells=cells_sql), [scale, scale, *params])
+        rows = cursor.fetchall()
+    if not rows:
+        return []
+
+    x, y, counts, speed_sums, histograms = zip(*rows)
+    keys = np.stack((np.array(x, dtype=np.int64), np.array(y, dtype=np.int64)), axis=1)
+    counts = np.array(counts, dtype=np.float64)
+    speed_sums = np.array(speed_sums, dtype=np.float64)
+    p85 = histogram_percentiles(np.array(histograms, dtype=np.int64), HEATMAP_SPEED_BIN, 0.85)
+
+    size = HEATMAP_CELL_SIZE * scale
+    lon, lat = mercator_lonlat((keys[:, 0] + 0.5) * size, (keys[:, 1] + 0.5) * size)
+    return [
+        {
+            'x': int(keys[i, 0]), 'y': int(keys[i, 1]),
+            'lon': round(float(lon[i]), 6), 'lat': round(float(lat[i]), 6),
+            'count': int(counts[i]),
+            'mean_speed': round(float(speed_sums[i] / counts[i]), 1),
+            'p85_speed': round(float(p85[i]), 1),
+        }
+        for i in range(len(keys))
+    ]
@@ -0,0 +1,150 @@
+# project/ingest.py
+"""
+Асинхронный импорт загруженных файлов.
+
+Запрос на загрузку только сохраняет файлы в каталог задачи и ставит IngestJob в очередь
+django-q; разбор и запись в БД выполняет воркер, обновляя счетчики задачи после каждого
+файла, так что клиент может следить за ходом импорта через /api/ingest-jobs/<id>/.
+
+Файлы маршрутов из sorted_routes воркер django-q раздает нескольким задачам (воркеры — демон-процессы
+и не могут запускать пул процессов): каждая задача импортирует свою группу файлов и добавляет
+счетчики в общую IngestJob, а последняя завершившаяся часть закрывает ее.
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django_q.tasks import async_task
+
+from .models import IngestJob
+from .services import ReferenceResolver, import_bus_data_from_files
+
+# Куда складываются загруженные файлы до обработки
+SPOOL_DIR = Path(getattr(settings, 'BUS_DATA_INGEST_SPOOL_DIR', Path(settings.BASE_DIR) / 'data_processing_files' / 'uploads'))
+
+
+def spool_uploads(files):
+    """
+    Сохраняет загруженные файлы в отдельный каталог и создает задачу импорта.
+    Большие загрузки Django уже держит во временных файлах — они перемещаются без копирования.
+    """
+    job = IngestJob.objects.create(files_total=len(files))
+    job_dir = SPOOL_DIR / f"job_{job.pk}"
+    job_dir.mkdir(parents=True, exist_ok=True)
+
+    for index, uploaded_file in enumerate(files):
+        # Номер в имени сохраняет порядок и не дает одноименным файлам перезаписать друг друга
+        target = job_dir / f"{index:04d}_{Path(uploaded_file.name).name}"
+        if hasattr(uploaded_file, 'temporary_file_path'):
+            shutil.move(uploaded_file.temporary_file_path(), target)
+        else:
+            with open(target, 'wb') as out:
+                for chunk in uploaded_file.chunks():
+                    out.write(chunk)
+
+    job.spool_dir = str(job_dir)
+    job.save(update_fields=['spool_dir'])
+    return job
+
+
+def _original_name(path):
+    return path.name.split('_', 1)[1]
+
+
+def _add_result(job_id, result):
+    """Добавляет отчет импорта файла к счетчикам и ошибкам задачи."""
+    IngestJob.objects.filter(pk=job_id).update(
+        files_done=F('files_done') + 1,
+        positions_created=F('positions_created') + result['total_positions_created'],
+        positions_deduplicated=F('positions_deduplicated') + result['total_positions_deduplicated'],
+        positions_skipped=F('positions_skipped') + result['total_positions_skipped'],
+    )
+    if result['errors']:
+        with transaction.atomic():
+            job = IngestJob.objects.select_for_update().get(pk=job_id)
+            job.errors = job.errors + result['errors']
+            job.save(update_fields=['errors'])
+
+
+def run_ingest_job(job_id):
+    """Обрабатывает файлы задачи по одному и удаляет каталог после завершения."""
+    job = IngestJob.objects.get(pk=job_id)
+    job.status = IngestJob.STATUS_RUNNING
+    job.started_at = timezone.now()
+    job.save(update_fields=['status', 'started_at'])
+
+    job_dir = Path(job.spool_dir)
+    resolver = ReferenceResolver()
+    try:
+        for path in sorted(job_dir.iterdir()):
+            # Имя для отчета — исходное имя файла, без номера в каталоге задачи
+            with File(open(path, 'rb'), name=_original_name(path)) as f:
+                result = import_bus_data_from_files([f], resolver=resolver)
+            _add_result(job.pk, result)
+        job.status = IngestJob.STATUS_DONE
+    except Exception as e:
+        job.refresh_from_db(fields=['errors'])
+        job.errors = job.errors + [f"Критическая ошибка импорта: {e}"]
+        job.status = IngestJob.STATUS_FAILED
+        job.save(update_fields=['errors'])
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at'])
+    job.refresh_from_db()
+    return job
+
+
+def dispatch_route_files(paths, parts, loader=None, incremental=False):
+    """
+    Раздает файлы маршрутов parts задачам django-q (project.tasks.import_route_files_task).
+    Файлы делятся по размеру: следующий по величине файл достается наименее загруженной группе.
+    Возвращает IngestJob, по которой видно ход импорта.
+    """
+    groups = [[0, []] for _ in range(min(parts, len(paths)))]
+    for path in sorted(paths, key=os.path.getsize, reverse=True):
+        group = min(groups, key=lambda group: group[0])
+        group[0] += os.path.getsize(path)
+        group[1].append(str(path))
+    job = IngestJob.objects.create(
+        status=IngestJob.STATUS_RUNNING, started_at=timezone.now(),
+        spool_dir=str(Path(paths[0]).parent), files_total=len(paths),
+    )
+    for _, group_paths in groups:
+        async_task('project.tasks.import_route_files_task', job.pk, group_paths, loader, incremental)
+    return job
+
+
+def run_route_files_part(job_id, paths, loader=None, incremental=False):
+    """
+    Импортирует группу файлов маршрутов задачи (файлы не удаляются).
+    Возвращает IngestJob, если эта часть завершила задачу последней, иначе None.
+    """
+    resolver = ReferenceResolver()
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                result = import_bus_data_from_files([f], resolver=resolver, loader=loader, incremental=incremental)
+        except OSError as e:
+            result = {
+                'total_positions_created': 0, 'total_positions_deduplicated': 0, 'total_positions_skipped': 0,
+                'errors': [f"{Path(path).name}: {e}"],
+            }
+        _add_result(job_id, result)
+
+    # Счетчики частей складываются под блокировкой строки: закрывает задачу ровно одна часть
+    with transaction.atomic():
+        job = IngestJob.objects.select_for_update().get(pk=job_id)
+        if job.status != IngestJob.STATUS_RUNNING or job.files_done < job.files_total:
+            return None
+        job.status = IngestJob.STATUS_DONE
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'finished_at'])
+    return job
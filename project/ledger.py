@@ -0,0 +1,158 @@
+# project/ledger.py
+"""
+Журнал инкрементального импорта.
+
+Хранит хэши уже загруженных файлов (IngestedFile) и отметку по каждому маршруту —
+время самой поздней загруженной позиции (RouteImportWatermark). Повторный импорт
+тех же файлов пропускается целиком, а из новых файлов в БД уходят только позиции
+не старше отметки маршрута. Позиции ровно на отметке отправляются повторно:
+в ту же секунду могли прийти метки других ТС, а дубликаты отсеет уникальный ключ.
+
+Аналитические стадии (прохождения остановок и т.п.) ведут свои отметки в AnalyticsWatermark:
+до какого времени позиции маршрута уже обработаны. Стадиям из CHANGE_STAGES импорт, кроме того,
+сообщает, какие позиции он записал (PositionChange): они пересчитывают только затронутые
+ТС и интервалы, даже если позиции пришли позже более новых.
+"""
+
+import hashlib
+from datetime import timedelta
+
+import numpy as np
+from django.db import connection
+
+from .decoding import epoch_to_datetime
+from .models import AnalyticsWatermark, IngestedFile, PositionChange, RouteImportWatermark
+
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(file_obj):
+    """BLAKE2b содержимого файла (hex) и его размер; позиция в файле возвращается в начало."""
+    file_obj.seek(0)
+    digest = hashlib.blake2b(digest_size=32)
+    size = 0
+    for chunk in iter(lambda: file_obj.read(DIGEST_CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest(), size
+
+
+class IngestLedger:
+    """Доступ к журналу импорта с кэшем отметок маршрутов на время одного запуска."""
+
+    def __init__(self):
+        self._watermarks = None
+
+    def is_ingested(self, digest):
+        return IngestedFile.objects.filter(digest=digest).exists()
+
+    def record_file(self, digest, name, size, positions_created):
+        IngestedFile.objects.get_or_create(
+            digest=digest,
+            defaults={'name': name[-255:], 'size': size, 'positions_created': positions_created},
+        )
+
+    def watermark(self, route_id):
+        """Отметка маршрута в секундах UTC или None, если маршрут еще не импортировался."""
+        if self._watermarks is None:
+            self._watermarks = {
+                route: int(moment.timestamp())
+                for route, moment in RouteImportWatermark.objects.values_list('route_id', 'last_timestamp')
+            }
+        return self._watermarks.get(route_id)
+
+    def advance(self, route_id, epoch):
+        """Сдвигает отметку маршрута вперед (назад она не двигается)."""
+        current = self.watermark(route_id)
+        if current is not None and current >= epoch:
+            return
+        moment = epoch_to_datetime(epoch)
+        updated = RouteImportWatermark.objects.filter(route_id=route_id, last_timestamp__lt=moment).update(last_timestamp=moment)
+        if not updated:
+            RouteImportWatermark.objects.get_or_create(route_id=route_id, defaults={'last_timestamp': moment})
+        self._watermarks[route_id] = epoch
+
+
+def stage_watermark(stage, route_id=None):
+    """Отметка аналитической стадии (aware datetime) или None, если стадия еще не запускалась."""
+    return (
+        AnalyticsWatermark.objects.filter(stage=stage, route_id=route_id)
+        .values_list('processed_until', flat=True).first()
+    )
+
+
+def advance_stage_watermark(stage, route_id, moment):
+    """Сдвигает отметку стадии вперед (назад она не двигается)."""
+    updated = AnalyticsWatermark.objects.filter(
+        stage=stage, route_id=route_id, processed_until__lt=moment,
+    ).update(processed_until=moment)
+    if not updated:
+        AnalyticsWatermark.objects.get_or_create(stage=stage, route_id=route_id, defaults={'processed_until': moment})
+
+
+# Стадии, которые пересчитываются по отметкам новых позиций PositionChange
+CHANGE_STAGES = ('trips', 'position_density', 'activity_rollups')
+
+
+def record_position_changes(records):
+    """
+    Отмечает для стадий CHANGE_STAGES интервал позиций каждой пары (маршрут, ТС) пачки PositionRecords.
+    Один запрос INSERT ... ON CONFLICT: интервал существующей отметки только расширяется.
+    """
+    routed = np.array([route_id is not None for route_id in records.route_id.tolist()], dtype=bool)
+    if not routed.any():
+        return
+    route = records.route_id[routed].astype(np.int64)
+    vehicle, timestamp = records.vehicle_id[routed], records.timestamp[routed]
+    pairs, inverse = np.unique(np.stack((route, vehicle), axis=1), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    since = np.full(len(pairs), np.iinfo(np.int64).max)
+    until = np.full(len(pairs), np.iinfo(np.int64).min)
+    np.minimum.at(since, inverse, timestamp)
+    np.maximum.at(until, inverse, timestamp)
+
+    params = []
+    for stage in CHANGE_STAGES:
+        for (route_id, vehicle_id), first, last in zip(pairs.tolist(), since.tolist(), until.tolist()):
+            params += [stage, route_id, vehicle_id, epoch_to_datetime(first), epoch_to_datetime(last)]
+    values_sql = ', '.join(['(%s, %s, %s, %s, %s, 0)'] * (len(params) // 5))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {PositionChange._meta.db_table} AS mark (stage, route_id, vehicle_id, since, until, revision) "
+            f"VALUES {values_sql} "
+            f"ON CONFLICT (stage, route_id, vehicle_id) DO UPDATE SET "
+            f"since = LEAST(mark.since, EXCLUDED.since), until = GREATEST(mark.until, EXCLUDED.until), "
+            f"revision = mark.revision + 1",
+            params,
+        )
+
+
+def pending_position_changes(stage):
+    """Отметки новых позиций стадии: список PositionChange."""
+    return list(PositionChange.objects.filter(stage=stage).order_by('id'))
+
+
+def clear_position_changes(marks):
+    """
+    Удаляет обработанные отметки. Отметка, которую импорт успел расширить после чтения
+    (revision изменилась), остается до следующего запуска стадии.
+    """
+    if not marks:
+        return
+    values_sql = ', '.join(['(%s, %s)'] * len(marks))
+    params = [value for mark in marks for value in (mark.id, mark.revision)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {PositionChange._meta.db_table} AS mark USING (VALUES {values_sql}) AS done (id, revision) "
+            f"WHERE mark.id = done.id AND mark.revision = done.revision",
+            params,
+        )
+
+
+def day_starts(first, last):
+    """Начала суток (UTC) с суток момента first по сутки момента last включительно."""
+    day = first.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day <= last:
+        yield day
+        day += timedelta(days=1)
@@ -0,0 +1,146 @@
+# project/loaders.py
+"""
+Загрузчики позиций ТС в БД.
+
+Каждый загрузчик принимает пачку PositionRecords (столбцы NumPy: vehicle_id, route_id,
+timestamp в секундах UTC, lon, lat, speed, direction) без дубликатов по (vehicle_id, timestamp)
+и возвращает пару (вставлено, отброшено как уже существующие).
+"""
+
+import io
+
+from django.contrib.gis.geos import Point
+from django.db import connection, transaction
+
+from .models import VehicleLastPosition, VehiclePosition
+
+STAGING_TABLE = 'project_vehicleposition_staging'
+
+
+def load_positions_orm(records):
+    """Вставка через bulk_create; уже сохраненные позиции отсеиваются одним SELECT заранее."""
+    if not len(records):
+        return 0, 0
+
+    with transaction.atomic():
+        existing = set(
+            VehiclePosition.objects
+            .filter(
+                vehicle_id__in=set(records.vehicle_id.tolist()),
+                timestamp__range=records.time_range(),
+            )
+            .order_by()
+            .values_list('vehicle_id', 'timestamp')
+        )
+        new_positions = [
+            VehiclePosition(
+                vehicle_id=vehicle_id,
+                route_id=route_id,
+                timestamp=timestamp,
+                location=Point(lon, lat, srid=4326),
+                speed=speed,
+                direction=direction
+            )
+            for vehicle_id, route_id, timestamp, lon, lat, speed, direction in records.rows()
+            if (vehicle_id, timestamp) not in existing
+        ]
+        # ignore_conflicts лишь страхует от параллельных загрузок
+        VehiclePosition.objects.bulk_create(new_positions, ignore_conflicts=True)
+    return len(new_positions), len(records) - len(new_positions)
+
+
+def _copy_to_staging(cursor, data):
+    """COPY ... FROM STDIN и для psycopg2, и для psycopg 3."""
+    sql = (
+        f"COPY {STAGING_TABLE} (vehicle_id, route_id, epoch, lon, lat, speed, direction) FROM STDIN"
+    )
+    raw_cursor = cursor.cursor
+    if hasattr(raw_cursor, 'copy_expert'):
+        raw_cursor.copy_expert(sql, data)
+    else:
+        with raw_cursor.copy(sql) as copy:
+            copy.write(data.getvalue())
+
+
+def load_positions_copy(records):
+    """
+    Быстрый путь для PostgreSQL: COPY во временную (нежурналируемую) таблицу сессии,
+    затем INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+    Геометрия и метки времени собираются на стороне БД, объекты Point и datetime в Python не создаются:
+    текст для COPY строится прямо из столбцов пачки.
+    """
+    if not len(records):
+        return 0, 0
+
+    columns = (
+        map(str, records.vehicle_id.tolist()),
+        ('\\N' if route_id is None else str(route_id) for route_id in records.route_id.tolist()),
+        map(str, records.timestamp.tolist()),
+        map(repr, records.lon.tolist()),
+        map(repr, records.lat.tolist()),
+        map(str, records.speed.tolist()),
+        map(str, records.direction.tolist()),
+    )
+    data = io.StringIO(''.join('\t'.join(line) + '\n' for line in zip(*columns)))
+
+    table = VehiclePosition._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} ("
+            " vehicle_id bigint, route_id bigint, epoch bigint,"
+            " lon double precision, lat double precision, speed integer, direction integer"
+            ") ON COMMIT DELETE ROWS"
+        )
+        cursor.execute(f"TRUNCATE {STAGING_TABLE}")
+        _copy_to_staging(cursor, data)
+        cursor.execute(
+            f"INSERT INTO {table} (vehicle_id, route_id, \"timestamp\", location, speed, direction) "
+            f"SELECT vehicle_id, route_id, to_timestamp(epoch), ST_SetSRID(ST_MakePoint(lon, lat), 4326), speed, direction "
+            f"FROM {STAGING_TABLE} "
+            f"ON CONFLICT (vehicle_id, \"timestamp\") DO NOTHING"
+        )
+        inserted = cursor.rowcount
+    return inserted, len(records) - inserted
+
+
+def upsert_last_positions(records):
+    """
+    Обновляет снимок VehicleLastPosition по пачке записей: для каждого ТС берется самая
+    свежая позиция, и строка снимка перезаписывается только если она новее сохраненной.
+    Один запрос INSERT ... ON CONFLICT на пачку. Возвращает число обновленных ТС.
+    """
+    if not len(records):
+        return 0
+    latest = records.latest_per_vehicle()
+
+    table = VehicleLastPosition._meta.db_table
+    values_sql = ', '.join(['(%s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s, %s)'] * len(latest))
+    params = []
+    for row in latest.rows():
+        params += row
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} AS snapshot (vehicle_id, route_id, \"timestamp\", location, speed, direction) "
+            f"VALUES {values_sql} "
+            f"ON CONFLICT (vehicle_id) DO UPDATE SET "
+            f"route_id = EXCLUDED.route_id, \"timestamp\" = EXCLUDED.\"timestamp\", "
+            f"location = EXCLUDED.location, speed = EXCLUDED.speed, direction = EXCLUDED.direction "
+            f"WHERE EXCLUDED.\"timestamp\" > snapshot.\"timestamp\"",
+            params,
+        )
+        return cursor.rowcount
+
+
+POSITION_LOADERS = {
+    'orm': load_positions_orm,
+    'copy': load_positions_copy,
+}
+
+
+def get_position_loader(name):
+    """Возвращает функцию-загрузчик по имени ('orm' или 'copy')."""
+    try:
+        return POSITION_LOADERS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный загрузчик позиций: {name!r}. Доступны: {', '.join(POSITION_LOADERS)}")
@@ -0,0 +1,84 @@
+# project/management/commands/benchmark_position_loaders.py
+
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+import numpy as np
+
+from project.decoding import PositionRecords, decode_bus_data
+from project.loaders import POSITION_LOADERS
+from project.services import IMPORT_BATCH_SIZE, RTYPE_MAP, ReferenceResolver, iter_json_array_items
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость загрузчиков позиций (ORM и COPY) на одном JSON-файле маршрута. Данные в БД не сохраняются.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('json_file', type=str, help='Путь к JSON файлу маршрута (например, sorted_routes/route_1.json)')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Размер пачки')
+        parser.add_argument('--loader', action='append', choices=sorted(POSITION_LOADERS), help='Какие загрузчики сравнивать (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        json_file = Path(options['json_file'])
+        if not json_file.is_file():
+            raise CommandError(f"Файл не найден: {json_file}")
+        batch_size = options['batch_size']
+
+        header = {}
+        with open(json_file, 'r', encoding='utf-8') as f:
+            items = list(iter_json_array_items(f, 'bus_data', header))
+        started = time.perf_counter()
+        positions, _ = decode_bus_data(items)
+        decode_elapsed = time.perf_counter() - started
+        if not len(positions):
+            raise CommandError("В файле нет позиций для загрузки.")
+        self.stdout.write(f"Позиций в файле: {len(positions)}, размер пачки: {batch_size}, декодирование: {decode_elapsed:.3f} с")
+
+        try:
+            # Все изменения (включая созданные ТС и маршрут) откатываются в конце
+            with transaction.atomic():
+                resolver = ReferenceResolver()
+                route_id = header.get('route_id', items[0].get('rid'))
+                resolver.route_id(int(route_id), str(header.get('route_name', route_id)), RTYPE_MAP.get(items[0].get('rtype'), 'Автобус'))
+                gos_nums = positions.gos_num.tolist()
+                vehicle_ids = resolver.vehicle_ids(set(gos_nums))
+                vehicle_id = np.array([vehicle_ids[gos_num] for gos_num in gos_nums], dtype=np.int64)
+                _, first = np.unique(np.stack([vehicle_id, positions.timestamp], axis=1), axis=0, return_index=True)
+                first.sort()
+                records = PositionRecords(
+                    vehicle_id[first], int(route_id), positions.timestamp[first], positions.lon[first],
+                    positions.lat[first], positions.speed[first], positions.direction[first],
+                )
+
+                for name in options['loader'] or sorted(POSITION_LOADERS):
+                    self._run(name, records, batch_size)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, name, records, batch_size):
+        load_positions = POSITION_LOADERS[name]
+        inserted = deduplicated = 0
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                for start in range(0, len(records), batch_size):
+                    batch_inserted, batch_deduplicated = load_positions(records.take(slice(start, start + batch_size)))
+                    inserted += batch_inserted
+                    deduplicated += batch_deduplicated
+                elapsed = time.perf_counter() - started
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        rate = len(records) / elapsed if elapsed else float('inf')
+        self.stdout.write(self.style.SUCCESS(
+            f"{name:>5}: {elapsed:.3f} с, {rate:,.0f} строк/с, вставлено {inserted}, отброшено дубликатов {deduplicated}"
+        ))
@@ -0,0 +1,18 @@
+# project/management/commands/build_heatmap.py
+
+from django.core.management.base import BaseCommand
+
+from project.heatmap import update_position_density
+from project.tiles import DENSITY_TILES, invalidate_tiles
+
+
+class Command(BaseCommand):
+    help = 'Обновляет почасовые агрегаты тепловой карты позиций и скоростей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Пересчитать всю историю, а не только новые часы')
+
+    def handle(self, *args, **options):
+        stats = update_position_density(full=options['full'])
+        invalidate_tiles((DENSITY_TILES,))
+        self.stdout.write(self.style.SUCCESS(f"Часов: {stats['hours']}, ячеек: {stats['cells']}."))
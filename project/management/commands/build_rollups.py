@@ -0,0 +1,18 @@
+# project/management/commands/build_rollups.py
+
+from django.core.management.base import BaseCommand
+
+from project.rollups import update_activity_rollups
+
+
+class Command(BaseCommand):
+    help = 'Обновляет почасовые и суточные сводки работы маршрутов и ТС.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Пересчитать всю историю, а не только новые сутки')
+
+    def handle(self, *args, **options):
+        stats = update_activity_rollups(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Суток: {stats['days']}, сводок маршрутов: {stats['routes']}, ТС: {stats['vehicles']}."
+        ))
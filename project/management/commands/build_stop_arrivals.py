@@ -0,0 +1,20 @@
+# project/management/commands/build_stop_arrivals.py
+
+from django.core.management.base import BaseCommand
+
+from project.arrivals import update_stop_arrivals
+
+
+class Command(BaseCommand):
+    help = 'Находит прохождения остановок по новым позициям и обновляет почасовую статистику интервалов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', type=int, action='append', dest='route_ids', help='ID маршрута (можно несколько раз)')
+        parser.add_argument('--full', action='store_true', help='Пересчитать всю историю, а не только новые позиции')
+
+    def handle(self, *args, **options):
+        stats = update_stop_arrivals(route_ids=options['route_ids'], full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Маршрутов: {stats['routes']}, прохождений остановок: {stats['arrivals']}, "
+            f"часов статистики: {stats['hours']}."
+        ))
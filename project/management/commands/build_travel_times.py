@@ -0,0 +1,24 @@
+# project/management/commands/build_travel_times.py
+
+from django.core.management.base import BaseCommand
+
+from project.travel_times import apply_to_connections, update_travel_times
+
+
+class Command(BaseCommand):
+    help = 'Добавляет к гистограммам времени в пути по соединениям проезды из новых прохождений остановок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', type=int, action='append', dest='route_ids', help='ID маршрута (можно несколько раз)')
+        parser.add_argument('--full', action='store_true', help='Удалить накопленные гистограммы и построить их заново')
+        parser.add_argument('--apply', action='store_true', help='Записать медиану наблюдаемого времени в Connection.travel_time')
+        parser.add_argument('--min-count', type=int, default=None, help='Сколько проездов нужно для --apply')
+
+    def handle(self, *args, **options):
+        stats = update_travel_times(route_ids=options['route_ids'], full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Маршрутов: {stats['routes']}, обновлено интервалов соединений: {stats['rows']}."
+        ))
+        if options['apply']:
+            updated = apply_to_connections(min_count=options['min_count'])
+            self.stdout.write(self.style.SUCCESS(f"Обновлено время в пути у соединений: {updated}."))
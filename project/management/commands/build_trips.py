@@ -0,0 +1,22 @@
+# project/management/commands/build_trips.py
+
+from django.core.management.base import BaseCommand
+
+from project.trips import TRIP_SIMPLIFY_TOLERANCE, rebuild_trips
+
+
+class Command(BaseCommand):
+    help = 'Разбивает историю позиций ТС на рейсы и сохраняет их упрощенные траектории.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicle', type=int, action='append', dest='vehicle_ids', help='ID транспортного средства (можно несколько раз)')
+        parser.add_argument('--full', action='store_true', help='Пересобрать рейсы по всей истории, а не только новые')
+        parser.add_argument('--tolerance', type=float, default=TRIP_SIMPLIFY_TOLERANCE, help='Допуск упрощения траектории, м')
+
+    def handle(self, *args, **options):
+        stats = rebuild_trips(vehicle_ids=options['vehicle_ids'], full=options['full'], tolerance=options['tolerance'])
+        ratio = stats['points'] / stats['vertices'] if stats['vertices'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано ТС: {stats['vehicles']}, рейсов: {stats['trips']}, "
+            f"точек: {stats['points']} -> вершин: {stats['vertices']} (сжатие {ratio:.1f}x)."
+        ))
@@ -0,0 +1,39 @@
+# project/management/commands/export_positions_columnar.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+
+from project.exports import COLUMNAR_FORMATS, ColumnarExportUnavailable, write_positions_columnar
+
+
+def _parse_moment(value):
+    if value is None:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        raise CommandError(f"Некорректная дата: {value} (нужен формат ISO 8601)")
+    return make_aware(moment) if is_naive(moment) else moment
+
+
+class Command(BaseCommand):
+    help = 'Выгружает историю позиций ТС в Parquet или Arrow IPC для аналитики (pandas, polars).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', type=str, help='Путь к выходному файлу')
+        parser.add_argument('--format', choices=sorted(COLUMNAR_FORMATS), default='parquet', help='Формат файла')
+        parser.add_argument('--route', type=int, help='ID маршрута')
+        parser.add_argument('--vehicle', type=int, help='ID транспортного средства')
+        parser.add_argument('--from', dest='time_from', type=str, help='Начало интервала (ISO 8601, UTC по умолчанию)')
+        parser.add_argument('--to', dest='time_to', type=str, help='Конец интервала, не включительно')
+
+    def handle(self, *args, **options):
+        try:
+            rows = write_positions_columnar(
+                options['output'], options['format'],
+                route_id=options['route'], vehicle_id=options['vehicle'],
+                time_from=_parse_moment(options['time_from']), time_to=_parse_moment(options['time_to']),
+            )
+        except ColumnarExportUnavailable as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Выгружено {rows} позиций в {options['output']}."))
@@ -0,0 +1,79 @@
+# project/management/commands/import_bus_data.py
+
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from project.loaders import POSITION_LOADERS
+from project.services import (
+    IMPORT_BATCH_SIZE, IMPORT_LOADER, IMPORT_WORKERS, ReferenceResolver,
+    import_bus_data_from_files, import_bus_data_parallel,
+)
+from project.tiles import invalidate_tiles
+
+class Command(BaseCommand):
+    help = 'Импортирует данные о положении автобусов из JSON файлов, отсортированных по маршрутам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('json_dir', type=str, help='Путь к директории с JSON файлами (например, sorted_routes)')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Сколько позиций записывать за одну транзакцию')
+        parser.add_argument('--loader', choices=sorted(POSITION_LOADERS), default=IMPORT_LOADER, help='Способ записи позиций в БД')
+        parser.add_argument('--incremental', action='store_true', help='Пропускать уже загруженные файлы и позиции старше отметок маршрутов')
+        parser.add_argument('--workers', type=int, default=IMPORT_WORKERS, help='Сколько процессов разбирают файлы (больше 1 — параллельно)')
+
+    def handle(self, *args, **options):
+        json_dir = Path(options['json_dir'])
+        if not json_dir.is_dir():
+            raise CommandError(f"Директория не найдена: {json_dir}")
+
+        files_to_process = list(json_dir.glob('route_*.json'))
+        total_files = len(files_to_process)
+        self.stdout.write(f"Найдено {total_files} файлов для обработки.")
+
+        # Общий резолвер: справочник ТС и маршрутов загружается один раз на весь запуск
+        resolver = ReferenceResolver()
+
+        if options['workers'] and options['workers'] > 1:
+            self.stdout.write(f"Параллельный разбор в {options['workers']} процессах.")
+            result = import_bus_data_parallel(
+                files_to_process, workers=options['workers'], batch_size=options['batch_size'],
+                resolver=resolver, loader=options['loader'], incremental=options['incremental'],
+            )
+            for name in result['skipped_files']:
+                self.stdout.write(f"{name}: уже загружен, пропущен")
+            for report in result['files']:
+                self.stdout.write(f"{report['file']}: создано {report['created']}, пропущено {report['skipped']}")
+            for error in result['errors']:
+                self.stdout.write(self.style.ERROR(error))
+            self.stdout.write(self.style.SUCCESS(
+                f"\nИмпорт завершен. Создано {result['total_positions_created']} записей о позициях, "
+                f"отброшено дубликатов {result['total_positions_deduplicated']}, "
+                f"старше отметки маршрута {result['total_positions_below_watermark']}, "
+                f"пропущено всего {result['total_positions_skipped']}."
+            ))
+            invalidate_tiles()
+            return
+
+        for i, file_path in enumerate(files_to_process):
+            self.stdout.write(f"\n--- Обработка файла [{i+1}/{total_files}]: {file_path.name} ---")
+
+            with open(file_path, 'rb') as f:
+                result = import_bus_data_from_files(
+                    [f], batch_size=options['batch_size'],
+                    resolver=resolver, loader=options['loader'], incremental=options['incremental'],
+                )
+
+            if result['skipped_files']:
+                self.stdout.write("Файл уже загружен, пропущен.")
+                continue
+            for error in result['errors']:
+                self.stdout.write(self.style.ERROR(error))
+            self.stdout.write(self.style.SUCCESS(
+                f"Создано {result['total_positions_created']} записей о позициях, "
+                f"отброшено дубликатов {result['total_positions_deduplicated']}, "
+                f"старше отметки маршрута {result['total_positions_below_watermark']}, "
+                f"пропущено всего {result['total_positions_skipped']}."
+            ))
+
+        invalidate_tiles()
+        self.stdout.write(self.style.SUCCESS("\nИмпорт завершен."))
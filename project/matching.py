@@ -0,0 +1,249 @@
+# project/matching.py
+"""
+Геометрия маршрутов и привязка позиций ТС к маршруту (map-matching).
+
+У маршрута нет собственной геометрии, поэтому она строится по порядку RouteStop: ломаная
+через остановки с координатами. Результат хранится в RouteShape вместе с расстояниями
+до остановок и отпечатком их последовательности — при изменении остановок геометрия
+перестраивается при следующем обращении.
+
+RouteMatcher проецирует позиции на ломаную маршрута пачкой: отрезки заранее разложены
+по ячейкам равномерной сетки размером MATCH_MAX_DISTANCE, так что для каждой точки
+рассматриваются только отрезки ее ячейки, а проекция считается векторно сразу для всех
+точек и кандидатов. Результат — расстояние вдоль маршрута, отклонение от него и
+ближайшая по ходу маршрута остановка.
+"""
+
+import hashlib
+import json
+
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import LineString
+from django.db.models import F, FloatField, Func
+
+from .models import RouteShape, RouteStop, VehiclePosition
+from .trips import epoch_expression, local_xy
+
+# Позиции дальше этого расстояния от ломаной маршрута (м) считаются не привязанными
+MATCH_MAX_DISTANCE = getattr(settings, 'BUS_MATCH_MAX_DISTANCE', 150)
+# Сколько точек проецируется за раз: промежуточные матрицы имеют размер (точки x кандидаты)
+MATCH_CHUNK_SIZE = getattr(settings, 'BUS_MATCH_CHUNK_SIZE', 50000)
+
+# Процессный кэш сопоставителей: route_id -> (signature, RouteMatcher)
+_matchers = {}
+
+
+def _stop_sequence(route_id):
+    """Остановки маршрута с координатами по порядку: [(stop_id, lon, lat), ...]."""
+    return list(
+        RouteStop.objects.filter(route_id=route_id, stop__location__isnull=False)
+        .order_by('order')
+        .annotate(
+            lon=Func(F('stop__location'), function='ST_X', output_field=FloatField()),
+            lat=Func(F('stop__location'), function='ST_Y', output_field=FloatField()),
+        )
+        .values_list('stop_id', 'lon', 'lat')
+    )
+
+
+def _signature(stops):
+    return hashlib.blake2b(json.dumps(stops).encode('ascii'), digest_size=16).hexdigest()
+
+
+def build_route_shape(route_id, stops=None):
+    """
+    Строит и сохраняет геометрию маршрута. Если остановок с координатами меньше двух,
+    геометрии нет: сохраненная удаляется, возвращается None.
+    """
+    stops = _stop_sequence(route_id) if stops is None else stops
+    if len(stops) < 2:
+        RouteShape.objects.filter(route_id=route_id).delete()
+        return None
+    stop_ids, lon, lat = (np.array(column) for column in zip(*stops))
+    x, y = local_xy(lon, lat)
+    offsets = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))))
+    shape, _ = RouteShape.objects.update_or_create(route_id=route_id, defaults={
+        'path': LineString(list(zip(lon.tolist(), lat.tolist())), srid=4326),
+        'stop_ids': stop_ids.tolist(),
+        'stop_offsets': offsets.round(1).tolist(),
+        'length': round(float(offsets[-1]), 1),
+        'signature': _signature(stops),
+    })
+    return shape
+
+
+def get_route_shape(route_id):
+    """Сохраненная геометрия маршрута; перестраивается, если остановки маршрута изменились."""
+    stops = _stop_sequence(route_id)
+    shape = RouteShape.objects.filter(route_id=route_id).first()
+    if shape is not None and shape.signature == _signature(stops):
+        return shape
+    return build_route_shape(route_id, stops)
+
+
+class MatchedPositions:
+    """
+    Позиции одного маршрута, привязанные к его геометрии (столбцы NumPy):
+    vehicle_id, timestamp (секунды UTC), offset — расстояние вдоль маршрута (м),
+    distance — отклонение от маршрута (м), stop_index — индекс ближайшей остановки
+    в stop_ids, matched — позиция не дальше MATCH_MAX_DISTANCE от маршрута.
+    Для непривязанных позиций offset = NaN, stop_index = -1.
+    """
+    __slots__ = ('vehicle_id', 'timestamp', 'offset', 'distance', 'stop_index', 'matched', 'stop_ids')
+
+    def __init__(self, vehicle_id, timestamp, offset, distance, stop_index, matched, stop_ids):
+        self.vehicle_id = vehicle_id
+        self.timestamp = timestamp
+        self.offset = offset
+        self.distance = distance
+        self.stop_index = stop_index
+        self.matched = matched
+        self.stop_ids = stop_ids
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def nearest_stop_id(self):
+        """id ближайшей остановки для каждой позиции (-1 для непривязанных)."""
+        return np.where(self.stop_index >= 0, self.stop_ids[np.maximum(self.stop_index, 0)], -1)
+
+
+class RouteMatcher:
+    """Пакетная проекция точек на ломаную маршрута с сеточным индексом отрезков."""
+
+    def __init__(self, lon, lat, stop_offsets, max_distance=None):
+        self.max_distance = MATCH_MAX_DISTANCE if max_distance is None else max_distance
+        self.lat0 = float(np.mean(lat))
+        x, y = local_xy(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64), self.lat0)
+        self.x0, self.y0 = x[:-1], y[:-1]
+        self.dx, self.dy = np.diff(x), np.diff(y)
+        self.length2 = self.dx ** 2 + self.dy ** 2
+        self.stop_offsets = np.asarray(stop_offsets, dtype=np.float64)
+        self._build_grid(x, y)
+
+    def _build_grid(self, x, y):
+        """Раскладывает отрезки по ячейкам, которые задевает их рамка, расширенная на max_distance."""
+        cell = self.max_distance
+        self.origin = (x.min() - cell, y.min() - cell)
+        self.columns = int((x.max() - self.origin[0] + cell) // cell) + 1
+        self.rows = int((y.max() - self.origin[1] + cell) // cell) + 1
+
+        cells = [[] for _ in range(self.columns * self.rows)]
+        for segment in range(len(self.dx)):
+            (cx_min, cy_min), (cx_max, cy_max) = (
+                self._cell(min(x[segment], x[segment + 1]) - cell, min(y[segment], y[segment + 1]) - cell),
+                self._cell(max(x[segment], x[segment + 1]) + cell, max(y[segment], y[segment + 1]) + cell),
+            )
+            for cx in range(max(cx_min, 0), min(cx_max, self.columns - 1) + 1):
+                for cy in range(max(cy_min, 0), min(cy_max, self.rows - 1) + 1):
+                    cells[cx * self.rows + cy].append(segment)
+
+        # Таблица кандидатов: строка на ячейку, недостающие места заполнены -1
+        width = max(1, max(len(candidates) for candidates in cells))
+        self.candidates = np.full((len(cells), width), -1, dtype=np.int64)
+        for index, candidates in enumerate(cells):
+            self.candidates[index, :len(candidates)] = candidates
+
+    def _cell(self, x, y):
+        cell = self.max_distance
+        return int((x - self.origin[0]) // cell), int((y - self.origin[1]) // cell)
+
+    def match(self, lon, lat):
+        """
+        Проецирует точки на маршрут.
+        Возвращает (offset, distance, stop_index, matched) — столбцы, как в MatchedPositions.
+        """
+        x, y = local_xy(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64), self.lat0)
+        if len(x) <= MATCH_CHUNK_SIZE:
+            return self._match_chunk(x, y)
+        parts = [self._match_chunk(x[i:i + MATCH_CHUNK_SIZE], y[i:i + MATCH_CHUNK_SIZE]) for i in range(0, len(x), MATCH_CHUNK_SIZE)]
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def _match_chunk(self, x, y):
+        count = len(x)
+        cx = np.floor((x - self.origin[0]) / self.max_distance).astype(np.int64)
+        cy = np.floor((y - self.origin[1]) / self.max_distance).astype(np.int64)
+        inside = (cx >= 0) & (cx < self.columns) & (cy >= 0) & (cy < self.rows)
+        candidates = np.full((count, self.candidates.shape[1]), -1, dtype=np.int64)
+        candidates[inside] = self.candidates[cx[inside] * self.rows + cy[inside]]
+
+        segment = np.maximum(candidates, 0)
+        px, py = x[:, None] - self.x0[segment], y[:, None] - self.y0[segment]
+        length2 = self.length2[segment]
+        t = np.divide(px * self.dx[segment] + py * self.dy[segment], length2, out=np.zeros_like(px), where=length2 > 0)
+        t = np.clip(t, 0.0, 1.0)
+        gap = np.hypot(px - t * self.dx[segment], py - t * self.dy[segment])
+        gap[candidates < 0] = np.inf
+
+        best = np.argmin(gap, axis=1) if count else np.zeros(0, dtype=np.int64)
+        rows = np.arange(count)
+        distance = gap[rows, best]
+        matched = distance <= self.max_distance
+        best_segment = segment[rows, best]
+        offset = self.stop_offsets[best_segment] + t[rows, best] * np.sqrt(length2[rows, best])
+        offset[~matched] = np.nan
+
+        # Ближайшая по ходу маршрута остановка: одна из двух соседних по расстоянию вдоль маршрута
+        after = np.clip(np.searchsorted(self.stop_offsets, np.nan_to_num(offset)), 1, len(self.stop_offsets) - 1)
+        closer_to_previous = np.nan_to_num(offset) - self.stop_offsets[after - 1] < self.stop_offsets[after] - np.nan_to_num(offset)
+        stop_index = np.where(closer_to_previous, after - 1, after)
+        stop_index[~matched] = -1
+        return offset, distance, stop_index, matched
+
+
+def get_route_matcher(route_id):
+    """Сопоставитель для маршрута (из кэша процесса) и его геометрия; (None, None), если геометрии нет."""
+    shape = get_route_shape(route_id)
+    if shape is None:
+        _matchers.pop(route_id, None)
+        return None, None
+    cached = _matchers.get(route_id)
+    if cached is None or cached[0] != shape.signature:
+        lon, lat = zip(*shape.path.coords)
+        cached = (shape.signature, RouteMatcher(lon, lat, shape.stop_offsets))
+        _matchers[route_id] = cached
+    return cached[1], shape
+
+
+def match_positions(time_from=None, time_to=None, route_ids=None):
+    """
+    Привязывает к геометрии маршрутов все позиции интервала за один проход: позиции читаются
+    одним запросом в порядке (маршрут, ТС, время) и проецируются пачкой по каждому маршруту.
+    Возвращает {route_id: MatchedPositions}; маршруты без геометрии пропускаются.
+    """
+    queryset = VehiclePosition.objects.filter(route__isnull=False)
+    if time_from is not None:
+        queryset = queryset.filter(timestamp__gte=time_from)
+    if time_to is not None:
+        queryset = queryset.filter(timestamp__lt=time_to)
+    if route_ids is not None:
+        queryset = queryset.filter(route_id__in=route_ids)
+    rows = list(
+        queryset.order_by('route_id', 'vehicle_id', 'timestamp')
+        .annotate(
+            epoch=epoch_expression(),
+            lon=Func(F('location'), function='ST_X', output_field=FloatField()),
+            lat=Func(F('location'), function='ST_Y', output_field=FloatField()),
+        )
+        .values_list('route_id', 'vehicle_id', 'epoch', 'lon', 'lat')
+    )
+    if not rows:
+        return {}
+    route, vehicle, epoch, lon, lat = (np.array(column) for column in zip(*rows))
+    lon, lat = lon.astype(np.float64), lat.astype(np.float64)
+
+    result = {}
+    bounds = np.flatnonzero(np.diff(route)) + 1
+    for indices in np.split(np.arange(len(route)), bounds):
+        route_id = int(route[indices[0]])
+        matcher, shape = get_route_matcher(route_id)
+        if matcher is None:
+            continue
+        offset, distance, stop_index, matched = matcher.match(lon[indices], lat[indices])
+        result[route_id] = MatchedPositions(
+            vehicle_id=vehicle[indices].astype(np.int64), timestamp=epoch[indices].astype(np.int64),
+            offset=offset, distance=distance, stop_index=stop_index, matched=matched,
+            stop_ids=np.array(shape.stop_ids, dtype=np.int64),
+        )
+    return result
@@ -0,0 +1,91 @@
+# Переводит project_vehicleposition на декларативное секционирование PostgreSQL по времени.
+#
+# Секционированная таблица требует, чтобы первичный ключ включал ключ секционирования,
+# поэтому в БД PK становится (id, timestamp); для Django первичным ключом остается id.
+# Уже накопленные данные раскладываются по месячным секциям, всё, что не попало
+# ни в одну секцию, попадает в секцию по умолчанию. Новые секции создает project.partitioning.
+
+from django.db import migrations
+
+
+TABLE = 'project_vehicleposition'
+
+CONSTRAINTS_AND_INDEXES = f"""
+ALTER TABLE {TABLE} ADD CONSTRAINT project_vehicleposition_vehicle_id_timestamp_14524b73_uniq UNIQUE (vehicle_id, "timestamp");
+ALTER TABLE {TABLE} ADD CONSTRAINT project_vehicleposit_vehicle_id_731b1991_fk_project_v
+    FOREIGN KEY (vehicle_id) REFERENCES project_vehicle (id) DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE {TABLE} ADD CONSTRAINT project_vehicleposition_route_id_aab30067_fk_project_route_id
+    FOREIGN KEY (route_id) REFERENCES project_route (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX project_vehicleposition_timestamp_4590d13a ON {TABLE} ("timestamp");
+CREATE INDEX project_vehicleposition_vehicle_id_731b1991 ON {TABLE} (vehicle_id);
+CREATE INDEX project_vehicleposition_route_id_aab30067 ON {TABLE} (route_id);
+CREATE INDEX project_vehicleposition_location_2139b3c7_id ON {TABLE} USING GIST (location);
+"""
+
+PARTITION_SQL = f"""
+ALTER TABLE {TABLE} RENAME TO {TABLE}_unpartitioned;
+
+CREATE SEQUENCE {TABLE}_part_id_seq;
+CREATE TABLE {TABLE} (
+    id bigint NOT NULL DEFAULT nextval('{TABLE}_part_id_seq'),
+    "timestamp" timestamp with time zone NOT NULL,
+    location geometry(POINT, 4326) NOT NULL,
+    speed integer NOT NULL CHECK (speed >= 0),
+    direction integer NOT NULL CHECK (direction >= 0),
+    route_id bigint NULL,
+    vehicle_id bigint NOT NULL
+) PARTITION BY RANGE ("timestamp");
+CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT;
+
+DO $$
+DECLARE
+    month_start timestamp;
+    last_month timestamp;
+BEGIN
+    SELECT date_trunc('month', min("timestamp") AT TIME ZONE 'UTC'),
+           date_trunc('month', max("timestamp") AT TIME ZONE 'UTC')
+      INTO month_start, last_month
+      FROM {TABLE}_unpartitioned;
+    WHILE month_start <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF {TABLE} FOR VALUES FROM (%L) TO (%L)',
+            '{TABLE}_p' || to_char(month_start, 'YYYY_MM'),
+            month_start AT TIME ZONE 'UTC',
+            (month_start + interval '1 month') AT TIME ZONE 'UTC'
+        );
+        month_start := month_start + interval '1 month';
+    END LOOP;
+END $$;
+
+INSERT INTO {TABLE} (id, "timestamp", location, speed, direction, route_id, vehicle_id)
+SELECT id, "timestamp", location, speed, direction, route_id, vehicle_id FROM {TABLE}_unpartitioned;
+SELECT setval('{TABLE}_part_id_seq', COALESCE((SELECT max(id) FROM {TABLE}), 0) + 1, false);
+DROP TABLE {TABLE}_unpartitioned;
+
+ALTER SEQUENCE {TABLE}_part_id_seq RENAME TO {TABLE}_id_seq;
+ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id;
+ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, "timestamp");
+""" + CONSTRAINTS_AND_INDEXES
+
+UNPARTITION_SQL = f"""
+ALTER TABLE {TABLE} RENAME TO {TABLE}_partitioned;
+ALTER SEQUENCE {TABLE}_id_seq OWNED BY NONE;
+
+CREATE TABLE {TABLE} (LIKE {TABLE}_partitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+INSERT INTO {TABLE} SELECT * FROM {TABLE}_partitioned;
+DROP TABLE {TABLE}_partitioned;
+
+ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id;
+ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id);
+""" + CONSTRAINTS_AND_INDEXES
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0003_vehicle_vehicleposition'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_SQL, reverse_sql=UNPARTITION_SQL),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.23 on 2026-10-18 10:12
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0004_partition_vehicleposition'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vehicleposition',
+            index=models.Index(fields=['route', 'timestamp'], name='vehpos_route_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicleposition',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['timestamp'], name='vehpos_timestamp_brin'),
+        ),
+    ]
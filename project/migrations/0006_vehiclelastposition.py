@@ -0,0 +1,40 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:02
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Заполняем снимок по уже накопленной истории: самая свежая позиция каждого ТС
+BACKFILL_SQL = """
+INSERT INTO project_vehiclelastposition (vehicle_id, route_id, "timestamp", location, speed, direction)
+SELECT DISTINCT ON (vehicle_id) vehicle_id, route_id, "timestamp", location, speed, direction
+  FROM project_vehicleposition
+ ORDER BY vehicle_id, "timestamp" DESC;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0005_vehicleposition_route_timestamp_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleLastPosition',
+            fields=[
+                ('vehicle', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='last_position', serialize=False, to='project.vehicle', verbose_name='Транспорт')),
+                ('timestamp', models.DateTimeField(verbose_name='Время')),
+                ('location', django.contrib.gis.db.models.fields.PointField(srid=4326, verbose_name='Местоположение')),
+                ('speed', models.PositiveIntegerField(default=0, verbose_name='Скорость')),
+                ('direction', models.PositiveIntegerField(default=0, verbose_name='Направление (азимут)')),
+                ('route', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='project.route', verbose_name='Маршрут')),
+            ],
+            options={
+                'verbose_name': 'Последняя позиция ТС',
+                'verbose_name_plural': 'Последние позиции ТС',
+            },
+        ),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
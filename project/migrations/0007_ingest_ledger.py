@@ -0,0 +1,42 @@
+# Generated by Django 4.2.23 on 2026-10-18 13:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0006_vehiclelastposition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='Хэш содержимого (BLAKE2b)')),
+                ('name', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('size', models.BigIntegerField(default=0, verbose_name='Размер, байт')),
+                ('positions_created', models.PositiveIntegerField(default=0, verbose_name='Создано позиций')),
+                ('imported_at', models.DateTimeField(auto_now_add=True, verbose_name='Импортирован')),
+            ],
+            options={
+                'verbose_name': 'Импортированный файл',
+                'verbose_name_plural': 'Импортированные файлы',
+                'ordering': ['-imported_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RouteImportWatermark',
+            fields=[
+                ('route', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='import_watermark', serialize=False, to='project.route', verbose_name='Маршрут')),
+                ('last_timestamp', models.DateTimeField(verbose_name='Последняя загруженная позиция')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Отметка импорта маршрута',
+                'verbose_name_plural': 'Отметки импорта маршрутов',
+            },
+        ),
+    ]
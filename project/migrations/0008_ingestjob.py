@@ -0,0 +1,35 @@
+# Generated by Django 4.2.23 on 2026-10-18 14:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0007_ingest_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершена'), ('failed', 'Ошибка')], default='queued', max_length=16, verbose_name='Статус')),
+                ('spool_dir', models.CharField(max_length=500, verbose_name='Каталог с файлами')),
+                ('files_total', models.PositiveIntegerField(default=0, verbose_name='Всего файлов')),
+                ('files_done', models.PositiveIntegerField(default=0, verbose_name='Обработано файлов')),
+                ('positions_created', models.PositiveIntegerField(default=0, verbose_name='Создано позиций')),
+                ('positions_deduplicated', models.PositiveIntegerField(default=0, verbose_name='Отброшено дубликатов')),
+                ('positions_skipped', models.PositiveIntegerField(default=0, verbose_name='Пропущено позиций')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Ошибки')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начата')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+            ],
+            options={
+                'verbose_name': 'Задача импорта',
+                'verbose_name_plural': 'Задачи импорта',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
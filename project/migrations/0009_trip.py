@@ -0,0 +1,41 @@
+# Generated by Django 4.2.23 on 2026-10-18 16:40
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0008_ingestjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Trip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_time', models.DateTimeField(verbose_name='Начало')),
+                ('end_time', models.DateTimeField(verbose_name='Окончание')),
+                ('path', django.contrib.gis.db.models.fields.LineStringField(srid=4326, verbose_name='Траектория')),
+                ('time_deltas', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None, verbose_name='Интервалы между вершинами (сек)')),
+                ('points_total', models.PositiveIntegerField(default=0, verbose_name='Исходных точек')),
+                ('distance', models.FloatField(default=0, verbose_name='Пройденное расстояние (м)')),
+                ('tolerance', models.FloatField(default=0, verbose_name='Допуск упрощения (м)')),
+                ('route', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='project.route', verbose_name='Маршрут')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trips', to='project.vehicle', verbose_name='Транспорт')),
+            ],
+            options={
+                'verbose_name': 'Рейс',
+                'verbose_name_plural': 'Рейсы',
+                'ordering': ['start_time'],
+                'unique_together': {('vehicle', 'start_time')},
+                'indexes': [
+                    models.Index(fields=['route', 'start_time'], name='trip_route_start_idx'),
+                    models.Index(fields=['start_time'], name='trip_start_idx'),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.23 on 2026-10-18 17:35
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0009_trip'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteShape',
+            fields=[
+                ('route', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='shape', serialize=False, to='project.route', verbose_name='Маршрут')),
+                ('path', django.contrib.gis.db.models.fields.LineStringField(srid=4326, verbose_name='Геометрия')),
+                ('stop_ids', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), default=list, size=None, verbose_name='Остановки по порядку')),
+                ('stop_offsets', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), default=list, size=None, verbose_name='Расстояния до остановок (м)')),
+                ('length', models.FloatField(default=0, verbose_name='Длина (м)')),
+                ('signature', models.CharField(max_length=32, verbose_name='Отпечаток остановок')),
+                ('built_at', models.DateTimeField(auto_now=True, verbose_name='Построена')),
+            ],
+            options={
+                'verbose_name': 'Геометрия маршрута',
+                'verbose_name_plural': 'Геометрии маршрутов',
+            },
+        ),
+    ]
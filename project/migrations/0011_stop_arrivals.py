@@ -0,0 +1,76 @@
+# Generated by Django 4.2.23 on 2026-10-18 18:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0010_routeshape'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=32, verbose_name='Стадия')),
+                ('processed_until', models.DateTimeField(verbose_name='Обработано до')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+                ('route', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='project.route', verbose_name='Маршрут')),
+            ],
+            options={
+                'verbose_name': 'Отметка аналитики',
+                'verbose_name_plural': 'Отметки аналитики',
+                'unique_together': {('stage', 'route')},
+            },
+        ),
+        migrations.CreateModel(
+            name='StopArrival',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stop_index', models.PositiveIntegerField(verbose_name='Номер остановки в геометрии маршрута')),
+                ('arrival_time', models.DateTimeField(verbose_name='Прибытие')),
+                ('departure_time', models.DateTimeField(verbose_name='Отправление')),
+                ('dwell', models.PositiveIntegerField(default=0, verbose_name='Стоянка (сек)')),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='project.route', verbose_name='Маршрут')),
+                ('stop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='project.stop', verbose_name='Остановка')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stop_arrivals', to='project.vehicle', verbose_name='Транспорт')),
+            ],
+            options={
+                'verbose_name': 'Прохождение остановки',
+                'verbose_name_plural': 'Прохождения остановок',
+                'ordering': ['arrival_time'],
+                'indexes': [
+                    models.Index(fields=['route', 'arrival_time'], name='arrival_route_time_idx'),
+                    models.Index(fields=['stop', 'arrival_time'], name='arrival_stop_time_idx'),
+                    models.Index(fields=['vehicle', 'arrival_time'], name='arrival_vehicle_time_idx'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='RouteHeadwayStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='Час')),
+                ('arrivals', models.PositiveIntegerField(default=0, verbose_name='Прибытий')),
+                ('vehicles', models.PositiveIntegerField(default=0, verbose_name='ТС на маршруте')),
+                ('headway_count', models.PositiveIntegerField(default=0, verbose_name='Интервалов')),
+                ('headway_mean', models.FloatField(blank=True, null=True, verbose_name='Средний интервал')),
+                ('headway_median', models.FloatField(blank=True, null=True, verbose_name='Медианный интервал')),
+                ('headway_p90', models.FloatField(blank=True, null=True, verbose_name='Интервал, 90-й процентиль')),
+                ('headway_max', models.FloatField(blank=True, null=True, verbose_name='Наибольший интервал')),
+                ('headway_cv', models.FloatField(blank=True, null=True, verbose_name='Коэффициент вариации интервала')),
+                ('dwell_mean', models.FloatField(blank=True, null=True, verbose_name='Средняя стоянка')),
+                ('dwell_p90', models.FloatField(blank=True, null=True, verbose_name='Стоянка, 90-й процентиль')),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='headway_stats', to='project.route', verbose_name='Маршрут')),
+            ],
+            options={
+                'verbose_name': 'Интервалы маршрута за час',
+                'verbose_name_plural': 'Интервалы маршрутов по часам',
+                'ordering': ['hour'],
+                'unique_together': {('route', 'hour')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.23 on 2026-10-18 19:55
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0011_stop_arrivals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConnectionTravelTime',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.PositiveSmallIntegerField(verbose_name='Интервал суток')),
+                ('bin_seconds', models.PositiveSmallIntegerField(verbose_name='Ширина корзины (сек)')),
+                ('histogram', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None, verbose_name='Гистограмма')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Проездов')),
+                ('total_seconds', models.BigIntegerField(default=0, verbose_name='Суммарное время (сек)')),
+                ('p50', models.FloatField(blank=True, null=True, verbose_name='Медиана (сек)')),
+                ('p85', models.FloatField(blank=True, null=True, verbose_name='85-й процентиль (сек)')),
+                ('p95', models.FloatField(blank=True, null=True, verbose_name='95-й процентиль (сек)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+                ('connection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='travel_times', to='project.connection', verbose_name='Соединение')),
+            ],
+            options={
+                'verbose_name': 'Время в пути по соединению',
+                'verbose_name_plural': 'Время в пути по соединениям',
+                'ordering': ['connection', 'bucket'],
+                'unique_together': {('connection', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.23 on 2026-10-18 21:10
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0012_connectiontraveltime'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionDensityCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='Час')),
+                ('cell_size', models.PositiveIntegerField(verbose_name='Размер ячейки (м)')),
+                ('cell_x', models.IntegerField(verbose_name='Ячейка X')),
+                ('cell_y', models.IntegerField(verbose_name='Ячейка Y')),
+                ('count', models.PositiveIntegerField(verbose_name='Позиций')),
+                ('speed_sum', models.BigIntegerField(verbose_name='Сумма скоростей')),
+                ('speed_histogram', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None, verbose_name='Гистограмма скоростей')),
+                ('route', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='density_cells', to='project.route', verbose_name='Маршрут')),
+            ],
+            options={
+                'verbose_name': 'Ячейка плотности позиций',
+                'verbose_name_plural': 'Плотность позиций',
+                'ordering': ['hour', 'cell_x', 'cell_y'],
+                'indexes': [models.Index(fields=['hour'], name='density_hour_idx'), models.Index(fields=['route', 'hour'], name='density_route_hour_idx')],
+            },
+        ),
+    ]
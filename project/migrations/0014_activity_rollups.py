@@ -0,0 +1,56 @@
+# Generated by Django 4.2.23 on 2026-10-18 21:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0013_positiondensitycell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Час'), ('day', 'Сутки')], max_length=4, verbose_name='Период')),
+                ('start', models.DateTimeField(verbose_name='Начало периода')),
+                ('vehicles', models.PositiveIntegerField(verbose_name='ТС на маршруте')),
+                ('samples', models.PositiveIntegerField(verbose_name='Позиций')),
+                ('distance', models.FloatField(verbose_name='Пройдено (м)')),
+                ('speed_sum', models.BigIntegerField(verbose_name='Сумма скоростей')),
+                ('max_speed', models.PositiveIntegerField(verbose_name='Наибольшая скорость')),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_rollups', to='project.route', verbose_name='Маршрут')),
+            ],
+            options={
+                'verbose_name': 'Сводка по маршруту',
+                'verbose_name_plural': 'Сводки по маршрутам',
+                'ordering': ['start'],
+                'indexes': [models.Index(fields=['period', 'start'], name='route_rollup_period_idx')],
+                'unique_together': {('route', 'period', 'start')},
+            },
+        ),
+        migrations.CreateModel(
+            name='VehicleActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Час'), ('day', 'Сутки')], max_length=4, verbose_name='Период')),
+                ('start', models.DateTimeField(verbose_name='Начало периода')),
+                ('routes', models.PositiveIntegerField(verbose_name='Маршрутов')),
+                ('samples', models.PositiveIntegerField(verbose_name='Позиций')),
+                ('distance', models.FloatField(verbose_name='Пройдено (м)')),
+                ('speed_sum', models.BigIntegerField(verbose_name='Сумма скоростей')),
+                ('max_speed', models.PositiveIntegerField(verbose_name='Наибольшая скорость')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_rollups', to='project.vehicle', verbose_name='Транспорт')),
+            ],
+            options={
+                'verbose_name': 'Сводка по ТС',
+                'verbose_name_plural': 'Сводки по ТС',
+                'ordering': ['start'],
+                'indexes': [models.Index(fields=['period', 'start'], name='vehicle_rollup_period_idx')],
+                'unique_together': {('vehicle', 'period', 'start')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.23 on 2026-10-19 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0014_activity_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=32, verbose_name='Стадия')),
+                ('since', models.DateTimeField(verbose_name='Самая ранняя новая позиция')),
+                ('until', models.DateTimeField(verbose_name='Самая поздняя новая позиция')),
+                ('revision', models.PositiveIntegerField(default=0, verbose_name='Версия')),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='project.route', verbose_name='Маршрут')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='project.vehicle', verbose_name='Транспорт')),
+            ],
+            options={
+                'verbose_name': 'Новые позиции для аналитики',
+                'verbose_name_plural': 'Новые позиции для аналитики',
+                'unique_together': {('stage', 'route', 'vehicle')},
+            },
+        ),
+    ]
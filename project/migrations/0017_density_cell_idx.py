@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-20 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0016_indexversion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='positiondensitycell',
+            index=models.Index(fields=['cell_x', 'cell_y'], name='density_cell_idx'),
+        ),
+    ]
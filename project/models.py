@@ -2,6 +2,8 @@
 
 from django.db import models
 from django.contrib.gis.db import models as gis_models
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import BrinIndex
 
 class TransportType(models.Model):
     name = models.CharField("Название типа транспорта", max_length=100, unique=True)
@@ -115,6 +117,403 @@ class VehiclePosition(models.Model):
         verbose_name_plural = "Позиции ТС"
         ordering = ['-timestamp']
         unique_together = ('vehicle', 'timestamp') # Предотвращаем дублирование позиций одного ТС в одно время
+        indexes = [
+            # "Маршрут N с 08:00 до 09:00" — диапазонное сканирование одного индекса
+            models.Index(fields=['route', 'timestamp'], name='vehpos_route_timestamp_idx'),
+            # Компактный индекс по времени: данные пишутся почти в хронологическом порядке
+            BrinIndex(fields=['timestamp'], name='vehpos_timestamp_brin'),
+        ]
 
     def __str__(self):
-        return f"{self.vehicle.gos_num} @ {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
\ No newline at end of file
+        return f"{self.vehicle.gos_num} @ {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
+
+class VehicleLastPosition(models.Model):
+    """
+    Последняя известная позиция каждого ТС (снимок "где сейчас каждый автобус").
+    Обновляется импортом при поступлении более свежей отметки времени,
+    поэтому живая карта читает одну строку на ТС и не трогает историю.
+    """
+    vehicle = models.OneToOneField(Vehicle, on_delete=models.CASCADE, primary_key=True, related_name="last_position", verbose_name="Транспорт")
+    route = models.ForeignKey(Route, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Маршрут")
+    timestamp = models.DateTimeField("Время")
+    location = gis_models.PointField("Местоположение", srid=4326)
+    speed = models.PositiveIntegerField("Скорость", default=0)
+    direction = models.PositiveIntegerField("Направление (азимут)", default=0)
+
+    @property
+    def latitude(self):
+        return self.location.y if self.location else None
+
+    @property
+    def longitude(self):
+        return self.location.x if self.location else None
+
+    class Meta:
+        verbose_name = "Последняя позиция ТС"
+        verbose_name_plural = "Последние позиции ТС"
+
+    def __str__(self):
+        return f"{self.vehicle.gos_num} @ {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
+
+class IngestedFile(models.Model):
+    """Журнал импорта: файл с таким содержимым уже загружен и при повторном импорте пропускается."""
+    digest = models.CharField("Хэш содержимого (BLAKE2b)", max_length=64, unique=True)
+    name = models.CharField("Имя файла", max_length=255)
+    size = models.BigIntegerField("Размер, байт", default=0)
+    positions_created = models.PositiveIntegerField("Создано позиций", default=0)
+    imported_at = models.DateTimeField("Импортирован", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Импортированный файл"
+        verbose_name_plural = "Импортированные файлы"
+        ordering = ['-imported_at']
+
+    def __str__(self):
+        return f"{self.name} ({self.imported_at.strftime('%Y-%m-%d %H:%M:%S')})"
+
+class RouteImportWatermark(models.Model):
+    """
+    Отметка импорта по маршруту: самое позднее время позиции, загруженной из завершенных файлов.
+    При инкрементальном импорте более старые позиции маршрута в БД не отправляются.
+    """
+    route = models.OneToOneField(Route, on_delete=models.CASCADE, primary_key=True, related_name="import_watermark", verbose_name="Маршрут")
+    last_timestamp = models.DateTimeField("Последняя загруженная позиция")
+    updated_at = models.DateTimeField("Обновлено", auto_now=True)
+
+    class Meta:
+        verbose_name = "Отметка импорта маршрута"
+        verbose_name_plural = "Отметки импорта маршрутов"
+
+    def __str__(self):
+        return f"{self.route} до {self.last_timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
+
+class IngestJob(models.Model):
+    """
+    Фоновая задача импорта загруженных файлов. Файлы сохраняются на диск (spool_dir),
+    обрабатываются воркером django-q, а счетчики обновляются по мере продвижения.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Завершена'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    status = models.CharField("Статус", max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    spool_dir = models.CharField("Каталог с файлами", max_length=500)
+    files_total = models.PositiveIntegerField("Всего файлов", default=0)
+    files_done = models.PositiveIntegerField("Обработано файлов", default=0)
+    positions_created = models.PositiveIntegerField("Создано позиций", default=0)
+    positions_deduplicated = models.PositiveIntegerField("Отброшено дубликатов", default=0)
+    positions_skipped = models.PositiveIntegerField("Пропущено позиций", default=0)
+    errors = models.JSONField("Ошибки", default=list, blank=True)
+    created_at = models.DateTimeField("Создана", auto_now_add=True)
+    started_at = models.DateTimeField("Начата", null=True, blank=True)
+    finished_at = models.DateTimeField("Завершена", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Задача импорта"
+        verbose_name_plural = "Задачи импорта"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Импорт #{self.pk} ({self.get_status_display()})"
+
+class Trip(models.Model):
+    """
+    Рейс ТС: непрерывный отрезок движения по одному маршруту между разрывами в данных и стоянками.
+    Траектория хранится упрощенной (Дуглас—Пекер): path — оставшиеся вершины,
+    time_deltas — секунды между соседними вершинами, начиная от start_time.
+    """
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name="trips", verbose_name="Транспорт")
+    route = models.ForeignKey(Route, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Маршрут")
+    start_time = models.DateTimeField("Начало")
+    end_time = models.DateTimeField("Окончание")
+    path = gis_models.LineStringField("Траектория", srid=4326)
+    time_deltas = ArrayField(models.IntegerField(), verbose_name="Интервалы между вершинами (сек)", default=list)
+    points_total = models.PositiveIntegerField("Исходных точек", default=0)
+    distance = models.FloatField("Пройденное расстояние (м)", default=0)
+    tolerance = models.FloatField("Допуск упрощения (м)", default=0)
+
+    @property
+    def duration(self):
+        return (self.end_time - self.start_time).total_seconds()
+
+    @property
+    def points_kept(self):
+        return len(self.time_deltas) + 1
+
+    class Meta:
+        verbose_name = "Рейс"
+        verbose_name_plural = "Рейсы"
+        ordering = ['start_time']
+        unique_together = ('vehicle', 'start_time')
+        indexes = [
+            models.Index(fields=['route', 'start_time'], name='trip_route_start_idx'),
+            models.Index(fields=['start_time'], name='trip_start_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.vehicle.gos_num} {self.start_time.strftime('%Y-%m-%d %H:%M')}–{self.end_time.strftime('%H:%M')}"
+
+class RouteShape(models.Model):
+    """
+    Геометрия маршрута, построенная по порядку RouteStop: ломаная через остановки с координатами.
+    stop_offsets — расстояние от начала маршрута до каждой остановки stop_ids (м).
+    signature — отпечаток последовательности остановок: при его расхождении геометрия строится заново.
+    """
+    route = models.OneToOneField(Route, on_delete=models.CASCADE, primary_key=True, related_name="shape", verbose_name="Маршрут")
+    path = gis_models.LineStringField("Геометрия", srid=4326)
+    stop_ids = ArrayField(models.BigIntegerField(), verbose_name="Остановки по порядку", default=list)
+    stop_offsets = ArrayField(models.FloatField(), verbose_name="Расстояния до остановок (м)", default=list)
+    length = models.FloatField("Длина (м)", default=0)
+    signature = models.CharField("Отпечаток остановок", max_length=32)
+    built_at = models.DateTimeField("Построена", auto_now=True)
+
+    class Meta:
+        verbose_name = "Геометрия маршрута"
+        verbose_name_plural = "Геометрии маршрутов"
+
+    def __str__(self):
+        return f"{self.route} ({self.length / 1000:.1f} км)"
+
+class AnalyticsWatermark(models.Model):
+    """
+    Отметка аналитической стадии: до какого времени позиций маршрута стадия уже обработана.
+    Следующий запуск стадии читает только более новые позиции (с небольшим перекрытием).
+    """
+    stage = models.CharField("Стадия", max_length=32)
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Маршрут")
+    processed_until = models.DateTimeField("Обработано до")
+    updated_at = models.DateTimeField("Обновлено", auto_now=True)
+
+    class Meta:
+        verbose_name = "Отметка аналитики"
+        verbose_name_plural = "Отметки аналитики"
+        unique_together = ('stage', 'route')
+
+    def __str__(self):
+        return f"{self.stage} / {self.route or 'все'} до {self.processed_until.strftime('%Y-%m-%d %H:%M:%S')}"
+
+class IndexVersion(models.Model):
+    """
+    Версия данных, по которым процессы строят индексы в памяти (граф планировщика, индекс остановок,
+    проверенные секции таблицы позиций).
+    Изменение данных увеличивает версию, и каждый процесс перестраивает свой индекс при следующем запросе.
+    """
+    name = models.CharField("Индекс", max_length=64, primary_key=True)
+    version = models.BigIntegerField("Версия", default=0)
+
+    class Meta:
+        verbose_name = "Версия индекса"
+        verbose_name_plural = "Версии индексов"
+
+    def __str__(self):
+        return f"{self.name}: {self.version}"
+
+class PositionChange(models.Model):
+    """
+    Новые позиции ТС на маршруте, которые аналитическая стадия еще не обработала: импорт
+    расширяет интервал [since, until] и увеличивает revision, стадия после пересчета удаляет
+    отметку (если за это время та не изменилась).
+    """
+    stage = models.CharField("Стадия", max_length=32)
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, verbose_name="Маршрут")
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, verbose_name="Транспорт")
+    since = models.DateTimeField("Самая ранняя новая позиция")
+    until = models.DateTimeField("Самая поздняя новая позиция")
+    revision = models.PositiveIntegerField("Версия", default=0)
+
+    class Meta:
+        verbose_name = "Новые позиции для аналитики"
+        verbose_name_plural = "Новые позиции для аналитики"
+        unique_together = ('stage', 'route', 'vehicle')
+
+    def __str__(self):
+        return f"{self.stage} / {self.route} / {self.vehicle}: {self.since:%Y-%m-%d %H:%M:%S} — {self.until:%Y-%m-%d %H:%M:%S}"
+
+class StopArrival(models.Model):
+    """Прохождение остановки ТС: время прибытия и отправления (по позициям, привязанным к маршруту)."""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name="stop_arrivals", verbose_name="Транспорт")
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, verbose_name="Маршрут")
+    stop = models.ForeignKey(Stop, on_delete=models.CASCADE, verbose_name="Остановка")
+    stop_index = models.PositiveIntegerField("Номер остановки в геометрии маршрута")
+    arrival_time = models.DateTimeField("Прибытие")
+    departure_time = models.DateTimeField("Отправление")
+    dwell = models.PositiveIntegerField("Стоянка (сек)", default=0)
+
+    class Meta:
+        verbose_name = "Прохождение остановки"
+        verbose_name_plural = "Прохождения остановок"
+        ordering = ['arrival_time']
+        indexes = [
+            models.Index(fields=['route', 'arrival_time'], name='arrival_route_time_idx'),
+            models.Index(fields=['stop', 'arrival_time'], name='arrival_stop_time_idx'),
+            models.Index(fields=['vehicle', 'arrival_time'], name='arrival_vehicle_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.vehicle.gos_num} @ {self.stop.name} {self.arrival_time.strftime('%Y-%m-%d %H:%M:%S')}"
+
+class RouteHeadwayStats(models.Model):
+    """
+    Почасовая статистика маршрута: интервалы движения (между последовательными прибытиями
+    на одну остановку) и стоянки на остановках, в секундах. Час — начало часа в UTC.
+    """
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name="headway_stats", verbose_name="Маршрут")
+    hour = models.DateTimeField("Час")
+    arrivals = models.PositiveIntegerField("Прибытий", default=0)
+    vehicles = models.PositiveIntegerField("ТС на маршруте", default=0)
+    headway_count = models.PositiveIntegerField("Интервалов", default=0)
+    headway_mean = models.FloatField("Средний интервал", null=True, blank=True)
+    headway_median = models.FloatField("Медианный интервал", null=True, blank=True)
+    headway_p90 = models.FloatField("Интервал, 90-й процентиль", null=True, blank=True)
+    headway_max = models.FloatField("Наибольший интервал", null=True, blank=True)
+    headway_cv = models.FloatField("Коэффициент вариации интервала", null=True, blank=True)
+    dwell_mean = models.FloatField("Средняя стоянка", null=True, blank=True)
+    dwell_p90 = models.FloatField("Стоянка, 90-й процентиль", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Интервалы маршрута за час"
+        verbose_name_plural = "Интервалы маршрутов по часам"
+        ordering = ['hour']
+        unique_together = ('route', 'hour')
+
+    def __str__(self):
+        return f"{self.route} {self.hour.strftime('%Y-%m-%d %H:00')}"
+
+
+class ConnectionTravelTime(models.Model):
+    """
+    Наблюдаемое время в пути по соединению в одном интервале суток (bucket — номер интервала
+    по местному времени отправления). histogram — число проездов по корзинам шириной bin_seconds,
+    последняя корзина — все более долгие; гистограммы складываются, поэтому новые наблюдения
+    добавляются без перечитывания истории.
+    """
+    connection = models.ForeignKey(Connection, on_delete=models.CASCADE, related_name="travel_times", verbose_name="Соединение")
+    bucket = models.PositiveSmallIntegerField("Интервал суток")
+    bin_seconds = models.PositiveSmallIntegerField("Ширина корзины (сек)")
+    histogram = ArrayField(models.IntegerField(), verbose_name="Гистограмма", default=list)
+    count = models.PositiveIntegerField("Проездов", default=0)
+    total_seconds = models.BigIntegerField("Суммарное время (сек)", default=0)
+    p50 = models.FloatField("Медиана (сек)", null=True, blank=True)
+    p85 = models.FloatField("85-й процентиль (сек)", null=True, blank=True)
+    p95 = models.FloatField("95-й процентиль (сек)", null=True, blank=True)
+    updated_at = models.DateTimeField("Обновлено", auto_now=True)
+
+    @property
+    def mean(self):
+        return self.total_seconds / self.count if self.count else None
+
+    class Meta:
+        verbose_name = "Время в пути по соединению"
+        verbose_name_plural = "Время в пути по соединениям"
+        ordering = ['connection', 'bucket']
+        unique_together = ('connection', 'bucket')
+
+    def __str__(self):
+        return f"{self.connection} [{self.bucket}]: {self.count} проездов"
+
+
+class PositionDensityCell(models.Model):
+    """
+    Почасовой агрегат позиций маршрута по квадратной ячейке сетки в проекции Web Mercator
+    (cell_x, cell_y — номер ячейки размером cell_size метров проекции). speed_histogram —
+    число позиций по корзинам скорости; гистограммы складываются при объединении часов и ячеек.
+    """
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, null=True, blank=True, related_name="density_cells", verbose_name="Маршрут")
+    hour = models.DateTimeField("Час")
+    cell_size = models.PositiveIntegerField("Размер ячейки (м)")
+    cell_x = models.IntegerField("Ячейка X")
+    cell_y = models.IntegerField("Ячейка Y")
+    count = models.PositiveIntegerField("Позиций")
+    speed_sum = models.BigIntegerField("Сумма скоростей")
+    speed_histogram = ArrayField(models.IntegerField(), verbose_name="Гистограмма скоростей")
+
+    @property
+    def mean_speed(self):
+        return self.speed_sum / self.count if self.count else None
+
+    class Meta:
+        verbose_name = "Ячейка плотности позиций"
+        verbose_name_plural = "Плотность позиций"
+        ordering = ['hour', 'cell_x', 'cell_y']
+        indexes = [
+            models.Index(fields=['hour'], name='density_hour_idx'),
+            models.Index(fields=['route', 'hour'], name='density_route_hour_idx'),
+            models.Index(fields=['cell_x', 'cell_y'], name='density_cell_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.route or 'Без маршрута'} {self.hour:%Y-%m-%d %H:00} ({self.cell_x}, {self.cell_y}): {self.count}"
+
+
+ROLLUP_HOUR = 'hour'
+ROLLUP_DAY = 'day'
+ROLLUP_PERIOD_CHOICES = [
+    (ROLLUP_HOUR, 'Час'),
+    (ROLLUP_DAY, 'Сутки'),
+]
+
+
+class RouteActivityRollup(models.Model):
+    """
+    Сводка работы маршрута за час или сутки (start — начало периода в UTC): число ТС,
+    позиций, пройденное расстояние по последовательным позициям (м), средняя и наибольшая скорость.
+    """
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name="activity_rollups", verbose_name="Маршрут")
+    period = models.CharField("Период", max_length=4, choices=ROLLUP_PERIOD_CHOICES)
+    start = models.DateTimeField("Начало периода")
+    vehicles = models.PositiveIntegerField("ТС на маршруте")
+    samples = models.PositiveIntegerField("Позиций")
+    distance = models.FloatField("Пройдено (м)")
+    speed_sum = models.BigIntegerField("Сумма скоростей")
+    max_speed = models.PositiveIntegerField("Наибольшая скорость")
+
+    @property
+    def mean_speed(self):
+        return self.speed_sum / self.samples if self.samples else None
+
+    class Meta:
+        verbose_name = "Сводка по маршруту"
+        verbose_name_plural = "Сводки по маршрутам"
+        ordering = ['start']
+        unique_together = ('route', 'period', 'start')
+        indexes = [
+            models.Index(fields=['period', 'start'], name='route_rollup_period_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.route} {self.get_period_display()} {self.start:%Y-%m-%d %H:00}"
+
+
+class VehicleActivityRollup(models.Model):
+    """Сводка работы ТС за час или сутки: позиции, пройденное расстояние (м), средняя и наибольшая скорость."""
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name="activity_rollups", verbose_name="Транспорт")
+    period = models.CharField("Период", max_length=4, choices=ROLLUP_PERIOD_CHOICES)
+    start = models.DateTimeField("Начало периода")
+    routes = models.PositiveIntegerField("Маршрутов")
+    samples = models.PositiveIntegerField("Позиций")
+    distance = models.FloatField("Пройдено (м)")
+    speed_sum = models.BigIntegerField("Сумма скоростей")
+    max_speed = models.PositiveIntegerField("Наибольшая скорость")
+
+    @property
+    def mean_speed(self):
+        return self.speed_sum / self.samples if self.samples else None
+
+    class Meta:
+        verbose_name = "Сводка по ТС"
+        verbose_name_plural = "Сводки по ТС"
+        ordering = ['start']
+        unique_together = ('vehicle', 'period', 'start')
+        indexes = [
+            models.Index(fields=['period', 'start'], name='vehicle_rollup_period_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.vehicle} {self.get_period_display()} {self.start:%Y-%m-%d %H:00}"
@@ -0,0 +1,113 @@
+# project/pagination.py
+
+import base64
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Курсорная (keyset) пагинация по паре (timestamp, id).
+    Каждая страница — это диапазонный запрос по индексу "после (timestamp, id) последней строки",
+    поэтому время ответа зависит от размера страницы, а не от глубины истории.
+    Курсор непрозрачен для клиента: в ответе возвращается готовая ссылка next.
+    Поле времени задается атрибутом ordering_field (для других таблиц — в подклассе).
+    """
+    ordering_field = 'timestamp'
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = getattr(settings, 'VEHICLE_POSITIONS_PAGE_SIZE', 500)
+    max_page_size = getattr(settings, 'VEHICLE_POSITIONS_MAX_PAGE_SIZE', 5000)
+    invalid_cursor_message = 'Некорректный курсор.'
+
+    def get_page_size(self, request):
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(requested, self.max_page_size))
+
+    @staticmethod
+    def encode_cursor(timestamp, pk):
+        raw = f"{timestamp.isoformat()}|{pk}".encode('ascii')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            timestamp, pk = raw.rsplit('|', 1)
+            return datetime.fromisoformat(timestamp), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        field = self.ordering_field
+        queryset = queryset.order_by(field, 'id')
+        if cursor is not None:
+            timestamp, pk = cursor
+            # Дополнительное условие timestamp >= ... помогает отсечь секции и сузить диапазон индекса
+            queryset = queryset.filter(**{f'{field}__gte': timestamp}).filter(
+                Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'id__gt': pk})
+            )
+
+        page = list(queryset[:page_size + 1])
+        self.has_next = len(page) > page_size
+        page = page[:page_size]
+        self.next_cursor = self.encode_cursor(getattr(page[-1], field), page[-1].pk) if self.has_next else None
+        return page
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class TripCursorPagination(KeysetCursorPagination):
+    """Курсорная пагинация рейсов по (start_time, id)."""
+    ordering_field = 'start_time'
+    page_size = getattr(settings, 'TRIPS_PAGE_SIZE', 100)
+    max_page_size = getattr(settings, 'TRIPS_MAX_PAGE_SIZE', 1000)
+
+
+class StopArrivalCursorPagination(KeysetCursorPagination):
+    """Курсорная пагинация прохождений остановок по (arrival_time, id)."""
+    ordering_field = 'arrival_time'
+
+
+class HourlyStatsCursorPagination(KeysetCursorPagination):
+    """Курсорная пагинация почасовой статистики по (hour, id)."""
+    ordering_field = 'hour'
+
+
+class RollupCursorPagination(KeysetCursorPagination):
+    """Курсорная пагинация сводок по (start, id)."""
+    ordering_field = 'start'
@@ -0,0 +1,18 @@
+# project/params.py
+"""Разбор параметров запросов, общий для API и представлений (тайлы)."""
+
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+
+
+def parse_time_param(value):
+    """Разбирает ISO-дату/время из query-параметра; наивное время считается UTC. Некорректное значение -> None."""
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value.replace(' ', '+'))
+    except ValueError:
+        return None
+    if moment is not None and is_naive(moment):
+        moment = make_aware(moment)
+    return moment
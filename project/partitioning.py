@@ -0,0 +1,281 @@
+# project/partitioning.py
+"""
+Управление секциями (partitions) таблицы позиций ТС.
+
+Таблица project_vehicleposition секционирована по диапазонам "timestamp" (см. миграцию 0004).
+Секции создаются заранее — перед импортом и периодической задачей, а срок хранения
+соблюдается удалением (или отсоединением) целых секций вместо построчного DELETE.
+
+Каждый процесс помнит, какие секции уже проверил, чтобы не спрашивать каталог на каждую пачку.
+Удаление секций увеличивает версию 'position_partitions' в БД (см. versions.py), и процессы,
+заметив новую версию, забывают проверенные секции — иначе после удаления секции в другом процессе
+строки ее интервала молча ложились бы в секцию по умолчанию.
+"""
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import VehiclePosition
+from .versions import bump_index_version, index_version
+
+# Гранулярность секций: 'day' или 'month'
+PARTITION_INTERVAL = getattr(settings, 'VEHICLE_POSITION_PARTITION_INTERVAL', 'month')
+
+# На сколько интервалов вперед заранее создавать секции
+PARTITIONS_AHEAD = getattr(settings, 'VEHICLE_POSITION_PARTITIONS_AHEAD', 2)
+
+# Сколько дней хранить позиции (None — хранить бессрочно)
+RETENTION_DAYS = getattr(settings, 'VEHICLE_POSITION_RETENTION_DAYS', None)
+
+# Для позиций старше стольких дней (или срока хранения, если он короче) импорт секции не создает:
+# такие строки, как и метки дальше заранее созданных секций, ложатся в секцию по умолчанию
+PARTITION_MAX_AGE_DAYS = getattr(settings, 'VEHICLE_POSITION_PARTITION_MAX_AGE_DAYS', 3650)
+
+# Ключ advisory-блокировки, чтобы параллельные импорты не создавали секции одновременно
+_LOCK_KEY = 'project_vehicleposition_partitions'
+
+PARTITIONS_VERSION_NAME = 'position_partitions'
+
+# Начала секций, наличие которых уже проверено этим процессом, и версия набора секций на момент проверки
+_known_partitions = set()
+_known_version = None
+
+
+def _table():
+    return VehiclePosition._meta.db_table
+
+
+def _default_partition():
+    return f"{_table()}_default"
+
+
+def partition_start(moment, interval=None):
+    """Начало секции (в UTC), в которую попадает момент времени."""
+    interval = interval or PARTITION_INTERVAL
+    moment = moment.astimezone(dt_timezone.utc)
+    if interval == 'day':
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == 'month':
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Неизвестная гранулярность секций: {interval!r} (нужно 'day' или 'month')")
+
+
+def partition_end(start, interval=None):
+    """Конец секции (не включительно), начинающейся в start."""
+    interval = interval or PARTITION_INTERVAL
+    if interval == 'day':
+        return start + timedelta(days=1)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def partition_name(start, interval=None):
+    interval = interval or PARTITION_INTERVAL
+    suffix = start.strftime('%Y_%m_%d' if interval == 'day' else '%Y_%m')
+    return f"{_table()}_p{suffix}"
+
+
+def list_partitions():
+    """
+    Возвращает список (имя, начало, конец) всех секций с диапазоном, отсортированный по времени.
+    Секция по умолчанию в список не входит. Границы берутся из каталога, поэтому
+    месячные и дневные секции могут сосуществовать.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, bounds[1]::timestamptz, bounds[2]::timestamptz
+              FROM pg_inherits
+              JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+              JOIN pg_class child ON child.oid = pg_inherits.inhrelid,
+                   LATERAL regexp_match(
+                       pg_get_expr(child.relpartbound, child.oid),
+                       'FROM \\(''([^'']+)''\\) TO \\(''([^'']+)''\\)'
+                   ) AS bounds
+             WHERE parent.relname = %s AND bounds IS NOT NULL
+             ORDER BY 2
+            """,
+            [_table()],
+        )
+        return cursor.fetchall()
+
+
+def _partition_starts(start, end, interval):
+    current = partition_start(start, interval)
+    while current <= end:
+        yield current
+        current = partition_end(current, interval)
+
+
+def _covered(moment, partitions):
+    return any(lower <= moment < upper for _, lower, upper in partitions)
+
+
+def _create_partition(cursor, start, end, name):
+    """
+    Создает секцию [start, end). Если в секции по умолчанию уже лежат строки этого диапазона,
+    они переносятся в новую секцию в той же транзакции.
+    """
+    table, default = _table(), _default_partition()
+    cursor.execute(
+        f'SELECT EXISTS (SELECT 1 FROM {default} WHERE "timestamp" >= %s AND "timestamp" < %s)',
+        [start, end],
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute(
+            f'CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)',
+            [start, end],
+        )
+        return
+
+    cursor.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM {default} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+        f'INSERT INTO {name} SELECT * FROM moved',
+        [start, end],
+    )
+    cursor.execute(
+        f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)',
+        [start, end],
+    )
+
+
+def ensure_partitions(start, end, interval=None):
+    """
+    Гарантирует наличие секций, покрывающих интервал [start, end].
+    Возвращает имена созданных секций. Повторные вызовы для уже покрытых
+    интервалов не обращаются к БД.
+    """
+    interval = interval or PARTITION_INTERVAL
+    return _ensure_partition_starts(list(_partition_starts(start, end, interval)), interval)
+
+
+def _future_horizon(interval, ahead=None):
+    """Начало последней секции, которую ensure_future_partitions создает заранее."""
+    ahead = PARTITIONS_AHEAD if ahead is None else ahead
+    end = partition_start(datetime.now(dt_timezone.utc), interval)
+    for _ in range(ahead):
+        end = partition_end(end, interval)
+    return end
+
+
+def ensure_partitions_for(timestamps, interval=None):
+    """
+    Создает секции только для интервалов, в которые попадают метки пачки (секунды эпохи),
+    а не для всего промежутка между самой ранней и самой поздней: одна битая метка не
+    порождает сотни пустых секций. Метки старше PARTITION_MAX_AGE_DAYS (или срока хранения)
+    и дальше заранее созданных секций секций не создают и ложатся в секцию по умолчанию.
+    """
+    interval = interval or PARTITION_INTERVAL
+    max_age = min(PARTITION_MAX_AGE_DAYS, RETENTION_DAYS or PARTITION_MAX_AGE_DAYS)
+    lower = datetime.now(dt_timezone.utc) - timedelta(days=max_age)
+    upper = _future_horizon(interval)
+    days = np.unique(np.asarray(timestamps, dtype=np.int64) // 86400)
+    starts = {
+        partition_start(datetime.fromtimestamp(day * 86400, dt_timezone.utc), interval)
+        for day in days.tolist()
+    }
+    return _ensure_partition_starts(
+        sorted(start for start in starts if partition_end(start, interval) > lower and start <= upper), interval,
+    )
+
+
+def _ensure_partition_starts(starts, interval):
+    global _known_version
+    version = index_version(PARTITIONS_VERSION_NAME)
+    if version != _known_version:
+        # Секции удаляли (возможно, в другом процессе) — проверенное раньше больше не верно
+        _known_partitions.clear()
+        _known_version = version
+    needed = [moment for moment in starts if moment not in _known_partitions]
+    if not needed:
+        return []
+
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [_LOCK_KEY])
+        partitions = list_partitions()
+        for moment in needed:
+            if _covered(moment, partitions):
+                continue
+            # Не пересекаемся с уже существующими секциями другой гранулярности
+            upper = min([partition_end(moment, interval)] + [lower for _, lower, _ in partitions if lower > moment])
+            name = partition_name(moment, interval)
+            _create_partition(cursor, moment, upper, name)
+            partitions.append((name, moment, upper))
+            created.append(name)
+
+    # Кэш обновляем только после успешной фиксации транзакции
+    transaction.on_commit(lambda: _known_partitions.update(needed))
+    return created
+
+
+def ensure_future_partitions(ahead=None, interval=None):
+    """Создает секции от текущего интервала на `ahead` интервалов вперед."""
+    interval = interval or PARTITION_INTERVAL
+    start = partition_start(datetime.now(dt_timezone.utc), interval)
+    return ensure_partitions(start, _future_horizon(interval, ahead), interval)
+
+
+def drop_partitions_before(cutoff, detach_only=False):
+    """
+    Удаляет (или только отсоединяет, если detach_only) секции, целиком лежащие раньше cutoff.
+    Оставшиеся строки старше cutoff (секция по умолчанию и секция, в которую попадает cutoff)
+    удаляются обычным DELETE; если cutoff совпадает с границей секций, таких строк почти нет.
+    Возвращает (список обработанных секций, оценка числа удаленных строк).
+    """
+    removed = []
+    rows = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [_LOCK_KEY])
+        for name, _, upper in list_partitions():
+            if upper > cutoff:
+                continue
+            # Оценка по статистике планировщика: точный count(*) стоил бы полного чтения секции
+            cursor.execute("SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE relname = %s", [name])
+            rows += cursor.fetchone()[0]
+            cursor.execute(f'ALTER TABLE {_table()} DETACH PARTITION {name}')
+            if not detach_only:
+                cursor.execute(f'DROP TABLE {name}')
+            removed.append(name)
+        cursor.execute(f'DELETE FROM {_table()} WHERE "timestamp" < %s', [cutoff])
+        rows += cursor.rowcount
+        if removed:
+            bump_index_version(PARTITIONS_VERSION_NAME)
+
+    _known_partitions.clear()
+    return removed, rows
+
+
+def truncate_positions():
+    """Мгновенно очищает все секции таблицы позиций. Возвращает оценку числа удаленных строк."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT COALESCE(SUM(GREATEST(child.reltuples, 0)), 0)::bigint
+              FROM pg_inherits
+              JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+              JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+             WHERE parent.relname = %s
+            """,
+            [_table()],
+        )
+        rows = cursor.fetchone()[0]
+        cursor.execute(f'TRUNCATE {_table()}')
+    return rows
+
+
+def apply_retention(days=None, detach_only=False):
+    """
+    Удаляет секции старше срока хранения (VEHICLE_POSITION_RETENTION_DAYS).
+    Граница выравнивается по началу секции, поэтому удаляются только целые секции.
+    """
+    days = RETENTION_DAYS if days is None else days
+    if days is None:
+        return [], 0
+    cutoff = partition_start(datetime.now(dt_timezone.utc) - timedelta(days=days))
+    return drop_partitions_before(cutoff, detach_only=detach_only)
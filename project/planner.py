@@ -0,0 +1,227 @@
+# project/planner.py
+"""
+Поиск маршрута поездки по графу остановок.
+
+Граф строится один раз на процесс: вершины — остановки, ребра — соединения (Connection)
+и пары соседних остановок маршрутов (RouteStop). Ребра хранятся в виде CSR (смещения
+исходящих ребер вершины, концы, веса в секундах), у каждого ребра — список маршрутов,
+которые по нему проходят. Запрос выполняется алгоритмом A* с эвристикой — расстоянием
+по сфере до цели, деленным на наибольшую скорость в графе, поэтому найденный путь
+кратчайший по времени, а БД при запросе не читается.
+
+Индекс сбрасывается при изменении остановок, маршрутов и соединений (сигналы моделей и
+явный вызов invalidate_index() после массовых обновлений). Номер версии хранится в БД
+(см. versions.py), поэтому граф перестраивают все процессы, а не только тот, где изменили данные.
+"""
+
+import heapq
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F, FloatField, Func
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Connection, Route, RouteStop, Stop
+from .trips import EARTH_RADIUS
+from .versions import bump_index_version, index_version
+
+# Скорость (км/ч) для оценки времени между соседними остановками маршрута без соединения
+PLAN_DEFAULT_SPEED = getattr(settings, 'BUS_PLAN_DEFAULT_SPEED', 20)
+
+GRAPH_VERSION_NAME = 'transit_graph'
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    """Расстояние по сфере (м); принимает числа и массивы NumPy."""
+    lon1, lat1, lon2, lat2 = (np.radians(value) for value in (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+class TransitGraph:
+    """Граф остановок в виде CSR для поиска пути в памяти."""
+
+    def __init__(self, stops, routes, connections, route_stops, version=None):
+        """
+        stops — [(id, name, lon, lat)], routes — {id: name}, connections — [(from_id, to_id, travel_time_min)],
+        route_stops — [(route_id, stop_id)] в порядке (маршрут, порядковый номер).
+        """
+        self.version = version
+        self.stop_ids = [stop_id for stop_id, _, _, _ in stops]
+        self.stop_names = [name for _, name, _, _ in stops]
+        self.index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        self.lon = np.array([np.nan if lon is None else lon for _, _, lon, _ in stops], dtype=np.float64)
+        self.lat = np.array([np.nan if lat is None else lat for _, _, _, lat in stops], dtype=np.float64)
+        self.route_names = dict(routes)
+
+        # (from, to) -> [вес в секундах, маршруты]
+        edges = {}
+        for from_id, to_id, travel_time in connections:
+            if from_id in self.index and to_id in self.index:
+                edges[self.index[from_id], self.index[to_id]] = [float(travel_time) * 60, []]
+        speed = PLAN_DEFAULT_SPEED / 3.6
+        for (route_id, from_id), (next_route_id, to_id) in zip(route_stops, route_stops[1:]):
+            if route_id != next_route_id or from_id == to_id:
+                continue
+            pair = (self.index[from_id], self.index[to_id])
+            if pair not in edges:
+                distance = haversine(self.lon[pair[0]], self.lat[pair[0]], self.lon[pair[1]], self.lat[pair[1]])
+                if np.isnan(distance):
+                    continue
+                edges[pair] = [float(distance) / speed, []]
+            if route_id not in edges[pair][1]:
+                edges[pair][1].append(route_id)
+
+        pairs = sorted(edges)
+        source = np.array([a for a, _ in pairs], dtype=np.int64)
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(source, minlength=len(self.stop_ids))))).tolist()
+        self.targets = [b for _, b in pairs]
+        self.weights = [edges[pair][0] for pair in pairs]
+        self.edge_routes = [edges[pair][1] for pair in pairs]
+
+        # Наибольшая скорость по ребрам (м/с): эвристика A* не должна переоценивать оставшееся время
+        distance = haversine(self.lon[source], self.lat[source], self.lon[self.targets], self.lat[self.targets]) if pairs else np.zeros(0)
+        weights = np.array(self.weights, dtype=np.float64)
+        known = ~np.isnan(distance)
+        valid = known & (weights > 0)
+        if (known & (weights <= 0) & (distance > 0)).any():
+            # Ребро с нулевым временем между разными точками: оценка невозможна, остается Дейкстра
+            self.max_speed = 0.0
+        else:
+            self.max_speed = float(np.max(distance[valid] / weights[valid])) if valid.any() else 0.0
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    def _heuristic(self, target):
+        if not self.max_speed or np.isnan(self.lon[target]):
+            return [0.0] * len(self)
+        estimate = haversine(self.lon, self.lat, self.lon[target], self.lat[target]) / self.max_speed
+        return np.nan_to_num(estimate, nan=0.0).tolist()
+
+    def shortest_path(self, from_id, to_id):
+        """Кратчайший по времени путь: (индексы вершин, индексы ребер, время в секундах) или None."""
+        source, target = self.index[from_id], self.index[to_id]
+        estimate = self._heuristic(target)
+        indptr, targets, weights = self.indptr, self.targets, self.weights
+        best = {source: 0.0}
+        previous = {}
+        done = set()
+        heap = [(estimate[source], 0.0, source)]
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            if node == target:
+                break
+            done.add(node)
+            for edge in range(indptr[node], indptr[node + 1]):
+                neighbour = targets[edge]
+                candidate = cost + weights[edge]
+                if candidate < best.get(neighbour, float('inf')):
+                    best[neighbour] = candidate
+                    previous[neighbour] = (node, edge)
+                    heapq.heappush(heap, (candidate + estimate[neighbour], candidate, neighbour))
+        if target not in best:
+            return None
+
+        nodes, edges = [target], []
+        while nodes[-1] != source:
+            node, edge = previous[nodes[-1]]
+            edges.append(edge)
+            nodes.append(node)
+        return nodes[::-1], edges[::-1], best[target]
+
+    def legs(self, edges):
+        """
+        Делит путь на участки без пересадок: участок продолжается, пока есть маршрут,
+        проходящий по всем его ребрам. Жадное продление дает наименьшее число участков.
+        Возвращает [(маршруты участка, индексы ребер)].
+        """
+        legs = []
+        for edge in edges:
+            routes = set(self.edge_routes[edge])
+            if legs and legs[-1][0] & routes:
+                legs[-1][0].intersection_update(routes)
+                legs[-1][1].append(edge)
+            elif legs and not legs[-1][0] and not routes:
+                legs[-1][1].append(edge)
+            else:
+                legs.append((routes, [edge]))
+        return legs
+
+    def plan(self, from_id, to_id):
+        """Маршрут поездки в виде словаря для API или None, если пути нет."""
+        found = self.shortest_path(from_id, to_id)
+        if found is None:
+            return None
+        nodes, edges, total = found
+        stop_position = 0
+        legs = []
+        for routes, leg_edges in self.legs(edges):
+            leg_nodes = nodes[stop_position:stop_position + len(leg_edges) + 1]
+            stop_position += len(leg_edges)
+            legs.append({
+                'routes': [{'id': route_id, 'name': self.route_names.get(route_id)} for route_id in sorted(routes)],
+                'stops': [self._stop(node) for node in leg_nodes],
+                'travel_time': round(sum(self.weights[edge] for edge in leg_edges)),
+            })
+        return {
+            'from': from_id,
+            'to': to_id,
+            'travel_time': round(total),
+            'transfers': max(len(legs) - 1, 0),
+            'legs': legs,
+        }
+
+    def _stop(self, node):
+        return {'id': self.stop_ids[node], 'name': self.stop_names[node]}
+
+
+def build_graph(version=None):
+    """Читает остановки, маршруты и соединения и строит TransitGraph."""
+    stops = list(
+        Stop.objects.order_by('id')
+        .annotate(
+            lon=Func(F('location'), function='ST_X', output_field=FloatField()),
+            lat=Func(F('location'), function='ST_Y', output_field=FloatField()),
+        )
+        .values_list('id', 'name', 'lon', 'lat')
+    )
+    routes = Route.objects.values_list('id', 'name')
+    connections = Connection.objects.values_list('from_stop_id', 'to_stop_id', 'travel_time')
+    route_stops = list(RouteStop.objects.order_by('route_id', 'order').values_list('route_id', 'stop_id'))
+    return TransitGraph(stops, routes, connections, route_stops, version=version)
+
+
+def get_graph():
+    """Граф из памяти процесса; перестраивается, если версия в БД изменилась."""
+    global _graph
+    version = index_version(GRAPH_VERSION_NAME)
+    graph = _graph
+    if graph is not None and graph.version == version:
+        return graph
+    with _graph_lock:
+        if _graph is None or _graph.version != version:
+            _graph = build_graph(version)
+        return _graph
+
+
+def invalidate_index():
+    """Сбрасывает граф во всех процессах."""
+    global _graph
+    _graph = None
+    bump_index_version(GRAPH_VERSION_NAME)
+
+
+@receiver((post_save, post_delete), sender=Stop)
+@receiver((post_save, post_delete), sender=Route)
+@receiver((post_save, post_delete), sender=RouteStop)
+@receiver((post_save, post_delete), sender=Connection)
+def _graph_changed(sender, **kwargs):
+    invalidate_index()
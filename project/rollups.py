@@ -0,0 +1,149 @@
+# project/rollups.py
+"""
+Почасовые и суточные сводки работы маршрутов и ТС.
+
+Сводки строятся одним запросом на сутки: оконная функция LAG по позициям каждого ТС дает
+расстояние между соседними позициями, и PostgreSQL группирует позиции по (час, маршрут, ТС).
+Из этих строк в Python собираются сводки маршрутов (RouteActivityRollup) и ТС
+(VehicleActivityRollup) за часы и сутки; число ТС за сутки считается по множеству ТС,
+а не суммой по часам.
+
+Шаг не входит в пройденное расстояние, если между позициями разрыв дольше TRIP_GAP_SECONDS
+или скорость на нем выше ROLLUP_MAX_SPEED (скачок координат). Расстояние шага относится
+к часу и маршруту второй позиции.
+
+Обновление инкрементальное: пересчитываются целиком и заменяются только сутки, в которые
+импорт записал новые позиции (отметки PositionChange), в том числе поздние данные маршрута
+за уже посчитанные сутки.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from .ledger import advance_stage_watermark, clear_position_changes, day_starts, pending_position_changes, stage_watermark
+from .models import (
+    ROLLUP_DAY, ROLLUP_HOUR, AnalyticsWatermark, PositionChange, RouteActivityRollup, VehicleActivityRollup,
+    VehiclePosition,
+)
+from .trips import TRIP_GAP_SECONDS
+
+ROLLUP_STAGE = 'activity_rollups'
+
+# Шаг между позициями быстрее этой скорости (км/ч) — скачок координат, в расстояние не входит
+ROLLUP_MAX_SPEED = getattr(settings, 'BUS_ROLLUP_MAX_SPEED', 150)
+
+_ACTIVITY_SQL = """
+    WITH steps AS (
+        SELECT vehicle_id, route_id, timestamp, speed,
+               ST_DistanceSphere(location, LAG(location) OVER w) AS step,
+               EXTRACT(EPOCH FROM timestamp - LAG(timestamp) OVER w) AS gap
+        FROM {table}
+        WHERE timestamp >= %(read_from)s AND timestamp < %(time_to)s
+        WINDOW w AS (PARTITION BY vehicle_id ORDER BY timestamp)
+    )
+    SELECT date_trunc('hour', timestamp) AS hour, route_id, vehicle_id,
+           count(*), sum(speed), max(speed),
+           coalesce(sum(step) FILTER (WHERE gap > 0 AND gap <= %(max_gap)s AND step <= gap * %(max_speed)s), 0)
+    FROM steps
+    WHERE timestamp >= %(time_from)s
+    GROUP BY 1, 2, 3
+"""
+
+
+def _activity_rows(time_from, time_to):
+    """Строки (час, маршрут, ТС, позиций, сумма скоростей, наибольшая скорость, расстояние)."""
+    with connection.cursor() as cursor:
+        cursor.execute(_ACTIVITY_SQL.format(table=VehiclePosition._meta.db_table), {
+            # Предыдущая позиция первой позиции интервала может быть раньше него
+            'read_from': time_from - timedelta(seconds=TRIP_GAP_SECONDS),
+            'time_from': time_from,
+            'time_to': time_to,
+            'max_gap': TRIP_GAP_SECONDS,
+            'max_speed': ROLLUP_MAX_SPEED / 3.6,
+        })
+        return cursor.fetchall()
+
+
+def _accumulate(totals, key, member, samples, speed_sum, max_speed, distance):
+    total = totals.get(key)
+    if total is None:
+        total = totals[key] = [set(), 0, 0, 0, 0.0]
+    if member is not None:
+        total[0].add(member)
+    total[1] += samples
+    total[2] += speed_sum
+    total[3] = max(total[3], max_speed)
+    total[4] += distance
+
+
+def aggregate_activity(time_from, time_to):
+    """Сводки маршрутов и ТС за часы и сутки интервала (не сохраняются): (маршрутов, ТС)."""
+    routes, vehicles = {}, {}
+    for hour, route_id, vehicle_id, samples, speed_sum, max_speed, distance in _activity_rows(time_from, time_to):
+        day = hour.replace(hour=0)
+        for period, start in ((ROLLUP_HOUR, hour), (ROLLUP_DAY, day)):
+            if route_id is not None:
+                _accumulate(routes, (route_id, period, start), vehicle_id, samples, speed_sum, max_speed, distance)
+            _accumulate(vehicles, (vehicle_id, period, start), route_id, samples, speed_sum, max_speed, distance)
+
+    route_rollups = [
+        RouteActivityRollup(
+            route_id=route_id, period=period, start=start, vehicles=len(members), samples=samples,
+            distance=round(distance, 1), speed_sum=speed_sum, max_speed=max_speed,
+        )
+        for (route_id, period, start), (members, samples, speed_sum, max_speed, distance) in routes.items()
+    ]
+    vehicle_rollups = [
+        VehicleActivityRollup(
+            vehicle_id=vehicle_id, period=period, start=start, routes=len(members), samples=samples,
+            distance=round(distance, 1), speed_sum=speed_sum, max_speed=max_speed,
+        )
+        for (vehicle_id, period, start), (members, samples, speed_sum, max_speed, distance) in vehicles.items()
+    ]
+    return route_rollups, vehicle_rollups
+
+
+def update_activity_rollups(full=False):
+    """
+    Пересчитывает сводки за сутки, в которые импорт записал новые позиции.
+    full=True (или отсутствие отметки стадии) — пересчет всей истории.
+    Возвращает {'days', 'routes', 'vehicles'} — число суток и записанных сводок.
+    """
+    stats = {'days': 0, 'routes': 0, 'vehicles': 0}
+    marks = []
+    if full or stage_watermark(ROLLUP_STAGE) is None:
+        RouteActivityRollup.objects.all().delete()
+        VehicleActivityRollup.objects.all().delete()
+        AnalyticsWatermark.objects.filter(stage=ROLLUP_STAGE).delete()
+        PositionChange.objects.filter(stage=ROLLUP_STAGE).delete()
+        bounds = VehiclePosition.objects.aggregate(first=Min('timestamp'), last=Max('timestamp'))
+        if bounds['last'] is None:
+            return stats
+        days = set(day_starts(bounds['first'], bounds['last']))
+        latest = bounds['last']
+    else:
+        marks = pending_position_changes(ROLLUP_STAGE)
+        if not marks:
+            return stats
+        # Шаг от последней новой позиции к следующей может прийтись на следующие сутки
+        gap = timedelta(seconds=TRIP_GAP_SECONDS)
+        days = {day for mark in marks for day in day_starts(mark.since, mark.until + gap)}
+        latest = max(mark.until for mark in marks)
+
+    for time_from in sorted(days):
+        time_to = time_from + timedelta(days=1)
+        route_rollups, vehicle_rollups = aggregate_activity(time_from, time_to)
+        with transaction.atomic():
+            RouteActivityRollup.objects.filter(start__gte=time_from, start__lt=time_to).delete()
+            VehicleActivityRollup.objects.filter(start__gte=time_from, start__lt=time_to).delete()
+            RouteActivityRollup.objects.bulk_create(route_rollups, batch_size=5000)
+            VehicleActivityRollup.objects.bulk_create(vehicle_rollups, batch_size=5000)
+        stats['days'] += 1
+        stats['routes'] += len(route_rollups)
+        stats['vehicles'] += len(vehicle_rollups)
+    clear_position_changes(marks)
+    advance_stage_watermark(ROLLUP_STAGE, None, latest)
+    return stats
@@ -1,8 +1,10 @@
 from rest_framework import serializers
 from .models import (
     Project, TransportType, Stop, Route, RouteStop, Connection,
-    Vehicle, VehiclePosition
+    Vehicle, VehicleLastPosition, VehiclePosition, IngestJob, Trip,
+    StopArrival, RouteHeadwayStats, ConnectionTravelTime, RouteActivityRollup, VehicleActivityRollup
 )
+from .travel_times import bucket_label
 
 class TransportTypeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -100,7 +102,10 @@ class VehicleSerializer(serializers.ModelSerializer):
 
 
 class VehiclePositionSerializer(serializers.ModelSerializer):
-    """Сериализатор для модели позиций ТС."""
+    """
+    Сериализатор для модели позиций ТС.
+    Необязательный аргумент fields оставляет в ответе только перечисленные поля.
+    """
     # Добавляем read-only поля для удобства фронтенда
     latitude = serializers.FloatField(read_only=True)
     longitude = serializers.FloatField(read_only=True)    
@@ -112,4 +117,122 @@ class VehiclePositionSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'timestamp', 'location', 'latitude', 'longitude', 
             'speed', 'direction', 'vehicle', 'route'
-        ]
\ No newline at end of file
+        ]
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
+class VehiclePositionFlatSerializer(VehiclePositionSerializer):
+    """Плоское представление позиции: вместо вложенных ТС и маршрута — только их id."""
+    vehicle = serializers.IntegerField(source='vehicle_id', read_only=True)
+    route = serializers.IntegerField(source='route_id', read_only=True)
+
+class VehicleLastPositionSerializer(serializers.ModelSerializer):
+    """Плоский сериализатор снимка "где сейчас ТС" для живой карты."""
+    vehicle = serializers.IntegerField(source='vehicle_id', read_only=True)
+    gos_num = serializers.CharField(source='vehicle.gos_num', read_only=True)
+    route = serializers.IntegerField(source='route_id', read_only=True)
+    latitude = serializers.FloatField(read_only=True)
+    longitude = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = VehicleLastPosition
+        fields = ['vehicle', 'gos_num', 'route', 'timestamp', 'latitude', 'longitude', 'speed', 'direction']
+
+
+class IngestJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = IngestJob
+        fields = [
+            'id', 'status', 'files_total', 'files_done', 'positions_created',
+            'positions_deduplicated', 'positions_skipped', 'errors',
+            'created_at', 'started_at', 'finished_at',
+        ]
+
+
+class TripSerializer(serializers.ModelSerializer):
+    """
+    Рейс со сжатой траекторией: coordinates — вершины [lon, lat], time_deltas — секунды
+    между соседними вершинами от start_time. С include_path=False траектория не отдается.
+    """
+    vehicle = serializers.IntegerField(source='vehicle_id', read_only=True)
+    gos_num = serializers.CharField(source='vehicle.gos_num', read_only=True)
+    route = serializers.IntegerField(source='route_id', read_only=True)
+    duration = serializers.FloatField(read_only=True)
+    points_kept = serializers.IntegerField(read_only=True)
+    coordinates = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Trip
+        fields = [
+            'id', 'vehicle', 'gos_num', 'route', 'start_time', 'end_time', 'duration',
+            'distance', 'points_total', 'points_kept', 'tolerance', 'coordinates', 'time_deltas',
+        ]
+
+    def __init__(self, *args, include_path=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not include_path:
+            self.fields.pop('coordinates')
+            self.fields.pop('time_deltas')
+
+    def get_coordinates(self, instance):
+        return [list(point) for point in instance.path.coords]
+
+
+class StopArrivalSerializer(serializers.ModelSerializer):
+    """Плоский сериализатор прохождения остановки."""
+    vehicle = serializers.IntegerField(source='vehicle_id', read_only=True)
+    gos_num = serializers.CharField(source='vehicle.gos_num', read_only=True)
+    route = serializers.IntegerField(source='route_id', read_only=True)
+    stop = serializers.IntegerField(source='stop_id', read_only=True)
+
+    class Meta:
+        model = StopArrival
+        fields = ['id', 'vehicle', 'gos_num', 'route', 'stop', 'stop_index', 'arrival_time', 'departure_time', 'dwell']
+
+
+class RouteHeadwayStatsSerializer(serializers.ModelSerializer):
+    route = serializers.IntegerField(source='route_id', read_only=True)
+
+    class Meta:
+        model = RouteHeadwayStats
+        fields = [
+            'id', 'route', 'hour', 'arrivals', 'vehicles', 'headway_count', 'headway_mean',
+            'headway_median', 'headway_p90', 'headway_max', 'headway_cv', 'dwell_mean', 'dwell_p90',
+        ]
+
+
+class ConnectionTravelTimeSerializer(serializers.ModelSerializer):
+    """Время в пути по соединению в интервале суток; start — начало интервала (ЧЧ:ММ)."""
+    start = serializers.SerializerMethodField()
+    mean = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = ConnectionTravelTime
+        fields = ['bucket', 'start', 'count', 'mean', 'p50', 'p85', 'p95', 'updated_at']
+
+    def get_start(self, obj):
+        return bucket_label(obj.bucket)
+
+
+class RouteActivityRollupSerializer(serializers.ModelSerializer):
+    route = serializers.IntegerField(source='route_id', read_only=True)
+    mean_speed = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = RouteActivityRollup
+        fields = ['id', 'route', 'period', 'start', 'vehicles', 'samples', 'distance', 'mean_speed', 'max_speed']
+
+
+class VehicleActivityRollupSerializer(serializers.ModelSerializer):
+    vehicle = serializers.IntegerField(source='vehicle_id', read_only=True)
+    gos_num = serializers.CharField(source='vehicle.gos_num', read_only=True)
+    mean_speed = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = VehicleActivityRollup
+        fields = ['id', 'vehicle', 'gos_num', 'period', 'start', 'routes', 'samples', 'distance', 'mean_speed', 'max_speed']
@@ -1,13 +1,21 @@
 import json
+import os
+import time
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from io import TextIOWrapper
-from datetime import datetime
+from pathlib import Path
 
+import django
+import numpy as np
+from django.conf import settings
 from django.db import transaction
-from django.contrib.gis.geos import Point
-from django.utils.timezone import make_aware
 
-from .models import Route, Vehicle, VehiclePosition, TransportType
+from .decoding import PositionArrays, PositionRecords, decode_bus_data
+from .ledger import IngestLedger, file_digest, record_position_changes
+from .loaders import get_position_loader, upsert_last_positions
+from .models import Route, Vehicle, TransportType
+from .partitioning import ensure_partitions_for
 
 RTYPE_MAP = {
     'А': 'Автобус',
@@ -15,114 +23,520 @@ RTYPE_MAP = {
     'Тр': 'Трамвай',
 }
 
-def _process_single_json_stream(content_stream):
+# Сколько позиций копится в памяти перед записью в БД (одна транзакция на пачку)
+IMPORT_BATCH_SIZE = getattr(settings, 'BUS_DATA_IMPORT_BATCH_SIZE', 5000)
+
+# Способ записи позиций по умолчанию: 'orm' (bulk_create) или 'copy' (COPY, только PostgreSQL)
+IMPORT_LOADER = getattr(settings, 'BUS_DATA_IMPORT_LOADER', 'orm')
+
+# Использовать ли журнал импорта (пропуск загруженных файлов и позиций старше отметки маршрута)
+# при импорте собранных файлов из sorted_routes
+IMPORT_INCREMENTAL = getattr(settings, 'BUS_DATA_IMPORT_INCREMENTAL', True)
+
+# Сколько процессов разбирают файлы маршрутов при импорте с диска (1 — последовательно, None — по числу ядер)
+IMPORT_WORKERS = getattr(settings, 'BUS_DATA_IMPORT_WORKERS', 1)
+
+# Как часто потоковый конвейер сбора сбрасывает накопленные позиции в БД (сек)
+STREAM_FLUSH_INTERVAL = getattr(settings, 'BUS_DATA_STREAM_FLUSH_INTERVAL', 5)
+
+# Размер блока, которым читается JSON при потоковом разборе
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_JSON_WHITESPACE = ' \t\r\n'
+
+
+def iter_json_array_items(text_stream, array_key, header, chunk_size=STREAM_CHUNK_SIZE):
     """
-    Внутренняя helper-функция для обработки одного потока с JSON-данными.
-    Определяет тип транспорта, создает/обновляет маршрут и готовит данные о позициях.
+    Потоково разбирает JSON-объект верхнего уровня, не загружая его целиком.
+    Элементы массива `array_key` отдаются по одному, остальные ключи складываются в `header`.
+    При синтаксической ошибке выбрасывает json.JSONDecodeError.
     """
-    positions_to_create = []
-    
-    try:
-        data = json.load(content_stream)
-    except json.JSONDecodeError:
-        return [], "Некорректный формат JSON."
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = text_stream.read(chunk_size) if not eof else ''
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def peek():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _JSON_WHITESPACE:
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not fill():
+                return ''
 
-    bus_data_list = data.get('bus_data', [])
-    if not bus_data_list:
-        return [], "Файл не содержит ключ 'bus_data' или этот список пуст."
+    def decode_value():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            # Число могло оборваться на границе блока — дочитываем и разбираем заново
+            if end == len(buf) and fill():
+                continue
+            pos = end
+            return value
+
+    def expect(*chars):
+        nonlocal pos
+        char = peek()
+        if char not in chars or not char:
+            raise json.JSONDecodeError(f"Expecting one of {chars!r}", buf, pos)
+        pos += 1
+        return char
+
+    expect('{')
+    if peek() == '}':
+        return
+    while True:
+        key = decode_value()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expecting property name", buf, pos)
+        expect(':')
+        if key == array_key and peek() == '[':
+            pos += 1
+            if peek() == ']':
+                pos += 1
+            else:
+                while True:
+                    yield decode_value()
+                    if expect(',', ']') == ']':
+                        break
+        else:
+            header[key] = decode_value()
+        if expect(',', '}') == '}':
+            return
+
+
+def _iter_json_members(uploaded_file):
+    """
+    Отдает пары (имя для отчета, текстовый поток) для .json-файла или каждого .json внутри .zip.
+    """
+    name = uploaded_file.name
+    if name.lower().endswith('.zip'):
+        with zipfile.ZipFile(uploaded_file, 'r') as zf:
+            for filename in zf.namelist():
+                if filename.lower().endswith('.json') and not filename.startswith('__MACOSX'):
+                    with zf.open(filename, 'r') as json_file:
+                        yield f"{name}/{filename}", TextIOWrapper(json_file, 'utf-8')
+    else:
+        uploaded_file.seek(0)
+        yield name, TextIOWrapper(uploaded_file, 'utf-8')
+
+
+class ReferenceResolver:
+    """
+    Кэш справочников (ТС, маршрутов, типов транспорта) на время импорта.
+    Вместо get_or_create на каждую запись ТС разрешаются пачкой: один SELECT по
+    незнакомым гос. номерам, bulk_create недостающих и повторный SELECT их id.
+    Один экземпляр можно передавать между файлами, чтобы кэш переиспользовался.
+    """
 
-    first_bus = bus_data_list[0]
-    rtype = first_bus.get('rtype', 'А') # По умолчанию считаем, что это автобус
+    def __init__(self):
+        self._vehicle_ids = {}
+        self._route_types = None
+        self._transport_type_ids = {}
+
+    def vehicle_ids(self, gos_nums):
+        """Возвращает словарь gos_num -> id, создавая отсутствующие ТС."""
+        missing = {gos_num for gos_num in gos_nums if gos_num not in self._vehicle_ids}
+        if missing:
+            found = dict(Vehicle.objects.filter(gos_num__in=missing).values_list('gos_num', 'id'))
+            self._vehicle_ids.update(found)
+            to_create = missing - found.keys()
+            if to_create:
+                # ignore_conflicts + повторная выборка: id могли создать параллельно
+                Vehicle.objects.bulk_create([Vehicle(gos_num=gos_num) for gos_num in to_create], ignore_conflicts=True)
+                self._vehicle_ids.update(Vehicle.objects.filter(gos_num__in=to_create).values_list('gos_num', 'id'))
+        return self._vehicle_ids
+
+    def transport_type_id(self, name):
+        if name not in self._transport_type_ids:
+            transport_type, _ = TransportType.objects.get_or_create(name=name)
+            self._transport_type_ids[name] = transport_type.id
+        return self._transport_type_ids[name]
+
+    def route_id(self, route_id, route_name, transport_type_name):
+        """Создает маршрут при необходимости и синхронизирует его тип транспорта."""
+        if self._route_types is None:
+            self._route_types = dict(Route.objects.values_list('id', 'transport_type_id'))
+        transport_type_id = self.transport_type_id(transport_type_name)
+        known_type_id = self._route_types.get(route_id)
+        if known_type_id is None:
+            route, _ = Route.objects.get_or_create(
+                id=route_id,
+                defaults={'name': route_name, 'transport_type_id': transport_type_id}
+            )
+            known_type_id = route.transport_type_id
+        if known_type_id != transport_type_id:
+            Route.objects.filter(id=route_id).update(transport_type_id=transport_type_id)
+        self._route_types[route_id] = transport_type_id
+        return route_id
+
+
+def _get_route_id(header, first_item, resolver):
+    """Определяет тип транспорта и маршрут по заголовку файла и первой записи."""
+    rtype = first_item.get('rtype', 'А') # По умолчанию считаем, что это автобус
     transport_type_name = RTYPE_MAP.get(rtype, 'Автобус') # Ищем в словаре, иначе - Автобус
-    
-    transport_type, _ = TransportType.objects.get_or_create(name=transport_type_name)
 
-    route_id = data.get('route_id')
-    route_name = data.get('route_name', f"Маршрут {route_id}")
-    
+    route_id = header.get('route_id', first_item.get('rid'))
     if not route_id:
-        return [], "В файле отсутствует 'route_id'."
-    
-    route, created = Route.objects.get_or_create(
-        id=route_id,
-        defaults={'name': route_name, 'transport_type': transport_type}
+        return None
+
+    route_name = header.get('route_name', first_item.get('rnum', f"Маршрут {route_id}"))
+    return resolver.route_id(int(route_id), route_name, transport_type_name)
+
+
+def _flush_positions(positions, route_id, resolver, load_positions):
+    """
+    Записывает пачку декодированных позиций (PositionArrays) в отдельной транзакции.
+    Число запросов на пачку фиксировано: разрешение ТС, проверка секций, работа загрузчика,
+    обновление снимка последних позиций и отметок новых позиций для аналитики. Позиции, снимок
+    и отметки пишутся одной транзакцией: без отметки новые позиции не попали бы в аналитику,
+    а повторный импорт отбросил бы их как дубликаты.
+    Возвращает (вставлено, отброшено как дубликаты).
+    """
+    if not len(positions):
+        return 0, 0
+
+    # ТС создаются вне транзакции пачки, чтобы кэш резолвера не ссылался на откаченные строки
+    gos_nums = positions.gos_num.tolist()
+    vehicle_ids = resolver.vehicle_ids(set(gos_nums))
+    vehicle_id = np.fromiter((vehicle_ids[gos_num] for gos_num in gos_nums), dtype=np.int64, count=len(gos_nums))
+
+    # Первое вхождение каждой пары (ТС, время), в исходном порядке
+    _, first = np.unique(np.stack([vehicle_id, positions.timestamp], axis=1), axis=0, return_index=True)
+    first.sort()
+    records = PositionRecords(
+        vehicle_id[first], route_id, positions.timestamp[first],
+        positions.lon[first], positions.lat[first], positions.speed[first], positions.direction[first],
     )
-    if not created and route.transport_type != transport_type:
-        route.transport_type = transport_type
-        route.save()
+    ensure_partitions_for(records.timestamp)
+    with transaction.atomic():
+        inserted, deduplicated = load_positions(records)
+        if inserted:
+            upsert_last_positions(records)
+            record_position_changes(records)
+    return inserted, deduplicated + len(positions) - len(records)
 
-    for item in bus_data_list:
-        gos_num = item.get('gos_num')
-        if not gos_num:
-            continue
 
-        vehicle, _ = Vehicle.objects.get_or_create(gos_num=gos_num)
+def _below_watermark(positions, route_id, ledger, stats):
+    """Отбрасывает позиции старше отметки маршрута в журнале импорта (если он передан)."""
+    mark = ledger.watermark(route_id) if ledger else None
+    if mark is None or not len(positions):
+        return positions
+    fresh = positions.timestamp >= mark
+    stats["below_watermark"] += int(len(fresh) - fresh.sum())
+    return positions.take(fresh)
 
-        try:
-            # Преобразуем данные в нужные форматы
-            raw_lat, raw_lon = float(item['lat']), float(item['lon'])
-            real_lat = (raw_lat / 1571673) - 0.002005
-            real_lon = (raw_lon / 1467000) - 0.002415
-            timestamp_str = item.get('lasttime')
-            timestamp = make_aware(datetime.strptime(timestamp_str, "%d.%m.%Y %H:%M:%S"))
-        except (ValueError, TypeError, KeyError):
-            continue
 
-        positions_to_create.append(
-            VehiclePosition(
-                vehicle=vehicle, 
-                route=route, 
-                timestamp=timestamp,
-                location=Point(real_lon, real_lat, srid=4326),
-                speed=item.get('speed', 0), 
-                direction=item.get('dir', 0)
-            )
-        )
-    
-    return positions_to_create, None
+def _process_single_json_stream(content_stream, batch_size=IMPORT_BATCH_SIZE, resolver=None, load_positions=None, ledger=None):
+    """
+    Внутренняя helper-функция для потоковой обработки одного JSON-потока.
+    Записи копятся пачками по batch_size, декодируются векторно (decode_bus_data)
+    и сбрасываются в БД, так что расход памяти не зависит от размера файла.
+    С журналом импорта (ledger) позиции старше отметки маршрута не отправляются в БД,
+    а после успешной обработки отметка сдвигается на самую позднюю позицию файла.
+    Возвращает (статистика, ошибка); статистика — словарь created/deduplicated/below_watermark/skipped.
+    """
+    resolver = resolver or ReferenceResolver()
+    load_positions = load_positions or get_position_loader(IMPORT_LOADER)
+    header = {}
+    route_id = None
+    batch = []
+    items_total = 0
+    latest = None
+    stats = {"created": 0, "deduplicated": 0, "below_watermark": 0, "skipped": 0}
+
+    def flush():
+        nonlocal latest
+        positions, _ = decode_bus_data(batch)
+        if len(positions):
+            latest = max(latest or 0, int(positions.timestamp.max()))
+        positions = _below_watermark(positions, route_id, ledger, stats)
+        inserted, deduplicated = _flush_positions(positions, route_id, resolver, load_positions)
+        stats["created"] += inserted
+        stats["deduplicated"] += deduplicated
+        batch.clear()
+
+    def finish(error=None):
+        stats["skipped"] = items_total - stats["created"]
+        return stats, error
+
+    try:
+        for item in iter_json_array_items(content_stream, 'bus_data', header):
+            if route_id is None:
+                route_id = _get_route_id(header, item, resolver)
+                if route_id is None:
+                    return finish("В файле отсутствует 'route_id'.")
+            items_total += 1
+
+            batch.append(item)
+            if len(batch) >= batch_size:
+                flush()
+    except json.JSONDecodeError:
+        flush()
+        return finish("Некорректный формат JSON.")
+
+    flush()
+
+    if not items_total:
+        return finish("Файл не содержит ключ 'bus_data' или этот список пуст.")
+    if ledger and latest is not None:
+        ledger.advance(route_id, latest)
+    return finish()
+
+
+def _parse_route_file(path):
+    """
+    Выполняется в процессе пула: разбирает файл маршрута и пересчитывает координаты, не обращаясь к БД.
+    Возвращает (имя файла, заголовок, первая запись, позиции PositionArrays, всего записей, ошибка).
+    """
+    header, first_item, items_total, error = {}, None, 0, None
+    batch, decoded = [], []
+    try:
+        with open(path, 'r', encoding='utf-8') as stream:
+            for item in iter_json_array_items(stream, 'bus_data', header):
+                if first_item is None:
+                    first_item = item
+                items_total += 1
+                batch.append(item)
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    decoded.append(decode_bus_data(batch)[0])
+                    batch = []
+    except json.JSONDecodeError:
+        error = "Некорректный формат JSON."
+    except (OSError, UnicodeDecodeError) as e:
+        error = f"Не удалось прочитать файл: {e}"
+    decoded.append(decode_bus_data(batch)[0])
+    return Path(path).name, header, first_item, PositionArrays.concat(decoded), items_total, error
+
 
-def import_bus_data_from_files(files):
+def _load_parsed_route(parsed, batch_size, resolver, load_positions, ledger=None):
+    """
+    Записывает результат _parse_route_file в БД пачками, с учетом отметки маршрута в журнале.
+    Возвращает (статистика, ошибка).
+    """
+    name, header, first_item, positions, items_total, error = parsed
+    stats = {"created": 0, "deduplicated": 0, "below_watermark": 0, "skipped": 0}
+    if first_item is None:
+        error = error or "Файл не содержит ключ 'bus_data' или этот список пуст."
+    else:
+        route_id = _get_route_id(header, first_item, resolver)
+        if route_id is None:
+            error = "В файле отсутствует 'route_id'."
+        else:
+            latest = int(positions.timestamp.max()) if len(positions) else None
+            positions = _below_watermark(positions, route_id, ledger, stats)
+            for start in range(0, len(positions), batch_size):
+                batch = positions.take(slice(start, start + batch_size))
+                inserted, deduplicated = _flush_positions(batch, route_id, resolver, load_positions)
+                stats["created"] += inserted
+                stats["deduplicated"] += deduplicated
+            if ledger and latest is not None and error is None:
+                ledger.advance(route_id, latest)
+    stats["skipped"] = items_total - stats["created"]
+    return stats, error
+
+
+def import_bus_data_parallel(paths, workers=None, batch_size=None, resolver=None, loader=None, incremental=False):
+    """
+    Параллельный импорт файлов маршрутов (route_N.json) с диска.
+    Разбор JSON и пересчет координат идут в пуле из workers процессов (по умолчанию
+    BUS_DATA_IMPORT_WORKERS), а запись в БД — в текущем процессе по мере готовности файлов,
+    поэтому ТС и маршруты создаются одним общим ReferenceResolver без гонок.
+    incremental — как в import_bus_data_from_files.
+    Возвращает словарь того же вида, что и import_bus_data_from_files.
+    """
+    workers = workers or IMPORT_WORKERS or os.cpu_count()
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    resolver = resolver or ReferenceResolver()
+    load_positions = get_position_loader(loader or IMPORT_LOADER)
+    ledger = IngestLedger() if incremental else None
+    totals = {"created": 0, "deduplicated": 0, "below_watermark": 0, "skipped": 0}
+    files_report = []
+    skipped_files = []
+    errors = []
+
+    digests = {}
+    for path in paths:
+        if ledger:
+            with open(path, 'rb') as f:
+                digest = file_digest(f)
+            if ledger.is_ingested(digest[0]):
+                skipped_files.append(Path(path).name)
+                continue
+            digests[str(path)] = digest
+        else:
+            digests[str(path)] = None
+
+    # django.setup нужен процессам, запущенным через spawn (Windows, macOS)
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        futures = {pool.submit(_parse_route_file, path): path for path in digests}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                parsed = future.result()
+                stats, err = _load_parsed_route(parsed, batch_size, resolver, load_positions, ledger)
+                if ledger and not err:
+                    digest, size = digests[path]
+                    ledger.record_file(digest, Path(path).name, size, stats["created"])
+            except Exception as e:
+                errors.append(f"Критическая ошибка при обработке файла {Path(path).name}: {e}")
+                continue
+            for key in totals:
+                totals[key] += stats[key]
+            files_report.append({"file": parsed[0], **stats})
+            if err:
+                errors.append(f"{parsed[0]}: {err}")
+
+    files_report.sort(key=lambda report: report["file"])
+    return _import_report(totals, files_report, skipped_files, errors)
+
+
+class PositionStreamWriter:
+    """
+    Пишет метки прямо из ответов сборщика в БД, без промежуточных файлов.
+    Позиции раскладываются по маршрутам (rid) и сбрасываются пачками через _flush_positions,
+    когда в буфере набирается batch_size позиций или с прошлой записи прошло flush_interval секунд.
+    Повторы одной и той же метки ТС в соседних опросах отсеиваются еще до БД.
+    Работает синхронно, поэтому вызывается из отдельного потока, а не из цикла событий сборщика.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, resolver=None, loader=None):
+        self.batch_size = batch_size or IMPORT_BATCH_SIZE
+        self.flush_interval = STREAM_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.resolver = resolver or ReferenceResolver()
+        self.load_positions = get_position_loader(loader or IMPORT_LOADER)
+        self.buffers = {}
+        self.buffered = 0
+        self.route_ids = {}
+        self.last_seen = {}
+        self.last_flush = time.monotonic()
+        self.stats = {"samples": 0, "created": 0, "deduplicated": 0, "skipped": 0}
+
+    def _route_id(self, item):
+        rid = item.get('rid')
+        if rid not in self.route_ids:
+            self.route_ids[rid] = _get_route_id({}, item, self.resolver)
+        return self.route_ids[rid]
+
+    def add_sample(self, data):
+        """Принимает один ответ getVehiclesMarkers ({"maxk": ..., "anims": [...]})."""
+        self.stats["samples"] += 1
+        by_route = {}
+        for item in data.get("anims", []):
+            by_route.setdefault(item.get('rid'), []).append(item)
+
+        for items in by_route.values():
+            route_id = self._route_id(items[0])
+            positions, invalid = decode_bus_data(items)
+            self.stats["skipped"] += invalid
+            if route_id is None:
+                self.stats["skipped"] += len(positions)
+                continue
+            # Метка ТС, не изменившаяся с прошлого опроса, в БД не отправляется
+            fresh = np.array([
+                self.last_seen.get(gos_num) != timestamp
+                for gos_num, timestamp in zip(positions.gos_num.tolist(), positions.timestamp.tolist())
+            ], dtype=bool)
+            positions = positions.take(fresh) if len(fresh) else positions
+            self.stats["skipped"] += len(fresh) - len(positions)
+            self.last_seen.update(zip(positions.gos_num.tolist(), positions.timestamp.tolist()))
+            if len(positions):
+                self.buffers.setdefault(route_id, []).append(positions)
+                self.buffered += len(positions)
+
+        if self.buffered >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        for route_id, batches in self.buffers.items():
+            positions = PositionArrays.concat(batches)
+            inserted, deduplicated = _flush_positions(positions, route_id, self.resolver, self.load_positions)
+            self.stats["created"] += inserted
+            self.stats["deduplicated"] += deduplicated
+            self.stats["skipped"] += deduplicated
+        self.buffers = {}
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+
+
+def _import_report(totals, files_report, skipped_files, errors):
+    return {
+        "message": "Импорт завершен.",
+        "total_positions_created": totals["created"],
+        "total_positions_deduplicated": totals["deduplicated"],
+        "total_positions_below_watermark": totals["below_watermark"],
+        "total_positions_skipped": totals["skipped"],
+        "files": files_report,
+        "skipped_files": skipped_files,
+        "errors": errors
+    }
+
+
+def import_bus_data_from_files(files, batch_size=None, resolver=None, loader=None, incremental=False):
     """
     Основная сервисная функция. Принимает список загруженных файлов,
-    обрабатывает .json и .zip, загружает данные в БД.
+    потоково обрабатывает .json и .zip и загружает данные в БД пачками.
+    В отчете для каждого файла (и каждого файла внутри архива) указано,
+    сколько позиций создано, сколько отброшено как дубликаты и сколько пропущено всего
+    (дубликаты и битые записи).
+    Справочники ТС и маршрутов разрешаются через общий ReferenceResolver,
+    способ записи задается loader: 'orm' (bulk_create) или 'copy' (COPY в PostgreSQL).
+    С incremental=True используется журнал импорта: файлы, уже загруженные целиком
+    (по хэшу содержимого), пропускаются и перечисляются в skipped_files, а позиции
+    старше отметки своего маршрута не отправляются в БД (below_watermark).
     """
-    total_positions_created = 0
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    resolver = resolver or ReferenceResolver()
+    load_positions = get_position_loader(loader or IMPORT_LOADER)
+    ledger = IngestLedger() if incremental else None
+    totals = {"created": 0, "deduplicated": 0, "below_watermark": 0, "skipped": 0}
+    files_report = []
+    skipped_files = []
     errors = []
-    
-    positions_to_bulk_create = []
 
     for uploaded_file in files:
+        if not uploaded_file.name.lower().endswith(('.zip', '.json')):
+            errors.append(f"{uploaded_file.name}: Неподдерживаемый формат (нужен .zip или .json).")
+            continue
         try:
-            # Обработка ZIP-архивов
-            if uploaded_file.name.lower().endswith('.zip'):
-                with zipfile.ZipFile(uploaded_file, 'r') as zf:
-                    for filename in zf.namelist():
-                        if filename.lower().endswith('.json') and not filename.startswith('__MACOSX'):
-                            with zf.open(filename, 'r') as json_file:
-                                positions, err = _process_single_json_stream(TextIOWrapper(json_file, 'utf-8'))
-                                if err:
-                                    errors.append(f"{uploaded_file.name}/{filename}: {err}")
-                                else:
-                                    positions_to_bulk_create.extend(positions)
-            elif uploaded_file.name.lower().endswith('.json'):
-                uploaded_file.seek(0)
-                positions, err = _process_single_json_stream(TextIOWrapper(uploaded_file, 'utf-8'))
+            digest = None
+            if ledger:
+                digest = file_digest(uploaded_file)
+                if ledger.is_ingested(digest[0]):
+                    skipped_files.append(uploaded_file.name)
+                    continue
+            created, failed = 0, False
+            for name, stream in _iter_json_members(uploaded_file):
+                stats, err = _process_single_json_stream(stream, batch_size, resolver, load_positions, ledger)
+                for key in totals:
+                    totals[key] += stats[key]
+                files_report.append({"file": name, **stats})
+                created += stats["created"]
                 if err:
-                    errors.append(f"{uploaded_file.name}: {err}")
-                else:
-                    positions_to_bulk_create.extend(positions)
-            else:
-                errors.append(f"{uploaded_file.name}: Неподдерживаемый формат (нужен .zip или .json).")
+                    failed = True
+                    errors.append(f"{name}: {err}")
+            # В журнал попадают только файлы, обработанные без ошибок
+            if digest and not failed:
+                ledger.record_file(digest[0], Path(uploaded_file.name).name, digest[1], created)
         except Exception as e:
             errors.append(f"Критическая ошибка при обработке файла {uploaded_file.name}: {e}")
 
-    if positions_to_bulk_create:
-        with transaction.atomic():
-            created_objects = VehiclePosition.objects.bulk_create(positions_to_bulk_create, ignore_conflicts=True)
-            total_positions_created = len(created_objects)
-
-    return {
-        "message": "Импорт завершен.",
-        "total_positions_created": total_positions_created,
-        "errors": errors
-    }
\ No newline at end of file
+    return _import_report(totals, files_report, skipped_files, errors)
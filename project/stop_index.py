@@ -0,0 +1,243 @@
+# project/stop_index.py
+"""
+Пространственный индекс остановок в памяти процесса: ближайшие остановки к точке и
+остановки в радиусе без запроса к PostGIS.
+
+Координаты остановок переводятся в метры (local_xy) и раскладываются по ячейкам
+равномерной сетки STOP_INDEX_CELL метров. Одиночный запрос обходит кольца ячеек вокруг
+точки, пока k-я найденная остановка не окажется ближе необойденных колец. Пакетный запрос
+считается векторно по 3x3 соседним ячейкам: если k-я остановка не дальше размера ячейки,
+ответ точный, иначе точка досчитывается обходом колец.
+
+Индекс сбрасывается при изменении остановок (сигналы модели Stop, явный invalidate_stop_index()
+после массовых изменений); версия хранится в БД, как у графа планировщика (см. versions.py),
+поэтому индекс перестраивают все процессы.
+"""
+
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F, FloatField, Func
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Stop
+from .trips import local_xy
+from .versions import bump_index_version, index_version
+
+# Размер ячейки сетки индекса (м)
+STOP_INDEX_CELL = getattr(settings, 'BUS_STOP_INDEX_CELL', 250)
+# Сколько точек пакетного запроса обрабатывается за раз
+STOP_INDEX_CHUNK_SIZE = 20000
+
+STOP_INDEX_VERSION_NAME = 'stop_index'
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class StopIndex:
+    """Сеточный индекс остановок с координатами."""
+
+    def __init__(self, stops, cell=None, version=None):
+        """stops — [(id, name, lon, lat)] только остановок с координатами."""
+        self.version = version
+        self.cell = STOP_INDEX_CELL if cell is None else cell
+        self.stop_ids = np.array([stop_id for stop_id, _, _, _ in stops], dtype=np.int64)
+        self.names = [name for _, name, _, _ in stops]
+        self.lon = np.array([lon for _, _, lon, _ in stops], dtype=np.float64)
+        self.lat = np.array([lat for _, _, _, lat in stops], dtype=np.float64)
+        self.lat0 = float(self.lat.mean()) if len(stops) else 0.0
+        self.x, self.y = local_xy(self.lon, self.lat, self.lat0)
+
+        if len(stops):
+            self.origin = (self.x.min(), self.y.min())
+            self.columns = int((self.x.max() - self.origin[0]) // self.cell) + 1
+            self.rows = int((self.y.max() - self.origin[1]) // self.cell) + 1
+        else:
+            self.origin, self.columns, self.rows = (0.0, 0.0), 0, 0
+        cx, cy = self._cells(self.x, self.y)
+        cell_id = cx * self.rows + cy
+
+        # Остановки, отсортированные по ячейке, и таблица кандидатов только по занятым ячейкам
+        # (строка на ячейку, пустые места -1): далекая остановка не раздувает сетку
+        self.order = np.argsort(cell_id, kind='stable')
+        self.cell_ids, starts, counts = np.unique(cell_id[self.order], return_index=True, return_counts=True)
+        self.spans = {int(cell): (int(start), int(start + count)) for cell, start, count in zip(self.cell_ids, starts, counts)}
+        self.candidates = np.full((len(self.cell_ids), max(1, counts.max() if len(counts) else 1)), -1, dtype=np.int64)
+        for row, (start, count) in enumerate(zip(starts, counts)):
+            self.candidates[row, :count] = self.order[start:start + count]
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    def _cells(self, x, y):
+        cx = np.floor((x - self.origin[0]) / self.cell).astype(np.int64)
+        cy = np.floor((y - self.origin[1]) / self.cell).astype(np.int64)
+        return cx, cy
+
+    def _ring(self, cx, cy, ring):
+        """Индексы остановок в ячейках на расстоянии ring (по Чебышёву) от ячейки (cx, cy)."""
+        found = []
+        for i in range(max(cx - ring, 0), min(cx + ring, self.columns - 1) + 1):
+            if abs(i - cx) == ring:
+                column = range(max(cy - ring, 0), min(cy + ring, self.rows - 1) + 1)
+            else:
+                column = [j for j in (cy - ring, cy + ring) if 0 <= j < self.rows]
+            for j in column:
+                span = self.spans.get(i * self.rows + j)
+                if span:
+                    found.append(self.order[span[0]:span[1]])
+        return found
+
+    def nearest(self, lon, lat, k=1, radius=None):
+        """k ближайших остановок к точке (не дальше radius м): [(индекс, расстояние м)] по возрастанию."""
+        if not len(self):
+            return []
+        x, y = local_xy(np.array([lon], dtype=np.float64), np.array([lat], dtype=np.float64), self.lat0)
+        x, y = float(x[0]), float(y[0])
+        cx, cy = (int(value[0]) for value in self._cells(np.array([x]), np.array([y])))
+        # Кольца, задевающие сетку: точка может быть и за ее пределами
+        first_ring = max(0, -cx, cx - self.columns + 1, -cy, cy - self.rows + 1)
+        last_ring = max(abs(cx), abs(cx - self.columns + 1), abs(cy), abs(cy - self.rows + 1))
+        if radius is not None:
+            last_ring = min(last_ring, int(radius // self.cell) + 1)
+
+        indices, distances = np.zeros(0, dtype=np.int64), np.zeros(0)
+        for ring in range(first_ring, last_ring + 1):
+            found = self._ring(cx, cy, ring)
+            if found:
+                ring_indices = np.concatenate(found)
+                indices = np.concatenate((indices, ring_indices))
+                distances = np.concatenate((distances, np.hypot(self.x[ring_indices] - x, self.y[ring_indices] - y)))
+            # Остановки за кольцом ring не ближе ring * cell
+            if len(indices) >= k and np.partition(distances, k - 1)[k - 1] <= ring * self.cell:
+                break
+        return self._select(indices, distances, k, radius)
+
+    def within(self, lon, lat, radius):
+        """Остановки не дальше radius м от точки: [(индекс, расстояние м)] по возрастанию."""
+        if not len(self):
+            return []
+        x, y = local_xy(np.array([lon], dtype=np.float64), np.array([lat], dtype=np.float64), self.lat0)
+        cx, cy = (int(value[0]) for value in self._cells(x, y))
+        span = int(radius // self.cell) + 1
+        found = [
+            self.order[start:end]
+            for i in range(max(cx - span, 0), min(cx + span, self.columns - 1) + 1)
+            for j in range(max(cy - span, 0), min(cy + span, self.rows - 1) + 1)
+            for start, end in [self.spans.get(i * self.rows + j, (0, 0))]
+        ]
+        indices = np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+        distances = np.hypot(self.x[indices] - x[0], self.y[indices] - y[0])
+        return self._select(indices, distances, len(indices), radius)
+
+    @staticmethod
+    def _select(indices, distances, k, radius):
+        if radius is not None:
+            keep = distances <= radius
+            indices, distances = indices[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')[:k]
+        return list(zip(indices[order].tolist(), distances[order].tolist()))
+
+    def nearest_many(self, lon, lat, k=1, radius=None):
+        """Пакетный вариант nearest для массивов координат: список результатов по точкам."""
+        lon, lat = np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+        results = []
+        for start in range(0, len(lon), STOP_INDEX_CHUNK_SIZE):
+            results.extend(self._nearest_chunk(lon[start:start + STOP_INDEX_CHUNK_SIZE], lat[start:start + STOP_INDEX_CHUNK_SIZE], k, radius))
+        return results
+
+    def _nearest_chunk(self, lon, lat, k, radius):
+        count = len(lon)
+        if not len(self):
+            return [[] for _ in range(count)]
+        x, y = local_xy(lon, lat, self.lat0)
+        cx, cy = self._cells(x, y)
+
+        # Кандидаты из 3x3 соседних ячеек
+        blocks = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                nx, ny = cx + dx, cy + dy
+                cell_id = nx * self.rows + ny
+                row = np.minimum(np.searchsorted(self.cell_ids, cell_id), len(self.cell_ids) - 1)
+                occupied = (nx >= 0) & (nx < self.columns) & (ny >= 0) & (ny < self.rows) & (self.cell_ids[row] == cell_id)
+                block = np.full((count, self.candidates.shape[1]), -1, dtype=np.int64)
+                block[occupied] = self.candidates[row[occupied]]
+                blocks.append(block)
+        candidates = np.hstack(blocks)
+        safe = np.maximum(candidates, 0)
+        distance = np.hypot(self.x[safe] - x[:, None], self.y[safe] - y[:, None])
+        distance[candidates < 0] = np.inf
+
+        take = min(k, distance.shape[1])
+        best = np.argsort(distance, axis=1, kind='stable')[:, :take]
+        rows = np.arange(count)[:, None]
+        best_distance, best_index = distance[rows, best], candidates[rows, best]
+        # Остановки за пределами 3x3 не ближе размера ячейки: если k-я найденная ближе, ответ точный.
+        # При radius не больше ячейки все остановки в радиусе лежат внутри 3x3.
+        if take == k:
+            exact = best_distance[:, -1] <= self.cell
+        else:
+            exact = np.zeros(count, dtype=bool)
+        if radius is not None and radius <= self.cell:
+            exact[:] = True
+        limit = np.inf if radius is None else radius
+
+        results = []
+        for point in range(count):
+            if exact[point]:
+                keep = best_distance[point] <= limit
+                results.append(list(zip(best_index[point][keep].tolist(), best_distance[point][keep].tolist())))
+            else:
+                results.append(self.nearest(lon[point], lat[point], k, radius))
+        return results
+
+    def describe(self, index, distance):
+        """Остановка результата в виде словаря для API."""
+        return {
+            'id': int(self.stop_ids[index]),
+            'name': self.names[index],
+            'latitude': float(self.lat[index]),
+            'longitude': float(self.lon[index]),
+            'distance': round(distance, 1),
+        }
+
+
+def build_stop_index(version=None):
+    stops = (
+        Stop.objects.filter(location__isnull=False).order_by('id')
+        .annotate(
+            lon=Func(F('location'), function='ST_X', output_field=FloatField()),
+            lat=Func(F('location'), function='ST_Y', output_field=FloatField()),
+        )
+        .values_list('id', 'name', 'lon', 'lat')
+    )
+    return StopIndex(list(stops), version=version)
+
+
+def get_stop_index():
+    """Индекс из памяти процесса; перестраивается, если версия в БД изменилась."""
+    global _index
+    version = index_version(STOP_INDEX_VERSION_NAME)
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _index_lock:
+        if _index is None or _index.version != version:
+            _index = build_stop_index(version)
+        return _index
+
+
+def invalidate_stop_index():
+    """Сбрасывает индекс остановок во всех процессах."""
+    global _index
+    _index = None
+    bump_index_version(STOP_INDEX_VERSION_NAME)
+
+
+@receiver((post_save, post_delete), sender=Stop)
+def _stops_changed(sender, **kwargs):
+    invalidate_stop_index()
@@ -1,6 +1,14 @@
 # project/tasks.py
 
-from .data_processing import run_collection_pipeline, run_import_pipeline
+from .ingest import run_ingest_job, run_route_files_part
+from .data_processing import run_collection_pipeline, run_import_pipeline, run_streaming_pipeline
+from .partitioning import apply_retention, ensure_future_partitions
+from .arrivals import update_stop_arrivals
+from .heatmap import update_position_density
+from .rollups import update_activity_rollups
+from .tiles import DENSITY_TILES, invalidate_tiles
+from .trips import rebuild_trips
+from .travel_times import update_travel_times
 
 def run_collection_task():
     """
@@ -11,10 +19,76 @@ def run_collection_task():
     print("Фоновая задача СБОРА ДАННЫХ завершена.")
 
 
-def run_import_task():
+def run_streaming_collection_task(loader=None):
+    """
+    Фоновая задача потокового режима: сбор меток и запись их в БД за один проход,
+    без файлов full_data.json / sorted_routes.
+    """
+    print("Начало фоновой задачи: ПОТОКОВЫЙ СБОР И ИМПОРТ...")
+    run_streaming_pipeline(duration_seconds=300, loader=loader)
+    refresh_derived_data()
+    print("Фоновая задача ПОТОКОВОГО СБОРА И ИМПОРТА завершена.")
+
+
+def run_import_task(loader=None, workers=None, incremental=None):
     """
     Фоновая задача ТОЛЬКО для импорта уже собранных файлов в базу данных.
+    loader — 'orm' или 'copy', workers — число процессов для разбора файлов,
+    incremental — использовать журнал импорта (по умолчанию из настроек).
     """
     print("Начало фоновой задачи: ИМПОРТ В БД...")
-    run_import_pipeline()
-    print("Фоновая задача ИМПОРТА В БД завершена.")
\ No newline at end of file
+    job = run_import_pipeline(loader=loader, workers=workers, incremental=incremental)
+    if job is not None:
+        # Файлы разбирают задачи import_route_files_task, производные данные обновит последняя
+        print(f"Фоновая задача ИМПОРТА В БД раздала файлы задачам (задача импорта #{job.pk}).")
+        return
+    refresh_derived_data()
+    print("Фоновая задача ИМПОРТА В БД завершена.")
+
+
+def import_route_files_task(job_id, paths, loader=None, incremental=False):
+    """
+    Часть импорта sorted_routes, розданного нескольким воркерам: импортирует группу файлов.
+    Последняя завершившаяся часть обновляет производные данные.
+    """
+    job = run_route_files_part(job_id, paths, loader=loader, incremental=incremental)
+    if job is None:
+        return
+    if job.positions_created:
+        refresh_derived_data()
+    print(f"[Импорт] Задача #{job.pk}: {job.get_status_display()}, создано позиций: {job.positions_created}")
+
+def refresh_derived_data():
+    """Обновляет данные, производные от истории позиций, после поступления новых позиций."""
+    invalidate_tiles()
+    stats = rebuild_trips()
+    print(f"[Рейсы] Обновлено рейсов: {stats['trips']} ({stats['points']} точек -> {stats['vertices']} вершин)")
+    stats = update_stop_arrivals()
+    print(f"[Остановки] Маршрутов: {stats['routes']}, прохождений: {stats['arrivals']}, часов статистики: {stats['hours']}")
+    stats = update_travel_times()
+    print(f"[Время в пути] Маршрутов: {stats['routes']}, интервалов соединений: {stats['rows']}")
+    stats = update_position_density()
+    invalidate_tiles((DENSITY_TILES,))
+    print(f"[Тепловая карта] Часов: {stats['hours']}, ячеек: {stats['cells']}")
+    stats = update_activity_rollups()
+    print(f"[Сводки] Суток: {stats['days']}, сводок маршрутов: {stats['routes']}, ТС: {stats['vehicles']}")
+
+
+def maintain_partitions_task():
+    """
+    Периодическая задача обслуживания таблицы позиций: заранее создает секции
+    на ближайшие интервалы и удаляет секции старше срока хранения.
+    """
+    created = ensure_future_partitions()
+    print(f"[Секции] Создано новых секций: {len(created)}")
+    removed, rows = apply_retention()
+    if removed:
+        print(f"[Секции] Удалено секций по сроку хранения: {len(removed)} (~{rows} позиций)")
+
+
+def run_ingest_job_task(job_id):
+    """Фоновая задача импорта файлов, загруженных через /api/upload-bus-data/."""
+    job = run_ingest_job(job_id)
+    if job.positions_created:
+        refresh_derived_data()
+    print(f"[Импорт] Задача #{job.pk}: {job.get_status_display()}, создано позиций: {job.positions_created}")
@@ -1,4 +1,13 @@
-from django.test import TestCase
+import asyncio
+import importlib.util
+import json
+import tempfile
+from pathlib import Path
+from unittest import skipUnless
+
+import numpy as np
+
+from django.test import SimpleTestCase, TestCase
 from django.urls import reverse
 from django.contrib.gis.geos import Point, Polygon
 from django.utils import timezone
@@ -7,8 +16,11 @@ from rest_framework import status
 
 from .models import (
     TransportType, Stop, Route, RouteStop, 
-    Connection, Vehicle, VehiclePosition, Project
+    Connection, Vehicle, VehiclePosition, Project, Trip
 )
+from .collector import AsyncCollector, split_rids
+from .data_processing import remove_duplicates
+from .services import import_bus_data_from_files
 
 class TransportModelTest(TestCase):
     def setUp(self):
@@ -97,8 +109,8 @@ class ApiEndpointTests(TestCase):
 
         response = self.client.get(f'/api/vehicle-positions/?polygon={self.poly_wkt}')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertAlmostEqual(response.data[0]['latitude'], 52.28)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertAlmostEqual(response.data['results'][0]['latitude'], 52.28)
 
 class FullCrudApiTests(TestCase):
     def setUp(self):
@@ -171,3 +183,1175 @@ class FullCrudApiTests(TestCase):
         """Попытка создать остановку без обязательных полей."""
         response = self.client.post('/api/stops/', {"name": ""})
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BusDataImportTests(TestCase):
+    """Потоковый импорт данных irkbus пачками."""
+
+    @staticmethod
+    def _make_file(name, items, route_id=7):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        payload = {"route_id": route_id, "route_name": str(route_id), "bus_data": items}
+        return SimpleUploadedFile(name, json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+
+    @staticmethod
+    def _item(gos_num, lasttime, rtype="А"):
+        return {
+            "lon": 152951138.5, "lat": 82173031.6, "dir": 213, "speed": 15,
+            "lasttime": lasttime, "gos_num": gos_num, "rid": 7, "rnum": "7", "rtype": rtype,
+        }
+
+    def test_import_counts_per_file_with_small_batches(self):
+        items = [
+            self._item("А001АА", "12.12.2025 03:14:49"),
+            self._item("А001АА", "12.12.2025 03:15:01"),
+            self._item("А001АА", "12.12.2025 03:15:01"),  # дубликат внутри файла
+            self._item("В002ВВ", "12.12.2025 03:15:01"),
+            self._item("", "12.12.2025 03:15:01"),        # без гос. номера
+        ]
+        result = import_bus_data_from_files([self._make_file("route_7.json", items)], batch_size=2)
+
+        self.assertEqual(result['errors'], [])
+        self.assertEqual(result['total_positions_created'], 3)
+        self.assertEqual(result['files'], [{"file": "route_7.json", "created": 3, "deduplicated": 1, "below_watermark": 0, "skipped": 2}])
+        self.assertEqual(VehiclePosition.objects.count(), 3)
+        self.assertEqual(Route.objects.get(id=7).transport_type.name, "Автобус")
+
+    def test_reimport_skips_existing_positions(self):
+        items = [self._item("А001АА", "12.12.2025 03:14:49")]
+        import_bus_data_from_files([self._make_file("route_7.json", items)])
+        result = import_bus_data_from_files([self._make_file("route_7.json", items)])
+        self.assertEqual(result['total_positions_created'], 0)
+        self.assertEqual(result['total_positions_skipped'], 1)
+
+    def test_positions_are_not_kept_without_change_marks(self):
+        from unittest import mock
+        from . import services
+        from .models import PositionChange
+
+        items = [self._item("А001АА", "12.12.2025 03:14:49")]
+        with mock.patch.object(services, 'record_position_changes', side_effect=RuntimeError("сбой")):
+            result = import_bus_data_from_files([self._make_file("route_7.json", items)])
+        self.assertTrue(result['errors'])
+        self.assertEqual(VehiclePosition.objects.count(), 0)
+
+        # Повторный импорт того же файла записывает и позиции, и отметки
+        result = import_bus_data_from_files([self._make_file("route_7.json", items)])
+        self.assertEqual(result['total_positions_created'], 1)
+        self.assertTrue(PositionChange.objects.exists())
+
+    def test_broken_and_unsupported_files_are_reported(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        broken = SimpleUploadedFile("broken.json", b'{"route_id": 7, "bus_data": [')
+        unsupported = SimpleUploadedFile("data.txt", b'')
+        result = import_bus_data_from_files([broken, unsupported])
+        self.assertEqual(len(result['errors']), 2)
+
+    def test_query_count_does_not_depend_on_row_count(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        def run(route_id, count):
+            items = [self._item(f"Н{route_id}{i:03d}", "12.12.2025 03:14:49") for i in range(count)]
+            with CaptureQueriesContext(connection) as ctx:
+                import_bus_data_from_files([self._make_file("route.json", items, route_id=route_id)])
+            return len(ctx.captured_queries)
+
+        TransportType.objects.create(name="Автобус")
+        self.assertEqual(run(8, 3), run(9, 60))
+        self.assertEqual(Vehicle.objects.count(), 63)
+
+    def test_copy_loader_matches_orm_loader(self):
+        items = [
+            self._item("А001АА", "12.12.2025 03:14:49"),
+            self._item("В002ВВ", "12.12.2025 03:15:01"),
+        ]
+        import_bus_data_from_files([self._make_file("route_7.json", items[:1])], loader='orm')
+        result = import_bus_data_from_files([self._make_file("route_7.json", items)], loader='copy')
+
+        self.assertEqual(result['errors'], [])
+        self.assertEqual(result['total_positions_created'], 1)
+        self.assertEqual(result['total_positions_deduplicated'], 1)
+        position = VehiclePosition.objects.get(vehicle__gos_num="В002ВВ")
+        self.assertAlmostEqual(position.longitude, 152951138.5 / 1467000 - 0.002415)
+        self.assertEqual(position.speed, 15)
+
+
+    def test_incremental_import_skips_loaded_files_and_old_positions(self):
+        items = [self._item("А001АА", "12.12.2025 03:14:49"), self._item("В002ВВ", "12.12.2025 03:15:01")]
+        first = import_bus_data_from_files([self._make_file("route_7.json", items)], incremental=True)
+        self.assertEqual(first['total_positions_created'], 2)
+
+        again = import_bus_data_from_files([self._make_file("route_7.json", items)], incremental=True)
+        self.assertEqual(again['skipped_files'], ["route_7.json"])
+        self.assertEqual(again['files'], [])
+
+        newer = items + [self._item("А001АА", "12.12.2025 03:16:00")]
+        result = import_bus_data_from_files([self._make_file("route_7_next.json", newer)], incremental=True)
+        self.assertEqual(result['total_positions_created'], 1)
+        self.assertEqual(result['total_positions_below_watermark'], 1)
+        self.assertEqual(result['total_positions_deduplicated'], 1)
+        self.assertEqual(VehiclePosition.objects.count(), 3)
+
+    def test_stream_writer_loads_samples_without_files(self):
+        from .services import PositionStreamWriter
+
+        writer = PositionStreamWriter(batch_size=1000, flush_interval=3600)
+        first = {"maxk": 1, "anims": [self._item("А001АА", "12.12.2025 03:14:49"), self._item("В002ВВ", "12.12.2025 03:14:50")]}
+        second = {"maxk": 2, "anims": [self._item("А001АА", "12.12.2025 03:14:49"), self._item("А001АА", "12.12.2025 03:15:10")]}
+        writer.add_sample(first)
+        writer.add_sample(second)
+        self.assertEqual(VehiclePosition.objects.count(), 0)
+
+        writer.flush()
+        self.assertEqual(writer.stats["created"], 3)
+        self.assertEqual(writer.stats["skipped"], 1)
+        self.assertEqual(VehiclePosition.objects.filter(route_id=7).count(), 3)
+
+    def test_parallel_import_merges_route_results(self):
+        from .services import import_bus_data_parallel
+
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for route_id in (7, 8):
+                path = Path(tmp) / f"route_{route_id}.json"
+                items = [self._item("А001АА", f"12.12.2025 03:1{route_id}:00"), self._item("В002ВВ", "12.12.2025 03:14:50")]
+                path.write_text(json.dumps({"route_id": route_id, "route_name": str(route_id), "bus_data": items}), encoding='utf-8')
+                paths.append(path)
+            (Path(tmp) / "route_9.json").write_text('{"route_id": 9, "bus_data": [', encoding='utf-8')
+            paths.append(Path(tmp) / "route_9.json")
+
+            result = import_bus_data_parallel(paths, workers=2)
+
+        self.assertEqual([report['file'] for report in result['files']], ["route_7.json", "route_8.json", "route_9.json"])
+        self.assertEqual(result['total_positions_created'], 3)
+        self.assertEqual(result['total_positions_deduplicated'], 1)
+        self.assertEqual(len(result['errors']), 1)
+        self.assertEqual(Vehicle.objects.count(), 2)
+
+    def test_upload_is_queued_and_imported_by_job(self):
+        from unittest import mock
+        from .ingest import run_ingest_job
+
+        client = APIClient()
+        upload = self._make_file("route_7.json", [self._item("А001АА", "12.12.2025 03:14:49")])
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch('project.ingest.SPOOL_DIR', Path(tmp)), \
+                mock.patch('project.api.async_task') as enqueue:
+            response = client.post('/api/upload-bus-data/', {'files': [upload]}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            job_id = response.data['job_id']
+            enqueue.assert_called_once_with('project.tasks.run_ingest_job_task', job_id)
+            self.assertEqual(VehiclePosition.objects.count(), 0)
+
+            job = run_ingest_job(job_id)
+            self.assertFalse(Path(job.spool_dir).exists())
+
+        self.assertEqual(job.status, 'done')
+        self.assertEqual((job.files_done, job.files_total, job.positions_created), (1, 1, 1))
+        detail = client.get(f'/api/ingest-jobs/{job_id}/')
+        self.assertEqual(detail.status_code, status.HTTP_200_OK)
+        self.assertEqual(detail.data['status'], 'done')
+
+class PositionPartitioningTests(TestCase):
+    """Секционирование позиций по времени и удаление целых секций."""
+
+    def setUp(self):
+        self.ttype = TransportType.objects.create(name="Автобус")
+        self.route = Route.objects.create(id=7, name="7", transport_type=self.ttype)
+
+    def test_import_creates_partition_for_data(self):
+        from .partitioning import list_partitions
+        items = [BusDataImportTests._item("А001АА", "12.12.2025 03:14:49")]
+        import_bus_data_from_files([BusDataImportTests._make_file("route_7.json", items)])
+        names = [name for name, _, _ in list_partitions()]
+        self.assertIn("project_vehicleposition_p2025_12", names)
+        self.assertEqual(VehiclePosition.objects.filter(timestamp__year=2025).count(), 1)
+
+    def test_partition_created_over_rows_in_default(self):
+        from datetime import datetime, timezone as dt_timezone
+        from .partitioning import ensure_partitions
+        veh = Vehicle.objects.create(gos_num="А001АА")
+        moment = datetime(2024, 3, 5, 10, 0, tzinfo=dt_timezone.utc)
+        VehiclePosition.objects.create(vehicle=veh, timestamp=moment, location=Point(104.28, 52.28, srid=4326))
+
+        created = ensure_partitions(moment, moment)
+        self.assertEqual(created, ["project_vehicleposition_p2024_03"])
+        self.assertEqual(VehiclePosition.objects.filter(timestamp=moment).count(), 1)
+
+    def test_partitions_only_for_intervals_in_batch(self):
+        from datetime import datetime, timezone as dt_timezone
+        from .partitioning import ensure_partitions_for, list_partitions
+        moments = [
+            datetime(2025, 1, 10, tzinfo=dt_timezone.utc), datetime(2025, 6, 10, tzinfo=dt_timezone.utc),
+            datetime(1970, 1, 1, tzinfo=dt_timezone.utc), datetime(2090, 1, 1, tzinfo=dt_timezone.utc),
+        ]
+        created = ensure_partitions_for(np.array([int(moment.timestamp()) for moment in moments]))
+        # Ни месяцев между метками, ни секций для битых меток: они ложатся в секцию по умолчанию
+        self.assertEqual(created, ["project_vehicleposition_p2025_01", "project_vehicleposition_p2025_06"])
+        names = [name for name, _, _ in list_partitions()]
+        self.assertNotIn("project_vehicleposition_p2025_03", names)
+        self.assertNotIn("project_vehicleposition_p1970_01", names)
+
+    def test_partition_dropped_by_another_process_is_recreated(self):
+        from datetime import datetime, timezone as dt_timezone
+        from django.db import connection
+        from . import partitioning
+        from .partitioning import PARTITIONS_VERSION_NAME, ensure_partitions_for
+        from .versions import bump_index_version
+
+        self.addCleanup(partitioning._known_partitions.clear)
+        timestamps = np.array([int(datetime(2025, 2, 10, tzinfo=dt_timezone.utc).timestamp())])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(ensure_partitions_for(timestamps), ["project_vehicleposition_p2025_02"])
+        self.assertEqual(ensure_partitions_for(timestamps), [])
+
+        # Другой процесс удаляет секцию по сроку хранения и увеличивает версию набора секций
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE project_vehicleposition_p2025_02")
+        bump_index_version(PARTITIONS_VERSION_NAME)
+        self.assertEqual(ensure_partitions_for(timestamps), ["project_vehicleposition_p2025_02"])
+
+    def test_delete_before_drops_partitions(self):
+        items = [
+            BusDataImportTests._item("А001АА", "12.11.2025 03:14:49"),
+            BusDataImportTests._item("А001АА", "12.12.2025 03:14:49"),
+        ]
+        import_bus_data_from_files([BusDataImportTests._make_file("route_7.json", items)])
+
+        response = APIClient().post('/api/delete-monitoring-data/', {"before": "2025-12-01T00:00:00Z"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['dropped_partitions'], ["project_vehicleposition_p2025_11"])
+        self.assertEqual(VehiclePosition.objects.count(), 1)
+
+    def test_positions_time_window_filter(self):
+        items = [
+            BusDataImportTests._item("А001АА", "12.11.2025 03:14:49"),
+            BusDataImportTests._item("А001АА", "12.12.2025 03:14:49"),
+        ]
+        import_bus_data_from_files([BusDataImportTests._make_file("route_7.json", items)])
+        response = APIClient().get('/api/vehicle-positions/?from=2025-12-01T00:00:00&to=2026-01-01T00:00:00')
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class VehiclePositionPaginationTests(TestCase):
+    """Курсорная пагинация и проекция полей /api/vehicle-positions/."""
+
+    def setUp(self):
+        self.client = APIClient()
+        ttype = TransportType.objects.create(name="Автобус")
+        self.route = Route.objects.create(name="5", transport_type=ttype)
+        self.vehicle = Vehicle.objects.create(gos_num="К555КК38")
+        start = timezone.now() - timezone.timedelta(hours=1)
+        for i in range(5):
+            VehiclePosition.objects.create(
+                vehicle=self.vehicle, route=self.route,
+                timestamp=start + timezone.timedelta(seconds=15 * i),
+                location=Point(104.28, 52.28, srid=4326), speed=i,
+            )
+
+    def test_pages_follow_next_cursor(self):
+        speeds = []
+        url = f'/api/vehicle-positions/?route_id={self.route.id}&page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            speeds += [item['speed'] for item in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(speeds, [0, 1, 2, 3, 4])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/vehicle-positions/?cursor=broken')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_fields_projection_and_flat_mode(self):
+        response = self.client.get('/api/vehicle-positions/?fields=id,speed&page_size=1')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'speed'})
+
+        response = self.client.get('/api/vehicle-positions/?flat=1&fields=id,vehicle,route&page_size=1')
+        self.assertEqual(response.data['results'][0]['vehicle'], self.vehicle.id)
+        self.assertEqual(response.data['results'][0]['route'], self.route.id)
+
+    def test_bbox_and_time_window_filters(self):
+        VehiclePosition.objects.create(
+            vehicle=self.vehicle, route=self.route, timestamp=timezone.now(),
+            location=Point(105.00, 53.00, srid=4326), speed=99,
+        )
+        response = self.client.get('/api/vehicle-positions/?bbox=104.9,52.9,105.1,53.1')
+        self.assertEqual([item['speed'] for item in response.data['results']], [99])
+
+        since = (timezone.now() - timezone.timedelta(minutes=1)).isoformat()
+        response = self.client.get('/api/vehicle-positions/', {'from': since, 'bbox': '104,52,106,54'})
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_invalid_filters_are_rejected(self):
+        self.assertEqual(self.client.get('/api/vehicle-positions/?bbox=1,2,3').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/vehicle-positions/?from=вчера').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/vehicle-positions/?fields=foo').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class LiveVehiclesTests(TestCase):
+    """Снимок последних позиций и /api/vehicles/live/."""
+
+    def test_snapshot_keeps_newest_position(self):
+        items = [
+            BusDataImportTests._item("А001АА", "12.12.2025 03:15:01"),
+            BusDataImportTests._item("А001АА", "12.12.2025 03:14:49"),
+        ]
+        import_bus_data_from_files([BusDataImportTests._make_file("route_7.json", items)])
+        # Более старая позиция, пришедшая позже, не затирает снимок
+        older = [BusDataImportTests._item("А001АА", "12.12.2025 03:00:00")]
+        import_bus_data_from_files([BusDataImportTests._make_file("route_7.json", older)])
+
+        response = APIClient().get('/api/vehicles/live/?route_id=7')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['gos_num'], "А001АА")
+        self.assertTrue(response.data[0]['timestamp'].startswith("2025-12-12T03:15:01"))
+
+        response = APIClient().get('/api/vehicles/live/?bbox=0,0,1,1')
+        self.assertEqual(response.data, [])
+
+
+class StreamingExportTests(TestCase):
+    """Потоковый экспорт остановок и позиций маршрута."""
+
+    def setUp(self):
+        ttype = TransportType.objects.create(name="Автобус")
+        self.route = Route.objects.create(name="12", transport_type=ttype)
+        vehicle = Vehicle.objects.create(gos_num="Е777ЕЕ38")
+        for i in range(3):
+            VehiclePosition.objects.create(
+                vehicle=vehicle, route=self.route,
+                timestamp=timezone.now() - timezone.timedelta(minutes=i),
+                location=Point(104.28, 52.28, srid=4326), speed=i,
+            )
+        Stop.objects.create(name="Центр", location=Point(104.28, 52.28, srid=4326))
+        Stop.objects.create(name="Без координат")
+
+    @staticmethod
+    def _content(response):
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_route_positions_json_and_csv(self):
+        response = APIClient().get(f'/api/export/route-positions/{self.route.id}/json/')
+        self.assertTrue(response.streaming)
+        data = json.loads(self._content(response))
+        self.assertEqual([item['speed'] for item in data], [2, 1, 0])
+        self.assertAlmostEqual(data[0]['latitude'], 52.28)
+        self.assertEqual(data[0]['vehicle_gos_num'], "Е777ЕЕ38")
+
+        response = APIClient().get(f'/api/export/route-positions/{self.route.id}/csv/')
+        lines = self._content(response).lstrip('\ufeff').strip().splitlines()
+        self.assertEqual(len(lines), 4)
+
+    def test_stops_geojson_skips_stops_without_location(self):
+        response = APIClient().get('/api/export/stops/geojson/')
+        data = json.loads(self._content(response))
+        self.assertEqual(len(data['features']), 1)
+        self.assertEqual(data['features'][0]['geometry']['coordinates'], [104.28, 52.28])
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), "pyarrow не установлен")
+    def test_columnar_export_parquet(self):
+        import io
+        import pyarrow.parquet as pq
+
+        response = APIClient().get(f'/api/export/positions/columnar/?format=parquet&route_id={self.route.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        table = pq.read_table(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(str(table.schema.field('speed').type), 'int16')
+        self.assertEqual(table.column('gos_num').to_pylist(), ["Е777ЕЕ38"] * 3)
+        self.assertEqual(table.column('speed').to_pylist(), [2, 1, 0])
+
+
+@skipUnless(importlib.util.find_spec('aiohttp'), "aiohttp не установлен")
+class AsyncCollectorTests(SimpleTestCase):
+    """Сборщик опрашивает шарды параллельно на локальном сервере-заглушке."""
+
+    def test_split_rids(self):
+        self.assertEqual(split_rids("1-0, 2-0,3-0,", shard_size=2), ["1-0,2-0", "3-0"])
+
+    def test_failing_and_stalled_shards_do_not_block_others(self):
+        from aiohttp import web
+
+        calls = {}
+
+        async def markers(request):
+            rids = request.query['rids']
+            calls[rids] = calls.get(rids, 0) + 1
+            if rids == "3-0,4-0" and calls[rids] <= 2:
+                return web.Response(status=503)
+            if rids == "5-0,6-0":
+                await asyncio.sleep(5)
+            return web.json_response({"maxk": calls[rids], "anims": [{"rid": rids}]})
+
+        async def scenario():
+            app = web.Application()
+            app.router.add_get('/markers', markers)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            samples = []
+            collector = AsyncCollector(
+                f'http://127.0.0.1:{port}/markers', {"rids": "1-0,2-0,3-0,4-0,5-0,6-0", "city": "irkutsk"},
+                on_sample=samples.append, shard_size=2, interval=0.05, jitter=0.01, timeout=0.2,
+                backoff_base=0.05, backoff_max=0.1, log=lambda message: None,
+            )
+            try:
+                stats = await collector.run(1.0)
+            finally:
+                await runner.cleanup()
+            return stats, samples
+
+        stats, samples = asyncio.run(scenario())
+        shards_with_data = {sample["anims"][0]["rid"] for sample in samples}
+        self.assertEqual(shards_with_data, {"1-0,2-0", "3-0,4-0"})
+        self.assertGreater(calls["1-0,2-0"], 5)
+        self.assertGreaterEqual(stats['errors'], 2)
+
+    def test_backoff_does_not_outlast_duration(self):
+        import time
+        from aiohttp import web
+
+        async def markers(request):
+            return web.Response(status=503)
+
+        async def scenario():
+            app = web.Application()
+            app.router.add_get('/markers', markers)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            collector = AsyncCollector(
+                f'http://127.0.0.1:{port}/markers', {"rids": "1-0", "city": "irkutsk"},
+                interval=0.05, jitter=0, timeout=0.2, backoff_base=10, backoff_max=10, log=lambda message: None,
+            )
+            try:
+                return await collector.run(0.3)
+            finally:
+                await runner.cleanup()
+
+        started = time.monotonic()
+        stats = asyncio.run(scenario())
+        # Пауза после ошибки (10 с) обрезается по окончанию сбора
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(stats['errors'], 1)
+
+
+def _run_import_pipeline(sorted_dir, results):
+    """Запуск конвейера импорта в дочернем процессе теста; в results — какой путь импорта выбран."""
+    from unittest import mock
+    from . import data_processing
+
+    report = {
+        "total_positions_created": 0, "total_positions_deduplicated": 0, "total_positions_below_watermark": 0,
+        "total_positions_skipped": 0, "skipped_files": [], "errors": [],
+    }
+    with mock.patch.object(data_processing, 'SORTED_DIR', Path(sorted_dir)), \
+            mock.patch.object(data_processing, 'ensure_future_partitions'), \
+            mock.patch.object(data_processing, 'import_bus_data_parallel', return_value=report) as parallel, \
+            mock.patch.object(data_processing, 'import_bus_data_from_files', return_value=report) as sequential, \
+            mock.patch.object(data_processing, 'dispatch_route_files') as dispatch:
+        try:
+            data_processing.run_import_pipeline(workers=4, incremental=False)
+        except Exception as e:
+            results.put(repr(e))
+        else:
+            results.put(
+                'parallel' if parallel.called else 'sequential' if sequential.called
+                else 'dispatched' if dispatch.called else None
+            )
+
+
+class ImportPipelineDaemonTests(SimpleTestCase):
+    """Импорт из воркера django-q: воркеры — демон-процессы и не могут запускать пул процессов."""
+
+    def _run(self, daemon):
+        import multiprocessing
+
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        with tempfile.TemporaryDirectory() as sorted_dir:
+            (Path(sorted_dir) / 'route_1.json').write_text('{"bus_data": []}')
+            process = context.Process(target=_run_import_pipeline, args=(sorted_dir, results), daemon=daemon)
+            process.start()
+            result = results.get(timeout=30)
+            process.join()
+        return result
+
+    def test_daemon_process_dispatches_files_to_tasks(self):
+        self.assertEqual(self._run(daemon=True), 'dispatched')
+        self.assertEqual(self._run(daemon=False), 'parallel')
+
+
+class ImportTaskFanOutTests(TestCase):
+    """Импорт sorted_routes из воркера django-q раздается нескольким задачам."""
+
+    def test_route_files_are_parsed_by_several_workers(self):
+        from types import SimpleNamespace
+        from unittest import mock
+        from django.utils.module_loading import import_string
+        from . import data_processing, ingest, tasks
+        from .models import IngestJob
+
+        queued = []
+        with tempfile.TemporaryDirectory() as sorted_dir:
+            for route_id in (7, 8, 9):
+                items = [BusDataImportTests._item(f"А00{route_id}АА", f"12.12.2025 03:1{second}:00") for second in range(route_id - 6)]
+                payload = {"route_id": route_id, "route_name": str(route_id), "bus_data": items}
+                (Path(sorted_dir) / f'route_{route_id}.json').write_text(json.dumps(payload, ensure_ascii=False), encoding='utf-8')
+            with mock.patch.object(data_processing, 'SORTED_DIR', Path(sorted_dir)), \
+                    mock.patch.object(data_processing.multiprocessing, 'current_process', return_value=SimpleNamespace(daemon=True)), \
+                    mock.patch.object(ingest, 'async_task', side_effect=lambda func, *args: queued.append((func, args))), \
+                    mock.patch.object(tasks, 'refresh_derived_data') as refresh:
+                tasks.run_import_task(workers=2, incremental=False)
+                refresh.assert_not_called()
+
+                # Каждую группу файлов разбирает своя задача
+                self.assertEqual(len(queued), 2)
+                groups = [set(args[1]) for _, args in queued]
+                self.assertTrue(all(groups))
+                self.assertEqual(groups[0] | groups[1], {str(path) for path in Path(sorted_dir).glob('*.json')})
+                self.assertFalse(groups[0] & groups[1])
+
+                # Производные данные обновляет только последняя завершившаяся задача
+                for func, args in queued:
+                    import_string(func)(*args)
+                refresh.assert_called_once()
+
+        job = IngestJob.objects.get()
+        self.assertEqual((job.status, job.files_done, job.positions_created), (IngestJob.STATUS_DONE, 3, 6))
+        self.assertEqual(VehiclePosition.objects.count(), 6)
+
+
+class RemoveDuplicatesTests(SimpleTestCase):
+    """Потоковая очистка сырых данных: повторы отбрасываются, порядок по maxk сохраняется."""
+
+    def test_external_sort_matches_in_memory_result(self):
+        samples = [{"maxk": (i * 7) % 5, "anims": [{"id": i % 6, "rnum": "Ы"}]} for i in range(40)]
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / 'full_data.json'
+            source.write_text(
+                ''.join(json.dumps(sample, ensure_ascii=False) + '\n' for sample in samples) + 'не json\n',
+                encoding='utf-8',
+            )
+            results = []
+            for budget in (10 ** 9, 100):
+                target = Path(tmp) / f'dedup_{budget}.json'
+                remove_duplicates(source, target, memory_budget=budget)
+                results.append([json.loads(line) for line in target.read_text(encoding='utf-8').splitlines()])
+
+        unique = []
+        for sample in samples:
+            if sample not in unique:
+                unique.append(sample)
+        expected = sorted(unique, key=lambda sample: sample['maxk'])
+        self.assertEqual(results[0], expected)
+        self.assertEqual(results[1], expected)
+
+
+class BusDataDecodingTests(SimpleTestCase):
+    """Пакетное декодирование меток irkbus в массивы."""
+
+    def test_decode_matches_per_item_conversion(self):
+        from datetime import datetime
+        from .decoding import decode_bus_data, epoch_to_datetime
+
+        items = [
+            {"gos_num": "А001АА", "lat": 82173031.6, "lon": "152951138.5", "lasttime": "12.12.2025 03:14:49", "speed": 15, "dir": 213},
+            {"gos_num": "В002ВВ", "lat": 82173031.6, "lon": 152951138.5, "lasttime": "29.02.2024 23:59:59", "speed": None},
+            {"gos_num": "", "lat": 1, "lon": 2, "lasttime": "12.12.2025 03:14:49"},
+            {"gos_num": "С003СС", "lat": "нет", "lon": 2, "lasttime": "12.12.2025 03:14:49"},
+            {"gos_num": "С003СС", "lat": 1, "lon": 2, "lasttime": "31.02.2025 03:14:49"},
+            {"gos_num": "С003СС", "lat": 1, "lon": 2, "lasttime": "12.12.2025 3:14:49"},
+            {"gos_num": "С003СС", "lat": 1, "lon": 2},
+        ]
+        positions, invalid = decode_bus_data(items)
+
+        self.assertEqual(invalid, 5)
+        self.assertEqual(positions.gos_num.tolist(), ["А001АА", "В002ВВ"])
+        self.assertEqual(
+            epoch_to_datetime(positions.timestamp[0]),
+            timezone.make_aware(datetime(2025, 12, 12, 3, 14, 49)),
+        )
+        self.assertEqual(epoch_to_datetime(positions.timestamp[1]), timezone.make_aware(datetime(2024, 2, 29, 23, 59, 59)))
+        self.assertAlmostEqual(positions.lon[0], 152951138.5 / 1467000 - 0.002415)
+        self.assertAlmostEqual(positions.lat[0], 82173031.6 / 1571673 - 0.002005)
+        self.assertEqual(positions.speed.tolist(), [15, 0])
+        self.assertEqual(positions.direction.tolist(), [213, 0])
+
+
+class TripSegmentationTests(TestCase):
+    """Разбиение позиций на рейсы и сжатие траекторий."""
+
+    @staticmethod
+    def _series():
+        """Рейс на восток, стоянка 400 с, рейс на север, разрыв 1000 с, рейс по другому маршруту."""
+        timestamp, lon, lat, route = [], [], [], []
+
+        def add(count, step_lon, step_lat, route_id, start_lon, start_lat):
+            for i in range(count):
+                timestamp.append(timestamp[-1] + 10 if timestamp else 0)
+                lon.append(start_lon + step_lon * i)
+                lat.append(start_lat + step_lat * i)
+                route.append(route_id)
+
+        add(20, 0.001, 0, 1, 104.0, 52.0)
+        add(40, 0.000001, 0, 1, 104.02, 52.0)
+        add(10, 0, 0.001, 1, 104.02, 52.001)
+        add(5, 0, 0.001, 2, 104.0, 52.0)
+        timestamp[-5:] = [value + 1000 for value in timestamp[-5:]]
+        return [np.array(column) for column in (timestamp, lon, lat, route)]
+
+    def test_split_on_dwell_gap_and_route_change(self):
+        from .trips import split_trips
+
+        trips = split_trips(*self._series())
+        self.assertEqual([(int(t[0]), int(t[-1])) for t in trips], [(0, 20), (59, 69), (70, 74)])
+
+    def test_douglas_peucker_respects_tolerance(self):
+        from .trips import douglas_peucker
+
+        x = np.arange(200, dtype=float) * 10
+        y = np.sin(np.arange(200) / 7) * 50
+        keep = douglas_peucker(x, y, 5.0)
+        self.assertTrue(keep[0] and keep[-1])
+        self.assertLess(keep.sum(), 60)
+        # Каждая исходная точка лежит не дальше допуска от упрощенной ломаной
+        kx, ky = x[keep], y[keep]
+        self.assertTrue(np.all(np.abs(np.interp(x, kx, ky) - y) <= 5.0 + 1e-9))
+        self.assertEqual(douglas_peucker(x, np.zeros_like(x), 1.0).sum(), 2)
+
+    def test_rebuild_stores_compressed_trips_and_api(self):
+        from .trips import decode_time_deltas, rebuild_trips
+
+        ttype = TransportType.objects.create(name="Автобус")
+        routes = {route_id: Route.objects.create(id=route_id, name=str(route_id), transport_type=ttype) for route_id in (1, 2)}
+        vehicle = Vehicle.objects.create(gos_num="Т100ТТ38")
+        start = timezone.now().replace(microsecond=0) - timezone.timedelta(hours=2)
+        timestamp, lon, lat, route = self._series()
+        VehiclePosition.objects.bulk_create([
+            VehiclePosition(
+                vehicle=vehicle, route=routes[int(route[i])], timestamp=start + timezone.timedelta(seconds=int(timestamp[i])),
+                location=Point(float(lon[i]), float(lat[i]), srid=4326),
+            ) for i in range(len(timestamp))
+        ])
+
+        stats = rebuild_trips(vehicle_ids=[vehicle.id])
+        self.assertEqual(stats['trips'], 3)
+        first = Trip.objects.order_by('start_time').first()
+        self.assertEqual(first.points_total, 21)
+        self.assertEqual(first.points_kept, 2)
+        self.assertEqual(decode_time_deltas(first.start_time, first.time_deltas)[-1], first.end_time)
+
+        # Повторный инкрементальный запуск пересобирает только последний рейс
+        self.assertEqual(rebuild_trips(vehicle_ids=[vehicle.id])['trips'], 1)
+        self.assertEqual(Trip.objects.count(), 3)
+
+        response = APIClient().get(f'/api/trips/?route_id=1&vehicle_id={vehicle.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(len(response.data['results'][0]['coordinates']), 2)
+        response = APIClient().get('/api/trips/?path=0')
+        self.assertNotIn('coordinates', response.data['results'][0])
+
+    def test_rebuild_after_import_touches_only_new_positions(self):
+        from .trips import rebuild_trips
+
+        # ТС без рейсов и без новых позиций не перечитывается
+        idle = Vehicle.objects.create(gos_num="Б500ББ38")
+        VehiclePosition.objects.create(vehicle=idle, timestamp=timezone.now(), location=Point(104.28, 52.28, srid=4326))
+        items = [BusDataImportTests._item("А001АА", f"12.12.2025 03:15:{second:02d}") for second in (0, 10, 20)]
+        import_bus_data_from_files([BusDataImportTests._make_file("route_7.json", items)])
+
+        stats = rebuild_trips()
+        self.assertEqual((stats['vehicles'], stats['trips']), (1, 1))
+        self.assertEqual(Trip.objects.get().vehicle.gos_num, "А001АА")
+        self.assertEqual(rebuild_trips()['vehicles'], 0)
+
+        # Поздние позиции того же рейса пересобирают его, а не добавляют второй
+        items = [BusDataImportTests._item("А001АА", "12.12.2025 03:15:30")]
+        import_bus_data_from_files([BusDataImportTests._make_file("route_7_late.json", items)])
+        self.assertEqual(rebuild_trips()['vehicles'], 1)
+        self.assertEqual(Trip.objects.get().points_total, 4)
+
+
+class RouteMatchingTests(TestCase):
+    """Геометрия маршрута по остановкам и привязка к ней позиций."""
+
+    def setUp(self):
+        ttype = TransportType.objects.create(name="Автобус")
+        self.route = Route.objects.create(id=7, name="7", transport_type=ttype)
+        points = [(104.0, 52.0), (104.01, 52.0), (104.01, 52.01)]
+        self.stops = [Stop.objects.create(name=f"Остановка {i}", location=Point(*point, srid=4326)) for i, point in enumerate(points)]
+        for order, stop in enumerate(self.stops):
+            RouteStop.objects.create(route=self.route, stop=stop, order=order)
+        RouteStop.objects.create(route=self.route, stop=Stop.objects.create(name="Без координат"), order=10)
+
+    def test_shape_is_cached_and_rebuilt_when_stops_change(self):
+        from .matching import get_route_shape
+
+        shape = get_route_shape(self.route.id)
+        self.assertEqual(shape.stop_ids, [stop.id for stop in self.stops])
+        self.assertAlmostEqual(shape.stop_offsets[1], 684.5, delta=1)
+        self.assertEqual(get_route_shape(self.route.id).built_at, shape.built_at)
+
+        self.stops[2].location = Point(104.02, 52.0, srid=4326)
+        self.stops[2].save()
+        self.assertAlmostEqual(get_route_shape(self.route.id).length, 2 * 684.5, delta=2)
+
+        response = APIClient().get(f'/api/routes/{self.route.id}/shape/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['coordinates']), 3)
+
+    def test_match_positions_gives_offset_and_nearest_stop(self):
+        from .matching import match_positions
+
+        vehicle = Vehicle.objects.create(gos_num="М700ММ38")
+        start = timezone.now().replace(microsecond=0) - timezone.timedelta(hours=1)
+        points = [(104.004, 52.0003), (104.0099, 52.0), (104.011, 52.009), (104.2, 52.0)]
+        VehiclePosition.objects.bulk_create([
+            VehiclePosition(vehicle=vehicle, route=self.route, timestamp=start + timezone.timedelta(seconds=15 * i), location=Point(*point, srid=4326))
+            for i, point in enumerate(points)
+        ])
+
+        matched = match_positions(time_from=start)[self.route.id]
+        self.assertEqual(matched.matched.tolist(), [True, True, True, False])
+        self.assertAlmostEqual(matched.offset[0], 273.8, delta=1)
+        self.assertAlmostEqual(matched.distance[0], 33.4, delta=1)
+        self.assertEqual(matched.nearest_stop_id().tolist(), [self.stops[0].id, self.stops[1].id, self.stops[2].id, -1])
+
+
+class StopArrivalTests(TestCase):
+    """Прохождения остановок и почасовые интервалы движения."""
+
+    def setUp(self):
+        RouteMatchingTests.setUp(self)
+        self.start = timezone.now().replace(minute=5, second=0, microsecond=0) - timezone.timedelta(days=1)
+
+    def _drive(self, gos_num, departure):
+        """ТС проезжает маршрут со скоростью 10 м/с, позиции раз в 15 секунд."""
+        vehicle, _ = Vehicle.objects.get_or_create(gos_num=gos_num)
+        positions = []
+        for step in range(13):
+            distance = min(step * 150, 1796)
+            if distance <= 684.5:
+                point = (104.0 + distance / 684.5 * 0.01, 52.0)
+            else:
+                point = (104.01, 52.0 + (distance - 684.5) / 1111.9 * 0.01)
+            positions.append(VehiclePosition(
+                vehicle=vehicle, route=self.route, location=Point(*point, srid=4326),
+                timestamp=self.start + timezone.timedelta(seconds=departure + 15 * step),
+            ))
+        VehiclePosition.objects.bulk_create(positions)
+
+    def test_arrivals_and_headways_are_built_incrementally(self):
+        from .arrivals import update_stop_arrivals
+        from .models import RouteHeadwayStats, StopArrival
+
+        self._drive("А001АА", 0)
+        self._drive("В002ВВ", 600)
+        stats = update_stop_arrivals()
+        self.assertEqual(stats['arrivals'], 6)
+        self.assertEqual(
+            list(StopArrival.objects.filter(vehicle__gos_num="А001АА").values_list('stop_id', flat=True)),
+            [stop.id for stop in self.stops],
+        )
+        hour = RouteHeadwayStats.objects.get(route=self.route)
+        self.assertEqual((hour.arrivals, hour.vehicles, hour.headway_count), (6, 2, 3))
+        self.assertAlmostEqual(hour.headway_mean, 600, delta=1)
+
+        # Следующий запуск пересчитывает только перекрытие и добавляет новое
+        self._drive("С003СС", 1500)
+        update_stop_arrivals()
+        self.assertEqual(StopArrival.objects.count(), 9)
+        response = APIClient().get(f'/api/headway-stats/?route_id={self.route.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['headway_count'], 6)
+        response = APIClient().get(f'/api/stop-arrivals/?stop_id={self.stops[1].id}')
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_jumps_along_route_are_not_arrivals(self):
+        import numpy as np
+        from .arrivals import detect_arrivals
+        from .matching import MatchedPositions
+
+        def matched(vehicle_ids, timestamps, offsets, stop_offsets):
+            offset = np.array(offsets, dtype=np.float64)
+            return MatchedPositions(
+                np.array(vehicle_ids), np.array(timestamps, dtype=np.int64), offset, np.zeros(len(offset)),
+                np.abs(offset[:, None] - np.array(stop_offsets)).argmin(axis=1), np.ones(len(offset), dtype=bool), [],
+            )
+
+        # ТС 2 за 15 секунд "проезжает" весь маршрут — скачок привязки
+        stop_offsets = [0, 684.5, 1796]
+        events = detect_arrivals(matched([1, 1, 1, 2, 2], [0, 100, 200, 0, 15], [10, 700, 1790, 10, 1790], stop_offsets), stop_offsets)
+        self.assertEqual(events['vehicle_id'].tolist(), [1, 1, 1])
+        # Шаг с обычной скоростью, но через шесть остановок сразу, тоже отбрасывается
+        stop_offsets = [200.0 * i for i in range(8)]
+        events = detect_arrivals(matched([3, 3], [0, 120], [50, 1350], stop_offsets), stop_offsets)
+        self.assertEqual(len(events['arrival']), 0)
+        events = detect_arrivals(matched([3, 3], [0, 120], [50, 650], stop_offsets), stop_offsets)
+        self.assertEqual(events['stop_index'].tolist(), [1, 2, 3])
+
+
+class ConnectionTravelTimeTests(TestCase):
+    """Время в пути по соединениям из прохождений остановок."""
+
+    def setUp(self):
+        StopArrivalTests.setUp(self)
+
+    def _drive(self, gos_num, departure):
+        StopArrivalTests._drive(self, gos_num, departure)
+
+    def test_travel_times_are_accumulated_once(self):
+        from .arrivals import update_stop_arrivals
+        from .models import Connection
+        from .travel_times import apply_to_connections, update_travel_times
+
+        connection = Connection.objects.create(from_stop=self.stops[0], to_stop=self.stops[1], travel_time=5)
+        self._drive("А001АА", 0)
+        self._drive("В002ВВ", 300)
+        # Поздний рейс сдвигает отметку прохождений: первые два рейса больше не пересчитываются
+        self._drive("С003СС", 4000)
+        update_stop_arrivals()
+        update_travel_times()
+        update_travel_times()
+
+        response = APIClient().get(f'/api/connections/{connection.id}/travel-times/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        bucket, = response.data['buckets']
+        self.assertEqual(bucket['count'], 2)
+        # 684,5 м со скоростью 10 м/с, время считается от отхода с первой остановки
+        self.assertTrue(60 <= bucket['p50'] <= 75)
+
+        self.assertEqual(apply_to_connections(min_count=2), 1)
+        connection.refresh_from_db()
+        self.assertEqual(connection.travel_time, 1)
+
+        # Удаление данных маршрута и повторный импорт тех же рейсов не удваивают гистограммы
+        response = APIClient().post('/api/delete-monitoring-data/', {"route_ids": [self.route.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for gos_num, departure in (("А001АА", 0), ("В002ВВ", 300), ("С003СС", 4000)):
+            self._drive(gos_num, departure)
+        update_stop_arrivals()
+        update_travel_times()
+        response = APIClient().get(f'/api/connections/{connection.id}/travel-times/')
+        self.assertEqual(response.data['buckets'][0]['count'], 2)
+
+
+class JourneyPlannerTests(TestCase):
+    """Поиск поездки по графу остановок в памяти."""
+
+    def setUp(self):
+        ttype = TransportType.objects.create(name="Автобус")
+        points = [(104.0, 52.0), (104.01, 52.0), (104.02, 52.0), (104.02, 52.01)]
+        self.stops = [Stop.objects.create(name=f"Остановка {i}", location=Point(*point, srid=4326)) for i, point in enumerate(points)]
+        self.first = Route.objects.create(name="1", transport_type=ttype)
+        self.second = Route.objects.create(name="2", transport_type=ttype)
+        for order, stop in enumerate(self.stops[:3]):
+            RouteStop.objects.create(route=self.first, stop=stop, order=order)
+        for order, stop in enumerate(self.stops[2:]):
+            RouteStop.objects.create(route=self.second, stop=stop, order=order)
+        Connection.objects.create(from_stop=self.stops[0], to_stop=self.stops[1], travel_time=2)
+
+    def test_plan_counts_transfers_and_follows_graph_changes(self):
+        url = f'/api/plan/?from={self.stops[0].id}&to={self.stops[3].id}'
+        response = APIClient().get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['transfers'], 1)
+        self.assertEqual([leg['routes'][0]['name'] for leg in response.data['legs']], ["1", "2"])
+        self.assertEqual([stop['id'] for stop in response.data['legs'][0]['stops']], [stop.id for stop in self.stops[:3]])
+        # Соединение задано явно (2 мин), остальное — по расстоянию со скоростью по умолчанию
+        self.assertGreater(response.data['travel_time'], 120)
+
+        # Новое соединение сбрасывает граф: прямой путь быстрее
+        Connection.objects.create(from_stop=self.stops[0], to_stop=self.stops[3], travel_time=1)
+        response = APIClient().get(url)
+        self.assertEqual((response.data['travel_time'], response.data['transfers']), (60, 0))
+
+        response = APIClient().get(f'/api/plan/?from={self.stops[3].id}&to={self.stops[0].id}')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = APIClient().get('/api/plan/?from=abc&to=1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_graph_follows_changes_made_in_another_process(self):
+        from django.core.cache import cache
+        from django.db.models import F
+        from .models import IndexVersion
+        from .planner import GRAPH_VERSION_NAME
+
+        url = f'/api/plan/?from={self.stops[0].id}&to={self.stops[1].id}'
+        self.assertEqual(APIClient().get(url).data['travel_time'], 120)
+        # Другой процесс меняет соединение массовым обновлением и увеличивает версию в БД;
+        # кэш Django у каждого процесса свой
+        Connection.objects.filter(from_stop=self.stops[0], to_stop=self.stops[1]).update(travel_time=1)
+        IndexVersion.objects.filter(name=GRAPH_VERSION_NAME).update(version=F('version') + 1)
+        cache.clear()
+        self.assertEqual(APIClient().get(url).data['travel_time'], 60)
+
+
+class StopIndexTests(TestCase):
+    """Ближайшие остановки и остановки в радиусе по индексу в памяти."""
+
+    def setUp(self):
+        points = [(104.0, 52.0), (104.002, 52.0), (104.01, 52.0), (104.05, 52.05)]
+        self.stops = [Stop.objects.create(name=f"Остановка {i}", location=Point(*point, srid=4326)) for i, point in enumerate(points)]
+        Stop.objects.create(name="Без координат")
+
+    def test_nearest_within_and_bulk(self):
+        client = APIClient()
+        response = client.get('/api/stops/nearest/?lon=104.0005&lat=52.0&n=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([stop['id'] for stop in response.data], [self.stops[0].id, self.stops[1].id])
+        self.assertAlmostEqual(response.data[0]['distance'], 34.3, delta=0.5)
+
+        response = client.get('/api/stops/within/?lon=104.0&lat=52.0&radius=1000')
+        self.assertEqual([stop['id'] for stop in response.data], [stop.id for stop in self.stops[:3]])
+
+        response = client.post('/api/stops/nearest-bulk/', {'points': [[104.049, 52.05], [104.0, 52.0], [0, 0]], 'radius': 500}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([[found['id'] for found in point] for point in results], [[self.stops[3].id], [self.stops[0].id], []])
+
+        # Изменение остановки сбрасывает индекс
+        self.stops[3].location = Point(104.0, 52.0001, srid=4326)
+        self.stops[3].save()
+        response = client.get('/api/stops/nearest/?lon=104.0&lat=52.0001')
+        self.assertEqual(response.data[0]['id'], self.stops[3].id)
+
+        self.assertEqual(client.get('/api/stops/nearest/?lon=abc&lat=52').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client.get('/api/stops/?polygon=NOT-WKT').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_index_follows_stop_writes_in_another_process(self):
+        from django.db.models import F
+        from .models import IndexVersion
+        from .stop_index import STOP_INDEX_VERSION_NAME
+
+        client = APIClient()
+        self.assertEqual(client.get('/api/stops/nearest/?lon=104.05&lat=52.05').data[0]['id'], self.stops[3].id)
+        # Запись остановки в другом процессе видна только по версии в БД
+        Stop.objects.filter(pk=self.stops[2].pk).update(location=Point(104.05, 52.05, srid=4326))
+        IndexVersion.objects.filter(name=STOP_INDEX_VERSION_NAME).update(version=F('version') + 1)
+        response = client.get('/api/stops/nearest/?lon=104.05&lat=52.05&n=2')
+        self.assertEqual({stop['id'] for stop in response.data}, {self.stops[2].id, self.stops[3].id})
+
+
+class VectorTileTests(TestCase):
+    """Векторные тайлы и их дисковый кэш."""
+
+    def setUp(self):
+        from unittest import mock
+
+        self.stop = Stop.objects.create(name="Центр", location=Point(104.0, 52.0, srid=4326))
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patcher = mock.patch('project.tiles.TILE_CACHE_DIR', Path(cache_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _tile_url(self, layer, z, lon, lat):
+        n = 2 ** z
+        x = int((lon + 180) / 360 * n)
+        y = int((1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2 * n)
+        return f'/tiles/{layer}/{z}/{x}/{y}.mvt'
+
+    def test_stop_tile_is_cached_until_stops_change(self):
+        url = self._tile_url('stops', 15, 104.0, 52.0)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn(b'stops', response.content)
+        self.assertEqual(response['X-Tile-Cache'], 'miss')
+        self.assertEqual(self.client.get(url)['X-Tile-Cache'], 'hit')
+
+        self.stop.name = "Центр-2"
+        self.stop.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Tile-Cache'], 'miss')
+        self.assertIn("Центр-2".encode('utf-8'), response.content)
+
+        self.assertEqual(self.client.get('/tiles/unknown/1/0/0.mvt').status_code, 404)
+        self.assertEqual(self.client.get('/tiles/stops/1/5/0.mvt').status_code, 404)
+
+    def test_low_zoom_history_is_built_from_density_cells(self):
+        from .heatmap import update_position_density
+
+        vehicle = Vehicle.objects.create(gos_num="А001АА")
+        VehiclePosition.objects.bulk_create([
+            VehiclePosition(
+                vehicle=vehicle, location=Point(104.0, 52.0, srid=4326), speed=30,
+                timestamp=timezone.now() - timezone.timedelta(hours=2, seconds=i),
+            )
+            for i in range(5)
+        ])
+        url = self._tile_url('positions', 10, 104.0, 52.0)
+        # История на мелком масштабе читается из агрегатов, а они еще не построены
+        self.assertNotIn(b'positions', self.client.get(url).content)
+        self.assertEqual(self.client.get(url)['X-Tile-Cache'], 'hit')
+
+        # Обновление агрегатов сбрасывает кэш мелких масштабов
+        update_position_density()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Tile-Cache'], 'miss')
+        self.assertIn(b'positions', response.content)
+        self.assertIn(b'positions', self.client.get(self._tile_url('positions', 16, 104.0, 52.0)).content)
+        # Ячейки вне диапазона номеров соседнего тайла в него не попадают
+        self.assertNotIn(b'positions', self.client.get(self._tile_url('positions', 10, 104.5, 52.0)).content)
+
+        # Тайлы с интервалом времени не кэшируются
+        since = (timezone.now() - timezone.timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S')
+        for _ in range(2):
+            response = self.client.get(f'{url}?from={since}')
+            self.assertEqual(response['X-Tile-Cache'], 'miss')
+            self.assertIn(b'positions', response.content)
+        self.assertNotIn(b'positions', self.client.get(f'{url}?from={timezone.now():%Y-%m-%dT%H:%M:%S}').content)
+
+
+class HeatmapTests(TestCase):
+    """Почасовые агрегаты тепловой карты и запрос по ним."""
+
+    def setUp(self):
+        ttype = TransportType.objects.create(name="Автобус")
+        self.route = Route.objects.create(name="5", transport_type=ttype)
+        self.vehicle = Vehicle.objects.create(gos_num="А001АА")
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0) - timezone.timedelta(days=1)
+
+    def _positions(self, speeds, minute=0, route=None):
+        """Позиции с отметками новых позиций, как их оставляет импорт."""
+        from .decoding import PositionRecords
+        from .ledger import record_position_changes
+
+        route = route or self.route
+        positions = VehiclePosition.objects.bulk_create([
+            VehiclePosition(
+                vehicle=self.vehicle, route=route, location=Point(104.0, 52.0, srid=4326), speed=speed,
+                timestamp=self.hour + timezone.timedelta(minutes=minute, seconds=i),
+            )
+            for i, speed in enumerate(speeds)
+        ])
+        count = len(positions)
+        record_position_changes(PositionRecords(
+            [self.vehicle.id] * count, route.id, [int(position.timestamp.timestamp()) for position in positions],
+            [104.0] * count, [52.0] * count, [position.speed for position in positions], [0] * count,
+        ))
+
+    def test_rollup_is_refreshed_without_double_counting(self):
+        from .heatmap import update_position_density
+
+        self._positions(range(10, 101, 10))
+        update_position_density()
+        update_position_density()
+        response = APIClient().get(f'/api/heatmap/?route_id={self.route.id}&bbox=103.9,51.9,104.1,52.1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        cell, = response.data['cells']
+        self.assertEqual((cell['count'], cell['mean_speed']), (10, 55.0))
+        self.assertAlmostEqual(cell['p85_speed'], 92.5)
+        self.assertAlmostEqual(cell['lat'], 52.0, delta=0.01)
+
+        # Позиции, дописанные в уже агрегированный час, пересчитывают его
+        self._positions([0], minute=30)
+        update_position_density()
+        response = APIClient().get('/api/heatmap/?scale=4')
+        self.assertEqual(response.data['cells'][0]['count'], 11)
+        self.assertEqual(response.data['cell_size'], 1000)
+
+    def test_late_positions_of_another_route_are_aggregated(self):
+        from .heatmap import update_position_density
+
+        self._positions([10])
+        update_position_density()
+        # Маршрут прислал данные за сутки до уже агрегированных позиций другого маршрута
+        late_route = Route.objects.create(name="7", transport_type=self.route.transport_type)
+        self._positions([30, 50], minute=-2 * 24 * 60, route=late_route)
+        self.assertEqual(update_position_density()['cells'], 1)
+        response = APIClient().get(f'/api/heatmap/?route_id={late_route.id}')
+        cell, = response.data['cells']
+        self.assertEqual((cell['count'], cell['mean_speed']), (2, 40.0))
+        self.assertEqual(APIClient().get(f'/api/heatmap/?route_id={self.route.id}').data['cells'][0]['count'], 1)
+
+    def test_window_is_bounded(self):
+        from .heatmap import update_position_density
+
+        self._positions([10])
+        self._positions([20, 30], minute=-10 * 24 * 60)
+        update_position_density()
+        # Без from — только последние HEATMAP_DEFAULT_DAYS суток
+        cell, = APIClient().get('/api/heatmap/').data['cells']
+        self.assertEqual(cell['count'], 1)
+        since = (self.hour - timezone.timedelta(days=11)).strftime('%Y-%m-%dT%H:%M:%S')
+        cell, = APIClient().get(f'/api/heatmap/?from={since}').data['cells']
+        self.assertEqual(cell['count'], 3)
+        since = (self.hour - timezone.timedelta(days=40)).strftime('%Y-%m-%dT%H:%M:%S')
+        self.assertEqual(APIClient().get(f'/api/heatmap/?from={since}').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityRollupTests(TestCase):
+    """Сводки работы маршрутов и ТС и запросы по ним."""
+
+    def setUp(self):
+        ttype = TransportType.objects.create(name="Автобус")
+        self.route = Route.objects.create(name="5", transport_type=ttype)
+        self.vehicles = [Vehicle.objects.create(gos_num=gos_num) for gos_num in ("А001АА", "А002АА")]
+        day = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - timezone.timedelta(days=1)
+        self.start = day + timezone.timedelta(hours=10)
+
+    def _track(self, vehicle, points, minute=0):
+        """Позиции ТС раз в минуту, каждая следующая на 0.001° (~111 м) севернее."""
+        VehiclePosition.objects.bulk_create([
+            VehiclePosition(
+                vehicle=vehicle, route=self.route, location=Point(104.0, 52.0 + 0.001 * i, srid=4326), speed=40,
+                timestamp=self.start + timezone.timedelta(minutes=minute + i),
+            )
+            for i in range(points)
+        ])
+
+    def test_rollups_are_refreshed_without_double_counting(self):
+        from .rollups import update_activity_rollups
+
+        for vehicle in self.vehicles:
+            self._track(vehicle, 11)
+        # Скачок координат на 50 км за минуту в расстояние не входит
+        VehiclePosition.objects.create(
+            vehicle=self.vehicles[1], route=self.route, location=Point(104.0, 52.5, srid=4326), speed=40,
+            timestamp=self.start + timezone.timedelta(minutes=11),
+        )
+        update_activity_rollups()
+        update_activity_rollups()
+
+        response = APIClient().get(f'/api/stats/routes/?period=day&route_id={self.route.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rollup, = response.data['results']
+        self.assertEqual((rollup['vehicles'], rollup['samples'], rollup['mean_speed']), (2, 23, 40.0))
+        self.assertAlmostEqual(rollup['distance'], 2 * 10 * 111.2, delta=5)
+
+        response = APIClient().get(f'/api/stats/vehicles/?vehicle_id={self.vehicles[0].id}')
+        hour, = response.data['results']
+        self.assertEqual((hour['routes'], hour['samples']), (1, 11))
+
+        response = APIClient().get('/api/stats/fleet/?period=day')
+        day, = response.data['results']
+        self.assertEqual((day['vehicles'], day['samples']), (2, 23))
+        self.assertEqual(APIClient().get('/api/stats/fleet/?period=week').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_late_import_recomputes_past_day(self):
+        from .rollups import update_activity_rollups
+
+        self._track(self.vehicles[0], 3)
+        update_activity_rollups()
+        # Файл маршрута за прошлые сутки пришел после того, как текущие уже посчитаны
+        items = [BusDataImportTests._item("В002ВВ", f"12.12.2025 03:15:{second:02d}") for second in (0, 10)]
+        import_bus_data_from_files([BusDataImportTests._make_file("route_7.json", items)])
+        self.assertEqual(update_activity_rollups()['days'], 1)
+
+        response = APIClient().get('/api/stats/routes/?period=day&route_id=7&to=2026-01-01T00:00:00')
+        rollup, = response.data['results']
+        self.assertEqual((rollup['vehicles'], rollup['samples']), (1, 2))
+        response = APIClient().get(f'/api/stats/vehicles/?period=day&vehicle_id={self.vehicles[0].id}')
+        self.assertEqual(response.data['results'][0]['samples'], 3)
@@ -0,0 +1,218 @@
+# project/tiles.py
+"""
+Векторные тайлы (Mapbox Vector Tile) для карты: остановки, текущие позиции ТС и история позиций.
+
+Тайл собирается одним запросом PostGIS (ST_TileEnvelope, ST_AsMVTGeom, ST_AsMVT), поэтому
+стоимость отрисовки зависит от видимой области, а не от объема данных. Точки остановок и истории
+группируются по ячейкам сетки в координатах тайла: на мелких масштабах (z < TILE_CLUSTER_MAX_ZOOM)
+ячейка — TILE_CLUSTER_PIXELS единиц, и объект несет число точек count; на крупных история
+позиций все равно схлопывается до одной точки на единицу тайла.
+
+История позиций на мелких масштабах читается не из таблицы позиций, а из почасовых агрегатов
+тепловой карты (PositionDensityCell): тайл всего города без интервала времени иначе просматривал бы
+всю историю. Интервал from/to на этих масштабах учитывается с точностью до часа.
+
+Готовые тайлы кэшируются на диске в TILE_CACHE_DIR/<слой>/<параметры>/<z>/<x>/<y>.mvt; тайлы
+с интервалом from/to не кэшируются — каждое значение дало бы свой каталог. Импорт позиций
+сбрасывает кэш слоев позиций, обновление агрегатов — кэш мелких масштабов истории (DENSITY_TILES),
+изменение остановок — слоя остановок.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .heatmap import HEATMAP_CELL_SIZE
+from .models import PositionDensityCell, Stop, VehicleLastPosition, VehiclePosition
+
+# Размер тайла в единицах MVT и запас по краям (чтобы значки на границе не обрезались)
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+TILE_MAX_ZOOM = 22
+# До этого масштаба точки объединяются в кластеры размером TILE_CLUSTER_PIXELS единиц тайла
+TILE_CLUSTER_MAX_ZOOM = getattr(settings, 'BUS_TILE_CLUSTER_MAX_ZOOM', 14)
+TILE_CLUSTER_PIXELS = getattr(settings, 'BUS_TILE_CLUSTER_PIXELS', 128)
+# Каталог дискового кэша тайлов (None — без кэша)
+TILE_CACHE_DIR = getattr(settings, 'BUS_TILE_CACHE_DIR', Path(settings.BASE_DIR) / 'data_processing_files' / 'tiles')
+
+TILE_LAYERS = ('stops', 'vehicles', 'positions')
+POSITION_LAYERS = ('vehicles', 'positions')
+# Каталог кэша тайлов positions мелких масштабов (строятся по агрегатам PositionDensityCell)
+DENSITY_TILES = 'positions_density'
+# Параметры, с которыми тайл не кэшируется
+UNCACHED_PARAMS = ('from', 'to')
+
+# Половина длины экватора в EPSG:3857
+WEB_MERCATOR_HALF = 20037508.342789244
+
+
+class TileNotFound(Exception):
+    """Неизвестный слой или координаты тайла вне сетки."""
+
+
+def _points_sql(table, attributes='', where=''):
+    """Точки таблицы в видимой области (с запасом) в координатах тайла."""
+    return f"""
+        SELECT ST_AsMVTGeom(ST_Transform(t.location, 3857), bounds.geom, {TILE_EXTENT}, {TILE_BUFFER}, true) AS geom{attributes}
+        FROM {table} t, bounds
+        WHERE t.location && ST_Transform(bounds.search, 4326){where}
+    """
+
+
+def _features_sql(points):
+    return f"SELECT * FROM ({points}) p WHERE p.geom IS NOT NULL"
+
+
+def _clusters_sql(points, grid, aggregates=''):
+    """Точки, объединенные по ячейкам размером grid единиц тайла: центр, число точек и агрегаты."""
+    return f"""
+        SELECT ST_SnapToGrid(ST_Centroid(ST_Collect(p.geom)), 1) AS geom, count(*) AS count{aggregates}
+        FROM ({points}) p
+        WHERE p.geom IS NOT NULL
+        GROUP BY ST_SnapToGrid(p.geom, {grid})
+    """
+
+
+def _tile_margin(z):
+    """Запас по краям тайла (TILE_BUFFER единиц) в метрах EPSG:3857."""
+    return 2 * WEB_MERCATOR_HALF / 2 ** z * TILE_BUFFER / TILE_EXTENT
+
+
+def _tile_bounds(z, x, y, margin=0.0):
+    """Границы тайла в EPSG:3857 (min_x, min_y, max_x, max_y), расширенные на margin метров."""
+    size = 2 * WEB_MERCATOR_HALF / 2 ** z
+    min_x = -WEB_MERCATOR_HALF + x * size
+    max_y = WEB_MERCATOR_HALF - y * size
+    return min_x - margin, max_y - size - margin, min_x + size + margin, max_y + margin
+
+
+def _density_sql(where, grid):
+    """
+    Ячейки агрегатов позиций (центры ячеек сетки тепловой карты), объединенные по ячейкам
+    размером grid единиц тайла: центр, взвешенный числом позиций, число позиций и последний час.
+    Видимая область задается диапазонами номеров ячеек (индекс density_cell_idx), а не
+    пересечением с вычисленной точкой.
+    """
+    center = "ST_SetSRID(ST_MakePoint((c.cell_x + 0.5) * c.cell_size, (c.cell_y + 0.5) * c.cell_size), 3857)"
+    cells = f"""
+        SELECT ST_AsMVTGeom({center}, bounds.geom, {TILE_EXTENT}, {TILE_BUFFER}, true) AS geom, c.count, c.hour
+        FROM {PositionDensityCell._meta.db_table} c, bounds
+        WHERE c.cell_size = %s AND c.cell_x BETWEEN %s AND %s AND c.cell_y BETWEEN %s AND %s{where}
+    """
+    return f"""
+        SELECT ST_MakePoint(round(sum(ST_X(p.geom) * p.count) / sum(p.count)), round(sum(ST_Y(p.geom) * p.count) / sum(p.count))) AS geom,
+               sum(p.count)::bigint AS count, EXTRACT(EPOCH FROM max(p.hour))::bigint AS last_seen
+        FROM ({cells}) p
+        WHERE p.geom IS NOT NULL
+        GROUP BY ST_SnapToGrid(p.geom, {grid})
+    """
+
+
+def _layer_query(layer, z, x, y, params):
+    """SQL объектов слоя и его параметры (кроме z/x/y и запаса области bounds)."""
+    clustered = z < TILE_CLUSTER_MAX_ZOOM
+    if layer == 'stops':
+        points = _points_sql(Stop._meta.db_table, ', t.id, t.name')
+        return (_clusters_sql(points, TILE_CLUSTER_PIXELS) if clustered else _features_sql(points)), []
+    if layer == 'vehicles':
+        points = _points_sql(
+            VehicleLastPosition._meta.db_table,
+            ', t.vehicle_id, t.route_id, t.speed, t.direction, EXTRACT(EPOCH FROM t.timestamp)::bigint AS timestamp',
+        )
+        return _features_sql(points), []
+    if layer == 'positions':
+        where, args = '', []
+        if clustered:
+            # Агрегаты почасовые: час входит в интервал, если пересекается с ним
+            conditions = (('route_id', 'c.route_id = %s'), ('from', "c.hour >= date_trunc('hour', %s)"), ('to', 'c.hour < %s'))
+        else:
+            conditions = (('route_id', 't.route_id = %s'), ('from', 't.timestamp >= %s'), ('to', 't.timestamp < %s'))
+        for param, condition in conditions:
+            if params.get(param) is not None:
+                where += f' AND {condition}'
+                args.append(params[param])
+        if clustered:
+            min_x, min_y, max_x, max_y = _tile_bounds(z, x, y, _tile_margin(z))
+            cell_ranges = [
+                HEATMAP_CELL_SIZE,
+                int(min_x // HEATMAP_CELL_SIZE), int(max_x // HEATMAP_CELL_SIZE),
+                int(min_y // HEATMAP_CELL_SIZE), int(max_y // HEATMAP_CELL_SIZE),
+            ]
+            return _density_sql(where, TILE_CLUSTER_PIXELS), cell_ranges + args
+        points = _points_sql(VehiclePosition._meta.db_table, ', t.timestamp', where)
+        # История и на крупных масштабах схлопывается до одной точки на единицу тайла
+        return _clusters_sql(points, 1, ', EXTRACT(EPOCH FROM max(p.timestamp))::bigint AS last_seen'), args
+    raise TileNotFound(layer)
+
+
+def render_tile(layer, z, x, y, params=None):
+    """Тайл слоя в формате MVT (bytes, пустой — если объектов нет)."""
+    if not 0 <= z <= TILE_MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise TileNotFound(f"{z}/{x}/{y}")
+    sql, args = _layer_query(layer, z, x, y, params or {})
+    margin = _tile_margin(z)
+    query = f"""
+        WITH bounds AS (
+            SELECT ST_TileEnvelope(%s, %s, %s) AS geom, ST_Expand(ST_TileEnvelope(%s, %s, %s), %s) AS search
+        ),
+        mvt AS ({sql})
+        SELECT ST_AsMVT(mvt, %s, {TILE_EXTENT}, 'geom') FROM mvt
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query, [z, x, y, z, x, y, margin, *args, layer])
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] is not None else b''
+
+
+def _cache_path(layer, z, x, y, params):
+    """Путь тайла в кэше; набор параметров слоя — отдельный каталог (отпечаток значений)."""
+    if layer == 'positions' and z < TILE_CLUSTER_MAX_ZOOM:
+        layer = DENSITY_TILES
+    variant = '&'.join(f"{name}={params[name]}" for name in sorted(params) if params[name] is not None)
+    variant = hashlib.blake2b(variant.encode('utf-8'), digest_size=8).hexdigest() if variant else 'all'
+    return Path(TILE_CACHE_DIR) / layer / variant / str(z) / str(x) / f"{y}.mvt"
+
+
+def get_tile(layer, z, x, y, params=None):
+    """Тайл из дискового кэша или свежесобранный. Возвращает (bytes, взят ли из кэша)."""
+    params = params or {}
+    if layer not in TILE_LAYERS:
+        raise TileNotFound(layer)
+    if TILE_CACHE_DIR is None or any(params.get(name) is not None for name in UNCACHED_PARAMS):
+        return render_tile(layer, z, x, y, params), False
+    path = _cache_path(layer, z, x, y, params)
+    try:
+        return path.read_bytes(), True
+    except FileNotFoundError:
+        pass
+    tile = render_tile(layer, z, x, y, params)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Запись через временный файл: параллельный запрос не прочитает недописанный тайл
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as temporary:
+            temporary.write(tile)
+        os.replace(temporary.name, path)
+    except OSError:
+        # Кэш сбрасывают одновременно с записью — тайл просто не сохранится
+        pass
+    return tile, False
+
+
+def invalidate_tiles(layers=POSITION_LAYERS):
+    """Удаляет кэшированные тайлы слоев (каталогов кэша, см. DENSITY_TILES)."""
+    if TILE_CACHE_DIR is None:
+        return
+    for layer in layers:
+        shutil.rmtree(Path(TILE_CACHE_DIR) / layer, ignore_errors=True)
+
+
+@receiver((post_save, post_delete), sender=Stop)
+def _stops_changed(sender, **kwargs):
+    invalidate_tiles(('stops',))
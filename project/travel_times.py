@@ -0,0 +1,221 @@
+# project/travel_times.py
+"""
+Наблюдаемое время в пути по соединениям (Connection) из прохождений остановок.
+
+Проезд соединения from_stop -> to_stop — два последовательных прохождения соседних
+остановок маршрута одним ТС; время в пути считается от отправления с первой до прибытия
+на вторую. Проезды раскладываются по интервалам суток (местное время отправления) и
+корзинам фиксированной ширины; гистограммы ConnectionTravelTime складываются, так что
+каждый запуск добавляет только новые проезды и историю не перечитывает.
+
+Новыми считаются прохождения между отметкой стадии и отметкой стадии прохождений за вычетом
+ее перекрытия: более ранние прохождения уже не пересчитываются и не будут учтены дважды.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .arrivals import ARRIVAL_LOOKBACK, ARRIVAL_STAGE
+from .ledger import advance_stage_watermark, stage_watermark
+from .models import AnalyticsWatermark, Connection, ConnectionTravelTime, StopArrival
+from .planner import invalidate_index
+from .trips import epoch_expression
+
+TRAVEL_TIME_STAGE = 'travel_times'
+
+# Длина интервала суток (мин) и ширина корзины гистограммы (сек)
+TRAVEL_TIME_BUCKET_MINUTES = getattr(settings, 'BUS_TRAVEL_TIME_BUCKET_MINUTES', 60)
+TRAVEL_TIME_BIN_SECONDS = getattr(settings, 'BUS_TRAVEL_TIME_BIN_SECONDS', 15)
+# Проезды дольше этого (сек) — перерыв в движении, а не время в пути
+TRAVEL_TIME_MAX_SECONDS = getattr(settings, 'BUS_TRAVEL_TIME_MAX_SECONDS', 1800)
+# Сколько проездов нужно, чтобы заменить Connection.travel_time наблюдаемым значением
+TRAVEL_TIME_MIN_COUNT = getattr(settings, 'BUS_TRAVEL_TIME_MIN_COUNT', 20)
+
+
+def bucket_count():
+    return 24 * 60 // TRAVEL_TIME_BUCKET_MINUTES
+
+
+def bin_count():
+    return -(-TRAVEL_TIME_MAX_SECONDS // TRAVEL_TIME_BIN_SECONDS)
+
+
+def histogram_percentile(histogram, bin_seconds, q):
+    """Процентиль q (0..1) по гистограмме с линейной интерполяцией внутри корзины; None для пустой."""
+    histogram = np.asarray(histogram, dtype=np.int64)
+    total = histogram.sum()
+    if not total:
+        return None
+    cumulative = np.cumsum(histogram)
+    target = q * total
+    index = int(np.searchsorted(cumulative, target))
+    before = cumulative[index - 1] if index else 0
+    return float((index + (target - before) / histogram[index]) * bin_seconds)
+
+
+def _local_seconds_of_day(epoch):
+    """Секунды от начала местных суток (TIME_ZONE); смещение пояса считается один раз на час."""
+    tz = timezone.get_current_timezone()
+    hours, inverse = np.unique(epoch // 3600, return_inverse=True)
+    offsets = np.array([
+        int(datetime.fromtimestamp(int(hour) * 3600, tz).utcoffset().total_seconds()) for hour in hours
+    ], dtype=np.int64)
+    return (epoch + offsets[inverse.reshape(-1)]) % 86400
+
+
+def observe_travel_times(route_id, since=None, until=None):
+    """
+    Проезды соединений маршрута с прибытием в [since, until).
+    Возвращает {(connection_id, bucket): (гистограмма, сумма секунд)}.
+    """
+    arrivals = StopArrival.objects.filter(route_id=route_id)
+    if since is not None:
+        # Отправление с предыдущей остановки могло быть раньше since
+        arrivals = arrivals.filter(arrival_time__gte=since - timedelta(seconds=TRAVEL_TIME_MAX_SECONDS))
+    if until is not None:
+        arrivals = arrivals.filter(arrival_time__lt=until)
+    rows = list(
+        arrivals.order_by('vehicle_id', 'arrival_time')
+        .annotate(arrival=epoch_expression('arrival_time'), departure=epoch_expression('departure_time'))
+        .values_list('vehicle_id', 'stop_id', 'stop_index', 'arrival', 'departure')
+    )
+    if len(rows) < 2:
+        return {}
+    vehicle, stop, stop_index, arrival, departure = (np.array(column, dtype=np.int64) for column in zip(*rows))
+
+    travel = arrival[1:] - departure[:-1]
+    ride = (vehicle[1:] == vehicle[:-1]) & (stop_index[1:] == stop_index[:-1] + 1) & (travel > 0) & (travel <= TRAVEL_TIME_MAX_SECONDS)
+    if since is not None:
+        ride &= arrival[1:] >= int(since.timestamp())
+    from_stop, to_stop, travel, started = stop[:-1][ride], stop[1:][ride], travel[ride], departure[:-1][ride]
+    if not len(travel):
+        return {}
+
+    connections = dict(
+        ((from_id, to_id), connection_id) for from_id, to_id, connection_id in
+        Connection.objects.filter(from_stop_id__in=set(from_stop.tolist()), to_stop_id__in=set(to_stop.tolist()))
+        .values_list('from_stop_id', 'to_stop_id', 'id')
+    )
+    connection = np.array([connections.get(pair, -1) for pair in zip(from_stop.tolist(), to_stop.tolist())], dtype=np.int64)
+    known = connection >= 0
+    connection, travel, started = connection[known], travel[known], started[known]
+    if not len(travel):
+        return {}
+
+    bucket = _local_seconds_of_day(started) // (TRAVEL_TIME_BUCKET_MINUTES * 60)
+    bins = np.minimum(travel // TRAVEL_TIME_BIN_SECONDS, bin_count() - 1)
+    keys, key_index = np.unique(connection * bucket_count() + bucket, return_inverse=True)
+    key_index = key_index.reshape(-1)
+    histograms = np.bincount(key_index * bin_count() + bins, minlength=len(keys) * bin_count()).reshape(len(keys), bin_count())
+    totals = np.bincount(key_index, weights=travel, minlength=len(keys))
+    return {
+        (int(key // bucket_count()), int(key % bucket_count())): (histograms[i], int(totals[i]))
+        for i, key in enumerate(keys)
+    }
+
+
+def _fill_percentiles(row):
+    row.count = int(sum(row.histogram))
+    row.p50 = histogram_percentile(row.histogram, row.bin_seconds, 0.50)
+    row.p85 = histogram_percentile(row.histogram, row.bin_seconds, 0.85)
+    row.p95 = histogram_percentile(row.histogram, row.bin_seconds, 0.95)
+
+
+def merge_travel_times(observed):
+    """Добавляет наблюдения к сохраненным гистограммам. Возвращает число обновленных строк."""
+    if not observed:
+        return 0
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {
+            (row.connection_id, row.bucket): row for row in
+            ConnectionTravelTime.objects.select_for_update().filter(connection_id__in={key[0] for key in observed})
+        }
+        to_create, to_update = [], []
+        for (connection_id, bucket), (histogram, total) in observed.items():
+            row = existing.get((connection_id, bucket))
+            if row is None:
+                row = ConnectionTravelTime(connection_id=connection_id, bucket=bucket)
+                to_create.append(row)
+            else:
+                to_update.append(row)
+            if row.bin_seconds != TRAVEL_TIME_BIN_SECONDS or len(row.histogram) != len(histogram):
+                # Ширина корзин изменилась в настройках — накопленная гистограмма несовместима
+                row.bin_seconds, row.histogram, row.total_seconds = TRAVEL_TIME_BIN_SECONDS, [0] * len(histogram), 0
+            row.histogram = (np.asarray(row.histogram, dtype=np.int64) + histogram).tolist()
+            row.total_seconds += total
+            row.updated_at = now
+            _fill_percentiles(row)
+        ConnectionTravelTime.objects.bulk_create(to_create)
+        ConnectionTravelTime.objects.bulk_update(
+            to_update, ['bin_seconds', 'histogram', 'count', 'total_seconds', 'p50', 'p85', 'p95', 'updated_at'],
+        )
+    return len(observed)
+
+
+def update_travel_times(route_ids=None, full=False):
+    """
+    Добавляет к гистограммам проезды из новых прохождений остановок.
+    full=True удаляет накопленные гистограммы и строит их по всем прохождениям.
+    Возвращает {'routes', 'rows'}.
+    """
+    if full:
+        ConnectionTravelTime.objects.all().delete()
+        AnalyticsWatermark.objects.filter(stage=TRAVEL_TIME_STAGE).delete()
+        route_ids = None
+
+    # Учитываются только прохождения, которые стадия прохождений уже не будет пересчитывать
+    settled = AnalyticsWatermark.objects.filter(stage=ARRIVAL_STAGE)
+    if route_ids is not None:
+        settled = settled.filter(route_id__in=route_ids)
+    lookback = timedelta(seconds=ARRIVAL_LOOKBACK)
+
+    stats = {'routes': 0, 'rows': 0}
+    for route_id, arrivals_until in settled.values_list('route_id', 'processed_until'):
+        until = arrivals_until - lookback
+        since = stage_watermark(TRAVEL_TIME_STAGE, route_id)
+        if since is not None and since >= until:
+            continue
+        stats['rows'] += merge_travel_times(observe_travel_times(route_id, since, until))
+        advance_stage_watermark(TRAVEL_TIME_STAGE, route_id, until)
+        stats['routes'] += 1
+    return stats
+
+
+def apply_to_connections(min_count=None):
+    """
+    Записывает в Connection.travel_time медиану наблюдаемого времени в пути (мин) по всем
+    интервалам суток для соединений, у которых не меньше min_count проездов.
+    Возвращает число обновленных соединений.
+    """
+    min_count = TRAVEL_TIME_MIN_COUNT if min_count is None else min_count
+    merged = {}
+    for connection_id, bin_seconds, histogram in (
+        ConnectionTravelTime.objects.filter(bin_seconds=TRAVEL_TIME_BIN_SECONDS).values_list('connection_id', 'bin_seconds', 'histogram')
+    ):
+        merged[connection_id] = merged.get(connection_id, 0) + np.asarray(histogram, dtype=np.int64)
+
+    connections = []
+    for connection in Connection.objects.filter(id__in=merged):
+        histogram = merged[connection.id]
+        if histogram.sum() < min_count:
+            continue
+        minutes = max(1, round(histogram_percentile(histogram, TRAVEL_TIME_BIN_SECONDS, 0.5) / 60))
+        if connection.travel_time != minutes:
+            connection.travel_time = minutes
+            connections.append(connection)
+    Connection.objects.bulk_update(connections, ['travel_time'])
+    if connections:
+        # bulk_update не посылает сигналы моделей — граф планировщика сбрасывается явно
+        invalidate_index()
+    return len(connections)
+
+
+def bucket_label(bucket):
+    """Начало интервала суток в виде ЧЧ:ММ."""
+    minutes = bucket * TRAVEL_TIME_BUCKET_MINUTES
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
@@ -0,0 +1,261 @@
+# project/trips.py
+"""
+Разбиение истории позиций на рейсы и сжатие траекторий.
+
+Позиции каждого ТС читаются в хронологическом порядке и режутся на рейсы по смене
+маршрута, разрывам в данных (дольше TRIP_GAP_SECONDS) и длительным стоянкам
+(ТС дольше TRIP_DWELL_SECONDS не отходит дальше TRIP_DWELL_RADIUS метров — например,
+отстой на конечной). Точки стоянки в рейсы не попадают.
+
+Траектория рейса упрощается алгоритмом Дугласа—Пекера с допуском TRIP_SIMPLIFY_TOLERANCE
+метров и хранится одной строкой Trip: LineString из оставшихся вершин и разности времени
+между соседними вершинами в секундах. Карта и аналитика читают одну строку на рейс
+вместо тысяч точек.
+
+После импорта пересобираются только ТС, для которых импорт оставил отметки новых позиций
+(PositionChange), и только рейсы, которые эти позиции могли продолжить.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import LineString
+from django.db import transaction
+from django.db.models import BigIntegerField, F, FloatField, Func, Max, Min
+
+from .decoding import epoch_to_datetime
+from .ledger import clear_position_changes, pending_position_changes
+from .models import PositionChange, Trip, Vehicle, VehiclePosition
+
+TRIPS_STAGE = 'trips'
+
+# Разрыв в данных (сек), после которого начинается новый рейс
+TRIP_GAP_SECONDS = getattr(settings, 'BUS_TRIP_GAP_SECONDS', 600)
+# Стоянка дольше этого времени (сек) в радиусе TRIP_DWELL_RADIUS (м) разделяет рейсы
+TRIP_DWELL_SECONDS = getattr(settings, 'BUS_TRIP_DWELL_SECONDS', 300)
+TRIP_DWELL_RADIUS = getattr(settings, 'BUS_TRIP_DWELL_RADIUS', 30)
+# Допустимое отклонение упрощенной траектории от исходных точек (м)
+TRIP_SIMPLIFY_TOLERANCE = getattr(settings, 'BUS_TRIP_SIMPLIFY_TOLERANCE', 10.0)
+# Рейсы из меньшего числа точек не сохраняются
+TRIP_MIN_POINTS = getattr(settings, 'BUS_TRIP_MIN_POINTS', 3)
+
+EARTH_RADIUS = 6371008.8
+
+# Маршрут позиций без маршрута в целочисленном столбце
+_NO_ROUTE = -1
+
+
+def local_xy(lon, lat, lat0=None):
+    """
+    Равнопромежуточная проекция в метры относительно широты lat0 (по умолчанию — средней).
+    В пределах города погрешность пренебрежимо мала, а считается проекция векторно.
+    """
+    if lat0 is None:
+        lat0 = np.mean(lat) if len(lat) else 0.0
+    x = EARTH_RADIUS * np.radians(lon) * np.cos(np.radians(lat0))
+    y = EARTH_RADIUS * np.radians(lat)
+    return x, y
+
+
+def split_trips(timestamp, lon, lat, route_id, gap_seconds=None, dwell_seconds=None, dwell_radius=None, min_points=None):
+    """
+    Делит хронологический ряд позиций одного ТС на рейсы.
+    Возвращает список массивов индексов точек, по одному на рейс.
+    """
+    gap_seconds = TRIP_GAP_SECONDS if gap_seconds is None else gap_seconds
+    dwell_seconds = TRIP_DWELL_SECONDS if dwell_seconds is None else dwell_seconds
+    dwell_radius = TRIP_DWELL_RADIUS if dwell_radius is None else dwell_radius
+    min_points = TRIP_MIN_POINTS if min_points is None else min_points
+
+    count = len(timestamp)
+    if count == 0:
+        return []
+
+    # new_trip[i] — точка i начинает новый рейс
+    new_trip = np.zeros(count, dtype=bool)
+    new_trip[0] = True
+    new_trip[1:] |= np.diff(timestamp) > gap_seconds
+    new_trip[1:] |= route_id[1:] != route_id[:-1]
+
+    # Стоянка — серия коротких шагов (точка k-1 -> k) общей длительностью не меньше dwell_seconds.
+    # Рейс заканчивается на первой точке стоянки, следующий начинается с последней.
+    keep = np.ones(count, dtype=bool)
+    x, y = local_xy(lon, lat)
+    still = np.concatenate(([False], np.hypot(np.diff(x), np.diff(y)) < dwell_radius, [False]))
+    edges = np.diff(still.astype(np.int8))
+    for first, last in zip(np.flatnonzero(edges == 1) + 1, np.flatnonzero(edges == -1)):
+        if timestamp[last] - timestamp[first - 1] >= dwell_seconds:
+            keep[first:last] = False
+            new_trip[last] = True
+
+    trip_number = np.cumsum(new_trip)
+    kept = np.flatnonzero(keep)
+    bounds = np.flatnonzero(np.diff(trip_number[kept])) + 1
+    return [indices for indices in np.split(kept, bounds) if len(indices) >= min_points]
+
+
+def douglas_peucker(x, y, tolerance):
+    """
+    Маска вершин, оставшихся после упрощения ломаной алгоритмом Дугласа—Пекера.
+    Рекурсия заменена стеком, расстояния до хорды считаются векторно для всего участка.
+    """
+    count = len(x)
+    keep = np.zeros(count, dtype=bool)
+    if count == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        chord = np.hypot(dx, dy)
+        if chord == 0:
+            # Замкнутый участок: отклонение считается от общей точки
+            distance = np.hypot(px, py)
+        else:
+            distance = np.abs(dx * py - dy * px) / chord
+        farthest = int(np.argmax(distance))
+        if distance[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return keep
+
+
+def compress_trip(timestamp, lon, lat, tolerance=None):
+    """
+    Сжимает траекторию рейса: (маска оставленных вершин, разности времени между ними в секундах,
+    пройденное расстояние по исходным точкам в метрах).
+    """
+    tolerance = TRIP_SIMPLIFY_TOLERANCE if tolerance is None else tolerance
+    x, y = local_xy(lon, lat)
+    keep = douglas_peucker(x, y, tolerance)
+    deltas = np.diff(timestamp[keep])
+    distance = float(np.hypot(np.diff(x), np.diff(y)).sum())
+    return keep, deltas, distance
+
+
+def decode_time_deltas(start_time, deltas):
+    """Время каждой вершины траектории по времени начала рейса и разностям."""
+    offsets = np.concatenate(([0], np.cumsum(deltas, dtype=np.int64)))
+    return [start_time + timedelta(seconds=int(offset)) for offset in offsets]
+
+
+def epoch_expression(field='timestamp'):
+    """Значение поля даты/времени в секундах UTC, вычисленное в БД."""
+    return Func(
+        F(field), template="EXTRACT(EPOCH FROM %(expressions)s)::bigint", output_field=BigIntegerField(),
+    )
+
+
+def _vehicle_positions(vehicle_id, since=None):
+    """Столбцы (timestamp, lon, lat, route_id) позиций ТС в хронологическом порядке."""
+    queryset = VehiclePosition.objects.filter(vehicle_id=vehicle_id)
+    if since is not None:
+        queryset = queryset.filter(timestamp__gte=since)
+    rows = list(
+        queryset.order_by('timestamp')
+        .annotate(
+            epoch=epoch_expression(),
+            lon=Func(F('location'), function='ST_X', output_field=FloatField()),
+            lat=Func(F('location'), function='ST_Y', output_field=FloatField()),
+        )
+        .values_list('epoch', 'lon', 'lat', 'route_id')
+    )
+    if not rows:
+        return None
+    epoch, lon, lat, route = zip(*rows)
+    return (
+        np.array(epoch, dtype=np.int64), np.array(lon, dtype=np.float64), np.array(lat, dtype=np.float64),
+        np.array([_NO_ROUTE if value is None else value for value in route], dtype=np.int64),
+    )
+
+
+def _build_vehicle_trips(vehicle_id, columns, tolerance):
+    timestamp, lon, lat, route = columns
+    trips = []
+    for indices in split_trips(timestamp, lon, lat, route):
+        keep, deltas, distance = compress_trip(timestamp[indices], lon[indices], lat[indices], tolerance)
+        points = indices[keep]
+        route_id = int(route[indices[0]])
+        trips.append(Trip(
+            vehicle_id=vehicle_id,
+            route_id=None if route_id == _NO_ROUTE else route_id,
+            start_time=epoch_to_datetime(timestamp[indices[0]]),
+            end_time=epoch_to_datetime(timestamp[indices[-1]]),
+            path=LineString(list(zip(lon[points].tolist(), lat[points].tolist())), srid=4326),
+            time_deltas=deltas.tolist(),
+            points_total=len(indices),
+            distance=round(distance, 1),
+            tolerance=tolerance,
+        ))
+    return trips
+
+
+def _resume_after(vehicle_id, since):
+    """
+    С какого момента пересобирать рейсы ТС, у которого появились позиции начиная с since:
+    с начала самого раннего рейса, который они могли продолжить, иначе — за TRIP_GAP_SECONDS до since.
+    """
+    boundary = since - timedelta(seconds=TRIP_GAP_SECONDS)
+    first_start = (
+        Trip.objects.filter(vehicle_id=vehicle_id, end_time__gte=boundary)
+        .aggregate(first=Min('start_time'))['first']
+    )
+    return boundary if first_start is None else min(boundary, first_start)
+
+
+def rebuild_trips(vehicle_ids=None, full=False, tolerance=None):
+    """
+    Пересобирает рейсы. По умолчанию — только ТС с отметками новых позиций от импорта:
+    рейсы, которые новые позиции могли продолжить, и все после них.
+    vehicle_ids — пересобрать указанные ТС начиная с их последнего рейса (он мог быть не закончен).
+    full=True удаляет рейсы ТС (без vehicle_ids — всех) и собирает их по всей истории.
+    Возвращает {'vehicles', 'trips', 'points', 'vertices'}.
+    """
+    tolerance = TRIP_SIMPLIFY_TOLERANCE if tolerance is None else tolerance
+    marks = []
+    if full:
+        if vehicle_ids is None:
+            PositionChange.objects.filter(stage=TRIPS_STAGE).delete()
+            vehicle_ids = Vehicle.objects.order_by('id').values_list('id', flat=True)
+        vehicle_ids = list(vehicle_ids)
+        resume = {}
+    elif vehicle_ids is None:
+        marks = pending_position_changes(TRIPS_STAGE)
+        since = {}
+        for mark in marks:
+            since[mark.vehicle_id] = min(mark.since, since.get(mark.vehicle_id, mark.since))
+        vehicle_ids = sorted(since)
+        resume = {vehicle_id: _resume_after(vehicle_id, moment) for vehicle_id, moment in since.items()}
+    else:
+        vehicle_ids = list(vehicle_ids)
+        resume = dict(
+            Trip.objects.filter(vehicle_id__in=vehicle_ids).values('vehicle_id')
+            .annotate(last_start=Max('start_time')).values_list('vehicle_id', 'last_start')
+        )
+
+    stats = {'vehicles': 0, 'trips': 0, 'points': 0, 'vertices': 0}
+    for vehicle_id in vehicle_ids:
+        since = resume.get(vehicle_id)
+        columns = _vehicle_positions(vehicle_id, since)
+        with transaction.atomic():
+            stale = Trip.objects.filter(vehicle_id=vehicle_id)
+            if since is not None:
+                stale = stale.filter(start_time__gte=since)
+            stale.delete()
+            if columns is None:
+                continue
+            trips = _build_vehicle_trips(vehicle_id, columns, tolerance)
+            Trip.objects.bulk_create(trips)
+        stats['vehicles'] += 1
+        stats['trips'] += len(trips)
+        stats['points'] += sum(trip.points_total for trip in trips)
+        stats['vertices'] += sum(len(trip.time_deltas) + 1 for trip in trips)
+    clear_position_changes(marks)
+    return stats
@@ -0,0 +1,30 @@
+# project/versions.py
+"""
+Версии индексов, которые процессы держат в памяти (граф планировщика, индекс остановок,
+проверенные секции таблицы позиций).
+
+Версия хранится в БД (IndexVersion), а не в кэше Django: кэш по умолчанию — память процесса,
+и изменения, сделанные в другом процессе (воркер django-q, команда управления, другой воркер
+WSGI), до остальных процессов через него не доходят. Проверка версии — один запрос по
+первичному ключу; увеличение — один INSERT ... ON CONFLICT в транзакции изменения данных.
+"""
+
+from django.db import connection
+
+from .models import IndexVersion
+
+
+def index_version(name):
+    """Текущая версия индекса (0, если индекс еще не сбрасывался)."""
+    return IndexVersion.objects.filter(name=name).values_list('version', flat=True).first() or 0
+
+
+def bump_index_version(name):
+    """Увеличивает версию индекса: процессы перестроят его при следующем запросе."""
+    table = IndexVersion._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} AS index_version (name, version) VALUES (%s, 1) "
+            f"ON CONFLICT (name) DO UPDATE SET version = index_version.version + 1",
+            [name],
+        )
@@ -1,9 +1,12 @@
 from django.views import View
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
 from project.models import Project
 from django.views.generic import TemplateView
 
+from project.params import parse_time_param
+from project.tiles import TileNotFound, get_tile
+
 class ShowProjectView(TemplateView):
     template_name = "show_project.html"
 
@@ -12,4 +15,32 @@ class ShowProjectView(TemplateView):
         context['project'] = Project.objects.all()
 
         return context
-    
\ No newline at end of file
+    
+
+
+class TileView(View):
+    """
+    Векторный тайл слоя карты: /tiles/<stops|vehicles|positions>/<z>/<x>/<y>.mvt.
+    Слой positions принимает ?route_id= и ?from=/?to= (ISO 8601); на мелких масштабах
+    он строится по почасовым агрегатам, и интервал учитывается с точностью до часа.
+    """
+    def get(self, request, layer, z, x, y):
+        params = {}
+        if layer == 'positions':
+            route_id = request.GET.get('route_id')
+            if route_id and not route_id.isdigit():
+                return HttpResponseBadRequest("Некорректное значение параметра 'route_id'.")
+            params['route_id'] = int(route_id) if route_id else None
+            for name in ('from', 'to'):
+                value = request.GET.get(name)
+                moment = parse_time_param(value)
+                if value and moment is None:
+                    return HttpResponseBadRequest(f"Некорректное значение параметра '{name}'.")
+                params[name] = moment
+        try:
+            tile, cached = get_tile(layer, z, x, y, params)
+        except TileNotFound:
+            raise Http404("Тайл не найден.")
+        response = HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
+        response['X-Tile-Cache'] = 'hit' if cached else 'miss'
+        return response